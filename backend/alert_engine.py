@@ -0,0 +1,213 @@
+"""
+Stateful threshold alerts with debounce, hysteresis and deduplication
+
+Each rule (temperature, humidity, pH) is either closed or open. A rule opens
+once `debounce` consecutive readings are out of range, which inserts one
+ACTIVE alerts row. While it stays open, further out-of-range readings only
+raise the row's occurrence count and last_seen; that update is written at
+most once per `repeat_seconds`, so a night of pH drift is one row instead
+of thousands. The rule closes (the row becomes RESOLVED) once `debounce`
+consecutive readings are back inside the range by at least the rule's
+hysteresis, so a value hovering on the threshold does not flap.
+
+States are immutable and replaced per batch only after its transaction
+commits, so a retried batch never counts a reading twice. Active alerts are
+answered from memory and restored from the ACTIVE rows at startup.
+"""
+
+import threading
+from collections import namedtuple
+
+# field: reading key; min_setting / max_setting: ControlSettings fields
+AlertRule = namedtuple('AlertRule', 'alert_type field label unit min_setting max_setting hysteresis severity')
+
+THRESHOLD_RULES = [
+    AlertRule('TEMPERATURE', 'temperature', 'Temperature', '°C',
+              'temp_threshold_min', 'temp_threshold_max', 0.5, 'WARNING'),
+    AlertRule('HUMIDITY', 'humidity', 'Humidity', '%',
+              'humidity_threshold_min', 'humidity_threshold_max', 2.0, 'WARNING'),
+    AlertRule('PH', 'ph', 'pH', '',
+              'ph_threshold_min', 'ph_threshold_max', 0.1, 'CRITICAL'),
+]
+
+# streak counts consecutive readings towards the next transition (into
+# `condition` while closed, back inside the band while open)
+AlertState = namedtuple(
+    'AlertState', 'alert_id condition streak opened_at message occurrences last_seen last_value persisted_at'
+)
+
+CLOSED = AlertState(None, None, 0, None, None, 0, None, None, None)
+
+# Added to the alerts table by the backend migrations
+ALERT_STATE_COLUMNS = [
+    "ALTER TABLE alerts ADD COLUMN condition TEXT",
+    "ALTER TABLE alerts ADD COLUMN status TEXT NOT NULL DEFAULT 'RESOLVED'",
+    "ALTER TABLE alerts ADD COLUMN occurrences INTEGER NOT NULL DEFAULT 1",
+    "ALTER TABLE alerts ADD COLUMN last_seen DATETIME",
+    "ALTER TABLE alerts ADD COLUMN last_value REAL",
+    "ALTER TABLE alerts ADD COLUMN resolved_at DATETIME",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_status ON alerts (status)",
+    "CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts (timestamp)",
+]
+
+
+def alert_message(rule, condition, value):
+    return f"{rule.label} too {'low' if condition == 'LOW' else 'high'}: {value}{rule.unit}"
+
+
+class AlertEngine:
+    """Per-rule open/closed alert states, persisted as transitions"""
+
+    def __init__(self, rules=THRESHOLD_RULES, debounce=2, repeat_seconds=300,
+                 timestamp_format='%Y-%m-%d %H:%M:%S'):
+        self.rules = {rule.alert_type: rule for rule in rules}
+        self.debounce = max(1, debounce)
+        self.repeat_seconds = repeat_seconds
+        self.timestamp_format = timestamp_format
+        self._states = {alert_type: CLOSED for alert_type in self.rules}
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._resolved = 0
+        self._folded = 0
+        self._row_writes = 0
+
+    def load(self, pool):
+        """Restore open alerts from the ACTIVE rows, returning how many were restored"""
+        rows = pool.query('''
+            SELECT id, alert_type, condition, timestamp, message, occurrences, last_seen, last_value
+            FROM alerts
+            WHERE status = 'ACTIVE'
+            ORDER BY id
+        ''')
+        states = dict(self._states)
+        for alert_id, alert_type, condition, opened_at, message, occurrences, last_seen, last_value in rows:
+            if alert_type in states:
+                # The newest ACTIVE row of a type wins
+                states[alert_type] = AlertState(alert_id, condition, 0, opened_at, message, occurrences,
+                                                last_seen, last_value, None)
+        with self._lock:
+            self._states = states
+        return sum(1 for state in states.values() if state.alert_id is not None)
+
+    def _format(self, moment):
+        return moment.strftime(self.timestamp_format)
+
+    def _step(self, pool, rule, state, value, settings, moment):
+        """Next state of one rule for one reading, writing its transition if any"""
+        low, high = getattr(settings, rule.min_setting), getattr(settings, rule.max_setting)
+        if low is None or high is None:
+            return state
+        breach = 'LOW' if value < low else 'HIGH' if value > high else None
+        timestamp = self._format(moment)
+
+        if state.alert_id is None:
+            if breach is None:
+                return CLOSED
+            streak = state.streak + 1 if breach == state.condition else 1
+            opened_at = state.opened_at if breach == state.condition else timestamp
+            if streak < self.debounce:
+                return CLOSED._replace(condition=breach, streak=streak, opened_at=opened_at)
+            message = alert_message(rule, breach, value)
+            cursor = pool.execute('''
+                INSERT INTO alerts
+                (timestamp, alert_type, message, severity, condition, status, occurrences, last_seen, last_value)
+                VALUES (?, ?, ?, ?, ?, 'ACTIVE', ?, ?, ?)
+            ''', (opened_at, rule.alert_type, message, rule.severity, breach, streak, timestamp, value))
+            self._row_writes += 1
+            self._opened += 1
+            return AlertState(cursor.lastrowid, breach, 0, opened_at, message, streak, timestamp, value, moment)
+
+        if breach == state.condition:
+            state = state._replace(streak=0, occurrences=state.occurrences + 1, last_seen=timestamp,
+                                   last_value=value)
+            self._folded += 1
+            if state.persisted_at is None or (moment - state.persisted_at).total_seconds() >= self.repeat_seconds:
+                pool.execute('UPDATE alerts SET occurrences = ?, last_seen = ?, last_value = ? WHERE id = ?',
+                             (state.occurrences, timestamp, value, state.alert_id))
+                self._row_writes += 1
+                state = state._replace(persisted_at=moment)
+            return state
+
+        if state.condition == 'LOW':
+            cleared = value >= low + rule.hysteresis
+        else:
+            cleared = value <= high - rule.hysteresis
+        if breach is None and not cleared:
+            # Inside the range but within the hysteresis band: still open
+            return state._replace(streak=0)
+        if breach is None and state.streak + 1 < self.debounce:
+            return state._replace(streak=state.streak + 1)
+
+        # Back in range for long enough, or straight across to the other side
+        pool.execute('''
+            UPDATE alerts SET status = 'RESOLVED', resolved_at = ?, occurrences = ?, last_seen = ?, last_value = ?
+            WHERE id = ?
+        ''', (timestamp, state.occurrences, state.last_seen, state.last_value, state.alert_id))
+        self._row_writes += 1
+        self._resolved += 1
+        if breach is None:
+            return CLOSED
+        return self._step(pool, rule, CLOSED, value, settings, moment)
+
+    def process(self, pool, batch):
+        """Evaluate a batch of (received_at, reading, settings) in one transaction
+
+        Returns the number of alert rows inserted or updated.
+        """
+        states = dict(self._states)
+        counters = (self._opened, self._resolved, self._folded, self._row_writes)
+        try:
+            with pool.transaction():
+                for moment, reading, settings in batch:
+                    if settings is None:
+                        continue
+                    for alert_type, rule in self.rules.items():
+                        value = reading.get(rule.field)
+                        if not isinstance(value, (int, float)):
+                            continue
+                        states[alert_type] = self._step(pool, rule, states[alert_type], value, settings, moment)
+        except BaseException:
+            # The rows were rolled back, so the batch must be counted again on retry
+            self._opened, self._resolved, self._folded, self._row_writes = counters
+            raise
+        with self._lock:
+            self._states = states
+        return self._row_writes - counters[3]
+
+    def active(self):
+        """Open alerts, newest first, in the shape of alerts rows"""
+        alerts = []
+        for alert_type, state in self._states.items():
+            if state.alert_id is None:
+                continue
+            rule = self.rules[alert_type]
+            alerts.append({
+                'id': state.alert_id,
+                'timestamp': state.opened_at,
+                'alert_type': alert_type,
+                'message': state.message,
+                'severity': rule.severity,
+                'condition': state.condition,
+                'status': 'ACTIVE',
+                'occurrences': state.occurrences,
+                'last_seen': state.last_seen,
+                'last_value': state.last_value,
+                'resolved_at': None
+            })
+        alerts.sort(key=lambda alert: alert['id'], reverse=True)
+        return alerts
+
+    def stats(self):
+        states = self._states
+        return {
+            'active': sum(1 for state in states.values() if state.alert_id is not None),
+            'debounce': self.debounce,
+            'repeat_seconds': self.repeat_seconds,
+            'opened': self._opened,
+            'resolved': self._resolved,
+            'occurrences_folded': self._folded,
+            'row_writes': self._row_writes
+        }
+
+
+__all__ = ['AlertEngine', 'AlertRule', 'AlertState', 'THRESHOLD_RULES', 'ALERT_STATE_COLUMNS', 'alert_message']
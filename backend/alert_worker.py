@@ -0,0 +1,63 @@
+"""
+Background rule evaluation for ingested readings
+
+Ingest stores a reading, hands it to AlertWorker.submit() and answers the
+device straight away. AlertWorker is a BatchWorker (see sqlite_pool): its
+thread collects queued readings into batches (up to batch_size, or whatever
+arrived within flush_interval_ms of the first one) and passes each batch to
+process(batch), which evaluates it and writes its alerts in one transaction
+(see AlertEngine.process). A batch whose transaction hits lock contention is
+retried; process must therefore leave no trace of a failed attempt.
+
+Lag is measured from submit() to the commit of the batch that evaluated the
+reading. The queue is bounded: when it is full, submit() returns False and
+the reading is counted as dropped (it is already stored, only its rule
+evaluation is skipped).
+"""
+
+from sqlite_pool import BatchWorker
+
+
+class AlertWorker(BatchWorker):
+    """Bounded queue of readings evaluated into alerts by one background thread"""
+
+    def __init__(self, process, max_queue=5000, batch_size=200, flush_interval_ms=100,
+                 max_retries=3, name='alert-worker'):
+        super().__init__(max_queue, batch_size, flush_interval_ms, max_retries, name)
+        self.process = process
+        self._alerts = 0
+
+    def _handle(self, readings):
+        return self.process(readings)
+
+    def _committed(self, readings, written):
+        with self._stats_lock:
+            self._alerts += written
+
+    def stats(self):
+        """Queue depth, lag and throughput counters"""
+        with self._stats_lock:
+            counters = self._counters()
+            alerts = self._alerts
+        return {
+            'running': counters['running'],
+            'queue_depth': counters['queue_depth'],
+            'queue_capacity': counters['queue_capacity'],
+            'batch_size': self.batch_size,
+            'flush_interval_ms': counters['flush_interval_ms'],
+            'readings_submitted': counters['submitted'],
+            'readings_evaluated': counters['done'],
+            'readings_dropped': counters['dropped'],
+            'readings_failed': counters['failed'],
+            'alerts_written': alerts,
+            'batches': counters['batches'],
+            'avg_batch_size': counters['avg_batch_size'],
+            'last_batch_ms': counters['last_batch_ms'],
+            'last_lag_ms': counters['last_lag_ms'],
+            'avg_lag_ms': counters['avg_lag_ms'],
+            'max_lag_ms': counters['max_lag_ms'],
+            'last_batch_at': counters['last_batch_at']
+        }
+
+
+__all__ = ['AlertWorker']
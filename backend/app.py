@@ -1,23 +1,59 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+import atexit
 import json
 import os
 from typing import Dict, List
-import sqlite3
 import threading
 import time
 
+from sqlite_pool import SQLitePool, apply_migrations
+from pagination import SEEK_BEFORE_SQL, decode_cursor, split_page
+from segment_archive import SegmentArchive, RetentionJob, read_archived_rows, merge_newest
+from http_cache import VersionCounter, ResponseCompressor, make_etag, conditional_response
+from control_settings import ControlSettingsStore
+from alert_worker import AlertWorker
+from alert_engine import AlertEngine, ALERT_STATE_COLUMNS
+
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
+
+# gzip/brotli for large JSON bodies, negotiated per request
+compressor = ResponseCompressor(min_size=int(os.getenv('TERRAPONIX_COMPRESS_MIN_BYTES', 1024))).init_app(app)
+
+# Change counters behind the ETags of /api/historical-data and /api/controls
+sensor_data_version = VersionCounter()
+settings_version = VersionCounter()
+
+# Relative ranges (?hours=) slide with the clock, so their tags also expire
+HISTORY_ETAG_SECONDS = int(os.getenv('TERRAPONIX_HISTORY_ETAG_SECONDS', 60))
+
+# Shared per-thread connection pool for the backend database
+db = SQLitePool('terraponix.db')
+
+# Schema changes on top of the base tables, as (version, description,
+# statements); the applied version is kept in PRAGMA user_version
+BACKEND_MIGRATIONS = [
+    (1, 'alert states', ALERT_STATE_COLUMNS),
+    # History queries (and their cursor pages) seek on timestamp. Databases
+    # created before the migrations may already have it, hence IF NOT EXISTS.
+    (2, 'sensor_data timestamp index', [
+        'CREATE INDEX IF NOT EXISTS idx_sensor_data_timestamp ON sensor_data (timestamp)',
+    ]),
+]
 
 # Database initialization
 def init_db():
-    conn = sqlite3.connect('terraponix.db')
-    cursor = conn.cursor()
-    
+    with db.transaction():
+        _create_tables()
+    applied = apply_migrations(db, BACKEND_MIGRATIONS)
+    if applied:
+        print(f"🗄️ terraponix.db migrated to schema version {applied[-1]}")
+
+def _create_tables():
     # Sensor data table
-    cursor.execute('''
+    db.execute('''
         CREATE TABLE IF NOT EXISTS sensor_data (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -33,7 +69,7 @@ def init_db():
     ''')
     
     # Control settings table
-    cursor.execute('''
+    db.execute('''
         CREATE TABLE IF NOT EXISTS control_settings (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             pump_auto BOOLEAN DEFAULT TRUE,
@@ -53,7 +89,7 @@ def init_db():
     ''')
     
     # Alert logs table
-    cursor.execute('''
+    db.execute('''
         CREATE TABLE IF NOT EXISTS alerts (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -64,15 +100,33 @@ def init_db():
     ''')
     
     # Insert default control settings if not exists
-    cursor.execute('SELECT COUNT(*) FROM control_settings')
-    if cursor.fetchone()[0] == 0:
-        cursor.execute('''
+    if db.execute('SELECT COUNT(*) FROM control_settings').fetchone()[0] == 0:
+        db.execute('''
             INSERT INTO control_settings (pump_auto, fan_auto, curtain_auto)
             VALUES (TRUE, TRUE, TRUE)
         ''')
-    
-    conn.commit()
-    conn.close()
+
+# sensor_data.timestamp is SQLite's CURRENT_TIMESTAMP: UTC, 'YYYY-MM-DD HH:MM:SS'
+SQLITE_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def utc_now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# Retention: sensor rows older than TERRAPONIX_RETENTION_DAYS are moved to
+# compressed per-day segment files and still served by /api/historical-data
+archive = SegmentArchive(os.getenv('TERRAPONIX_ARCHIVE_DIR', os.path.join('archive', 'sensor_data')))
+
+retention = RetentionJob(
+    db,
+    archive,
+    'sensor_data',
+    retain_days=float(os.getenv('TERRAPONIX_RETENTION_DAYS', 30)),
+    chunk_rows=int(os.getenv('TERRAPONIX_RETENTION_CHUNK_ROWS', 500)),
+    interval_seconds=float(os.getenv('TERRAPONIX_RETENTION_INTERVAL', 3600)),
+    clock=utc_now,
+    timestamp_format=SQLITE_TIMESTAMP_FORMAT,
+    name='sensor-data-retention'
+)
 
 # Global variables for real-time data
 current_sensor_data = {}
@@ -86,6 +140,29 @@ device_status = {
 # Initialize database
 init_db()
 
+# Latest control settings, read once here and updated write-through by POST /api/controls
+control_settings = ControlSettingsStore(db)
+control_settings.load()
+
+# Open/closed state per threshold rule: only transitions and occurrence
+# counts are written to alerts, active alerts are served from memory
+alert_engine = AlertEngine(
+    debounce=int(os.getenv('TERRAPONIX_ALERT_DEBOUNCE', 2)),
+    repeat_seconds=float(os.getenv('TERRAPONIX_ALERT_REPEAT_SECONDS', 300)),
+    timestamp_format=SQLITE_TIMESTAMP_FORMAT
+)
+alert_engine.load(db)
+
+# Threshold checks run off the request thread: ingest queues each stored
+# reading and a worker evaluates them in batches, one transaction per batch
+alert_worker = AlertWorker(
+    lambda batch: alert_engine.process(db, batch),
+    max_queue=int(os.getenv('TERRAPONIX_ALERT_QUEUE_SIZE', 5000)),
+    batch_size=int(os.getenv('TERRAPONIX_ALERT_BATCH_SIZE', 200)),
+    flush_interval_ms=int(os.getenv('TERRAPONIX_ALERT_FLUSH_INTERVAL_MS', 100)),
+    name='alert-worker'
+)
+
 @app.route('/api/sensor-data', methods=['POST'])
 def receive_sensor_data():
     """Endpoint to receive sensor data from ESP32"""
@@ -99,23 +176,21 @@ def receive_sensor_data():
                 return jsonify({'error': f'Missing required field: {field}'}), 400
         
         # Store in database
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO sensor_data (temperature, humidity, ph, tds, light_intensity, co2, soil_moisture, water_level)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['temperature'],
-            data['humidity'],
-            data['ph'],
-            data['tds'],
-            data['light_intensity'],
-            data['co2'],
-            data.get('soil_moisture', 0),
-            data.get('water_level', 0)
-        ))
-        conn.commit()
-        conn.close()
+        with db.transaction():
+            db.execute('''
+                INSERT INTO sensor_data (temperature, humidity, ph, tds, light_intensity, co2, soil_moisture, water_level)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                data['temperature'],
+                data['humidity'],
+                data['ph'],
+                data['tds'],
+                data['light_intensity'],
+                data['co2'],
+                data.get('soil_moisture', 0),
+                data.get('water_level', 0)
+            ))
+        sensor_data_version.bump()
         
         # Update global current data
         global current_sensor_data, device_status
@@ -125,8 +200,9 @@ def receive_sensor_data():
         device_status['battery_level'] = data.get('battery_level', 100)
         device_status['solar_power'] = data.get('solar_power', 0)
         
-        # Check thresholds and generate alerts
-        check_thresholds(data)
+        # Check thresholds and generate alerts in the background, against
+        # the settings in force now
+        alert_worker.submit((utc_now(), data, control_settings.get()))
         
         return jsonify({'status': 'success', 'message': 'Data received successfully'})
     
@@ -144,27 +220,54 @@ def get_current_data():
 
 @app.route('/api/historical-data', methods=['GET'])
 def get_historical_data():
-    """Get historical sensor data"""
+    """Get historical sensor data
+
+    The body stays a plain array; when more rows follow, the X-Next-Cursor
+    header carries the ?cursor= value for the next page.
+    """
+    etag = make_etag('history', sensor_data_version.get(), sorted(request.args.items(multi=True)),
+                     int(time.time() // HISTORY_ETAG_SECONDS))
+    return conditional_response(etag, build_historical_data)
+
+def build_historical_data():
+    """Historical data response for the current request"""
     try:
         hours = request.args.get('hours', 24, type=int)
         limit = request.args.get('limit', 100, type=int)
         
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
+        seek_sql, seek_params = '', ()
+        if request.args.get('cursor'):
+            try:
+                seek_params = decode_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            seek_sql = f'AND {SEEK_BEFORE_SQL}'
+        
+        since = (utc_now() - timedelta(hours=hours)).strftime(SQLITE_TIMESTAMP_FORMAT)
         
-        cursor.execute('''
+        # One extra row tells whether another page follows
+        fetch = limit + 1 if limit >= 0 else limit
+        cursor = db.execute('''
             SELECT * FROM sensor_data 
-            WHERE timestamp >= datetime('now', '-{} hours')
-            ORDER BY timestamp DESC
+            WHERE timestamp >= ? {}
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
-        '''.format(hours), (limit,))
+        '''.format(seek_sql), (since, *seek_params, fetch))
         
         columns = [description[0] for description in cursor.description]
-        results = [dict(zip(columns, row)) for row in cursor.fetchall()]
-        
-        conn.close()
-        
-        return jsonify(results)
+        rows = cursor.fetchall()
+        if limit < 0 or len(rows) < fetch:
+            # The hot table ran out inside the range: continue in the archive
+            archived = read_archived_rows(archive, None, since, fetch, before=seek_params or None,
+                                          since_inclusive=True)
+            rows = merge_newest(rows, archived, fetch)
+        rows, next_cursor = split_page(rows, limit, timestamp_index=columns.index('timestamp'))
+        results = [dict(zip(columns, row)) for row in rows]
+        
+        response = jsonify(results)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -172,24 +275,11 @@ def get_historical_data():
 @app.route('/api/controls', methods=['GET'])
 def get_controls():
     """Get current control settings"""
-    try:
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM control_settings ORDER BY id DESC LIMIT 1')
-        
-        columns = [description[0] for description in cursor.description]
-        result = cursor.fetchone()
-        
-        if result:
-            controls = dict(zip(columns, result))
-        else:
-            controls = {}
-        
-        conn.close()
-        return jsonify(controls)
-    
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return conditional_response(make_etag('controls', settings_version.get()), build_controls)
+
+def build_controls():
+    """Control settings response"""
+    return jsonify(control_settings.as_dict())
 
 @app.route('/api/controls', methods=['POST'])
 def update_controls():
@@ -197,43 +287,9 @@ def update_controls():
     try:
         data = request.get_json()
         
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
-        
-        # Update control settings
-        cursor.execute('''
-            UPDATE control_settings SET
-                pump_auto = ?,
-                fan_auto = ?,
-                curtain_auto = ?,
-                pump_status = ?,
-                fan_status = ?,
-                curtain_status = ?,
-                temp_threshold_min = ?,
-                temp_threshold_max = ?,
-                humidity_threshold_min = ?,
-                humidity_threshold_max = ?,
-                ph_threshold_min = ?,
-                ph_threshold_max = ?,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE id = (SELECT MAX(id) FROM control_settings)
-        ''', (
-            data.get('pump_auto', True),
-            data.get('fan_auto', True),
-            data.get('curtain_auto', True),
-            data.get('pump_status', False),
-            data.get('fan_status', False),
-            data.get('curtain_status', False),
-            data.get('temp_threshold_min', 20.0),
-            data.get('temp_threshold_max', 30.0),
-            data.get('humidity_threshold_min', 60.0),
-            data.get('humidity_threshold_max', 80.0),
-            data.get('ph_threshold_min', 5.5),
-            data.get('ph_threshold_max', 6.5)
-        ))
-        
-        conn.commit()
-        conn.close()
+        # Update control settings (database and the in-memory copy)
+        control_settings.update(data)
+        settings_version.bump()
         
         return jsonify({'status': 'success', 'message': 'Controls updated successfully'})
     
@@ -246,10 +302,7 @@ def get_alerts():
     try:
         limit = request.args.get('limit', 50, type=int)
         
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        cursor = db.execute('''
             SELECT * FROM alerts 
             ORDER BY timestamp DESC
             LIMIT ?
@@ -258,61 +311,15 @@ def get_alerts():
         columns = [description[0] for description in cursor.description]
         results = [dict(zip(columns, row)) for row in cursor.fetchall()]
         
-        conn.close()
-        
         return jsonify(results)
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def check_thresholds(sensor_data):
-    """Check sensor data against thresholds and generate alerts"""
-    try:
-        conn = sqlite3.connect('terraponix.db')
-        cursor = conn.cursor()
-        
-        # Get current thresholds
-        cursor.execute('SELECT * FROM control_settings ORDER BY id DESC LIMIT 1')
-        settings = cursor.fetchone()
-        
-        if not settings:
-            return
-        
-        alerts = []
-        
-        # Temperature check
-        temp = sensor_data.get('temperature', 0)
-        if temp < settings[7]:  # temp_threshold_min
-            alerts.append(('TEMPERATURE', f'Temperature too low: {temp}°C', 'WARNING'))
-        elif temp > settings[8]:  # temp_threshold_max
-            alerts.append(('TEMPERATURE', f'Temperature too high: {temp}°C', 'WARNING'))
-        
-        # Humidity check
-        humidity = sensor_data.get('humidity', 0)
-        if humidity < settings[9]:  # humidity_threshold_min
-            alerts.append(('HUMIDITY', f'Humidity too low: {humidity}%', 'WARNING'))
-        elif humidity > settings[10]:  # humidity_threshold_max
-            alerts.append(('HUMIDITY', f'Humidity too high: {humidity}%', 'WARNING'))
-        
-        # pH check
-        ph = sensor_data.get('ph', 0)
-        if ph < settings[11]:  # ph_threshold_min
-            alerts.append(('PH', f'pH too low: {ph}', 'CRITICAL'))
-        elif ph > settings[12]:  # ph_threshold_max
-            alerts.append(('PH', f'pH too high: {ph}', 'CRITICAL'))
-        
-        # Insert alerts
-        for alert_type, message, severity in alerts:
-            cursor.execute('''
-                INSERT INTO alerts (alert_type, message, severity)
-                VALUES (?, ?, ?)
-            ''', (alert_type, message, severity))
-        
-        conn.commit()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error checking thresholds: {e}")
+@app.route('/api/alerts/active', methods=['GET'])
+def get_active_alerts():
+    """Currently open alerts, from memory (occurrence counts are up to date)"""
+    return jsonify(alert_engine.active())
 
 @app.route('/api/device-command', methods=['POST'])
 def send_device_command():
@@ -350,10 +357,34 @@ def check_device_connectivity():
         
         time.sleep(60)  # Check every minute
 
-# Start background thread
-connectivity_thread = threading.Thread(target=check_device_connectivity)
-connectivity_thread.daemon = True
-connectivity_thread.start()
+connectivity_thread = None
+
+def start_background_tasks():
+    """Start the retention, alert and connectivity threads of this process
+
+    Runs at import unless TERRAPONIX_DEFER_BACKGROUND_TASKS=1, in which case
+    run_server.py calls it once per worker after the fork.
+    """
+    global connectivity_thread
+    retention.start()
+    alert_worker.start()
+    if connectivity_thread is None or not connectivity_thread.is_alive():
+        connectivity_thread = threading.Thread(target=check_device_connectivity)
+        connectivity_thread.daemon = True
+        connectivity_thread.start()
+
+def stop_background_tasks():
+    """Evaluate queued readings and stop the retention and alert threads
+
+    The connectivity check is a daemon and simply ends with the process.
+    """
+    alert_worker.stop()
+    retention.stop()
+
+# Start background threads
+if os.getenv('TERRAPONIX_DEFER_BACKGROUND_TASKS') != '1':
+    start_background_tasks()
+atexit.register(stop_background_tasks)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -364,8 +395,23 @@ def health_check():
         'version': '1.0.0'
     })
 
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    """SQLite connection pool and statement cache statistics"""
+    return jsonify({
+        'status': 'success',
+        'timestamp': datetime.now().isoformat(),
+        'database': db.stats(),
+        'retention': dict(retention.stats(), archive=archive.stats()),
+        'control_settings': control_settings.stats(),
+        'alert_worker': alert_worker.stats(),
+        'alerts': alert_engine.stats(),
+        'http': compressor.stats()
+    })
+
 if __name__ == '__main__':
     print("🌱 Terraponix Backend Server Starting...")
     print("📊 Dashboard will be available at: http://localhost:5000")
     print("🔌 ESP32 can send data to: http://localhost:5000/api/sensor-data")
+    print("💡 Production: python run_server.py --app backend")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -9,13 +9,40 @@ import time
 
 # Import XAMPP MySQL configuration
 from xampp_mysql_config import SensorDataDB, ControlDB, DeviceDB, initialize_database, test_connection
+from http_cache import VersionCounter, ResponseCompressor, make_etag, conditional_response
+from latest_readings import LatestReadingCache, reading_from_row
+from control_state import ControlState
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['ETag'])
+
+# gzip/brotli for large JSON bodies, negotiated per request
+compressor = ResponseCompressor(min_size=int(os.getenv('TERRAPONIX_COMPRESS_MIN_BYTES', 1024))).init_app(app)
+
+# Bumped on every control settings change made through this server; behind
+# the ETags of /api/controls and /api/esp32-config
+settings_version = VersionCounter()
+
+# Outputs the ESP32 polls from /api/esp32-config, with their defaults
+ESP32_CONFIG_FIELDS = {
+    'pump_status': False,
+    'fan_status': False,
+    'curtain_status': False,
+    'pump_auto': True,
+    'fan_auto': True,
+    'curtain_auto': True
+}
+
+# Newest reading of each device, filled by ingest and warmed at startup
+latest_readings = LatestReadingCache()
+
+# sensor_data columns a reading is stored with
+READING_FIELDS = ('temperature', 'humidity', 'ph', 'tds', 'light_intensity', 'co2',
+                  'soil_moisture', 'water_level')
 
 # Global variables for sensor data and control settings
 current_sensor_data = {}
-control_settings = {
+control_settings = ControlState({
     'pump_auto': True,
     'fan_auto': True,
     'curtain_auto': True,
@@ -33,7 +60,7 @@ control_settings = {
     'soil_moisture_threshold_min': 40.0,
     'soil_moisture_threshold_max': 70.0,
     'water_level_threshold_min': 20.0
-}
+}, settings_version)
 
 def init_db():
     """Initialize MySQL database with XAMPP"""
@@ -59,28 +86,48 @@ def init_db():
 
 def load_control_settings():
     """Load control settings from MySQL database"""
-    global control_settings
     try:
         settings = ControlDB.get_control_settings(device_id=1)
         if settings:
-            # Remove database-specific fields
-            settings.pop('id', None)
-            settings.pop('device_id', None)
-            settings.pop('updated_at', None)
-            control_settings.update(settings)
+            # Database-specific fields (id, device_id, updated_at) are not settings
+            control_settings.load(settings)
             print("✅ Control settings loaded from MySQL")
         else:
             print("ℹ️ Using default control settings")
     except Exception as e:
         print(f"⚠️ Error loading control settings: {e}")
 
+def warm_latest_readings():
+    """Cache the newest stored reading of every device"""
+    rows = SensorDataDB.get_latest_per_device()
+    if rows is None:
+        print("⚠️ Could not warm the latest-reading cache, readings will be fetched on demand")
+        return
+    print(f"✅ Latest readings cached for {latest_readings.warm(rows)} device(s)")
+
+def latest_reading(device_id):
+    """Newest reading of a device from the cache, asking MySQL only on a miss"""
+    reading = latest_readings.get(device_id)
+    if reading is not None:
+        return reading
+    row = SensorDataDB.get_latest_data(device_id=device_id)
+    if not row:
+        return None
+    reading = reading_from_row(row)
+    latest_readings.put(device_id, row.get('id'), reading)
+    return reading
+
 def save_control_settings():
-    """Save control settings to MySQL database"""
+    """Save the current control settings to MySQL, True on success"""
     try:
-        ControlDB.update_control_settings(device_id=1, settings=control_settings)
-        print("✅ Control settings saved to MySQL")
+        def write(settings):
+            return ControlDB.update_control_settings(device_id=1, settings=settings)
+        if control_settings.persist(write):
+            print("✅ Control settings saved to MySQL")
+            return True
     except Exception as e:
         print(f"⚠️ Error saving control settings: {e}")
+    return False
 
 @app.route('/api/sensor-data', methods=['POST'])
 def receive_sensor_data():
@@ -106,6 +153,10 @@ def receive_sensor_data():
                 data.get('solar_power')
             )
             
+            reading = {field: data.get(field) for field in READING_FIELDS}
+            reading['timestamp'] = datetime.now().replace(microsecond=0).isoformat()
+            latest_readings.put(device_id, sensor_id, reading)
+            
             print(f"✅ Sensor data saved to MySQL with ID: {sensor_id}")
             
             # Check and handle automatic controls
@@ -131,21 +182,12 @@ def receive_sensor_data():
 
 @app.route('/api/sensor-data', methods=['GET'])
 def get_current_data():
-    """Get current sensor data"""
+    """Get current sensor data (from the latest-reading cache, MySQL on a miss)"""
     try:
-        # Try to get latest data from MySQL
-        latest_data = SensorDataDB.get_latest_data(device_id=1)
+        device_id = request.args.get('device_id', 1, type=int)
+        latest_data = latest_reading(device_id)
         
         if latest_data:
-            # Remove database-specific fields
-            latest_data.pop('id', None)
-            latest_data.pop('device_id', None)
-            
-            # Convert timestamp to string if exists
-            if 'timestamp' in latest_data and latest_data['timestamp']:
-                if hasattr(latest_data['timestamp'], 'isoformat'):
-                    latest_data['timestamp'] = latest_data['timestamp'].isoformat()
-            
             return jsonify(latest_data)
         else:
             # Fallback to in-memory data
@@ -186,54 +228,33 @@ def get_historical_data():
 
 @app.route('/api/controls', methods=['GET'])
 def get_controls():
-    """Get current control settings"""
-    try:
-        # Try to get latest settings from MySQL
-        db_settings = ControlDB.get_control_settings(device_id=1)
-        
-        if db_settings:
-            # Remove database-specific fields
-            db_settings.pop('id', None)
-            db_settings.pop('device_id', None)
-            db_settings.pop('updated_at', None)
-            return jsonify(db_settings)
-        else:
-            # Fallback to in-memory settings
-            return jsonify(control_settings)
-            
-    except Exception as e:
-        print(f"❌ Error getting control settings: {str(e)}")
-        # Fallback to in-memory settings
-        return jsonify(control_settings)
+    """Get current control settings from memory (ETag-tagged; unchanged polls get 304)"""
+    version, settings = control_settings.snapshot()
+    return conditional_response(make_etag('controls', version), lambda: jsonify(settings))
 
 @app.route('/api/controls', methods=['POST'])
 def update_controls():
-    """Update control settings"""
-    global control_settings
-    
+    """Update control settings (unknown keys are ignored)"""
     try:
         data = request.get_json()
         print(f"🎛️ Updating controls: {data}")
         
-        # Update in-memory settings
+        # Update in-memory settings, then save them to MySQL
         control_settings.update(data)
-        
-        # Save to MySQL database
-        success = ControlDB.update_control_settings(device_id=1, settings=data)
+        success = save_control_settings()
         
         if success:
-            print("✅ Control settings updated in MySQL")
             return jsonify({
                 'status': 'success',
                 'message': 'Control settings updated in MySQL',
-                'settings': control_settings
+                'settings': control_settings.snapshot()[1]
             })
         else:
             print("⚠️ Failed to update MySQL, using in-memory settings")
             return jsonify({
                 'status': 'warning',
                 'message': 'Settings updated locally, MySQL update failed',
-                'settings': control_settings
+                'settings': control_settings.snapshot()[1]
             })
             
     except Exception as e:
@@ -245,41 +266,22 @@ def update_controls():
 
 @app.route('/api/esp32-config', methods=['GET'])
 def get_esp32_config():
-    """Get ESP32 configuration (control outputs)"""
-    try:
-        db_settings = ControlDB.get_control_settings(device_id=1)
-        
-        if db_settings:
-            esp32_config = {
-                'pump_status': db_settings.get('pump_status', False),
-                'fan_status': db_settings.get('fan_status', False),
-                'curtain_status': db_settings.get('curtain_status', False),
-                'pump_auto': db_settings.get('pump_auto', True),
-                'fan_auto': db_settings.get('fan_auto', True),
-                'curtain_auto': db_settings.get('curtain_auto', True)
-            }
-        else:
-            esp32_config = {
-                'pump_status': control_settings.get('pump_status', False),
-                'fan_status': control_settings.get('fan_status', False),
-                'curtain_status': control_settings.get('curtain_status', False),
-                'pump_auto': control_settings.get('pump_auto', True),
-                'fan_auto': control_settings.get('fan_auto', True),
-                'curtain_auto': control_settings.get('curtain_auto', True)
-            }
-        
-        return jsonify(esp32_config)
-        
-    except Exception as e:
-        print(f"❌ Error getting ESP32 config: {str(e)}")
-        return jsonify({
-            'pump_status': False,
-            'fan_status': False,
-            'curtain_status': False,
-            'pump_auto': True,
-            'fan_auto': True,
-            'curtain_auto': True
-        })
+    """Get ESP32 configuration from memory
+
+    Tagged with the settings version, which the body also carries as
+    config_version: a poll sending it back as If-None-Match or ?since= gets
+    an empty 304 while the outputs are unchanged.
+    """
+    version, settings = control_settings.snapshot()
+    etag = make_etag('esp32-config', version)
+    return conditional_response(etag, lambda: build_esp32_config(settings, etag),
+                                since=request.args.get('since'))
+
+def build_esp32_config(settings, config_version):
+    """ESP32 configuration response (control outputs)"""
+    esp32_config = {field: settings.get(field, default) for field, default in ESP32_CONFIG_FIELDS.items()}
+    esp32_config['config_version'] = config_version
+    return jsonify(esp32_config)
 
 @app.route('/api/database-status', methods=['GET'])
 def get_database_status():
@@ -287,12 +289,14 @@ def get_database_status():
     try:
         if test_connection():
             # Get some basic stats
-            latest_data = SensorDataDB.get_latest_data(device_id=1)
+            latest_data = latest_reading(1)
             
             return jsonify({
                 'status': 'connected',
                 'database': 'MySQL (XAMPP)',
                 'last_reading': latest_data['timestamp'] if latest_data else None,
+                'latest_reading_cache': latest_readings.stats(),
+                'control_settings': control_settings.stats(),
                 'message': 'XAMPP MySQL connection active'
             })
         else:
@@ -311,62 +315,55 @@ def get_database_status():
 
 def handle_automatic_controls(sensor_data):
     """Handle automatic control logic based on sensor readings"""
-    global control_settings
-    
     try:
+        _, settings = control_settings.snapshot()
         temp = sensor_data.get('temperature')
         humidity = sensor_data.get('humidity')
         soil_moisture = sensor_data.get('soil_moisture')
         water_level = sensor_data.get('water_level')
         
-        settings_updated = False
+        changes = {}
         
         # Auto pump control based on soil moisture and water level
-        if control_settings.get('pump_auto', True):
+        if settings.get('pump_auto', True):
             if (soil_moisture is not None and 
-                soil_moisture < control_settings.get('soil_moisture_threshold_min', 40.0) and
+                soil_moisture < settings.get('soil_moisture_threshold_min', 40.0) and
                 water_level is not None and 
-                water_level > control_settings.get('water_level_threshold_min', 20.0)):
+                water_level > settings.get('water_level_threshold_min', 20.0)):
                 
-                if not control_settings.get('pump_status', False):
-                    control_settings['pump_status'] = True
-                    settings_updated = True
+                if not settings.get('pump_status', False):
+                    changes['pump_status'] = True
                     print("🚰 Auto: Pump turned ON (low soil moisture)")
             else:
-                if control_settings.get('pump_status', False):
-                    control_settings['pump_status'] = False
-                    settings_updated = True
+                if settings.get('pump_status', False):
+                    changes['pump_status'] = False
                     print("🚰 Auto: Pump turned OFF")
         
         # Auto fan control based on temperature
-        if control_settings.get('fan_auto', True) and temp is not None:
-            if temp > control_settings.get('temp_threshold_max', 30.0):
-                if not control_settings.get('fan_status', False):
-                    control_settings['fan_status'] = True
-                    settings_updated = True
+        if settings.get('fan_auto', True) and temp is not None:
+            if temp > settings.get('temp_threshold_max', 30.0):
+                if not settings.get('fan_status', False):
+                    changes['fan_status'] = True
                     print(f"🌪️ Auto: Fan turned ON (temp: {temp}°C)")
-            elif temp < control_settings.get('temp_threshold_min', 20.0):
-                if control_settings.get('fan_status', False):
-                    control_settings['fan_status'] = False
-                    settings_updated = True
+            elif temp < settings.get('temp_threshold_min', 20.0):
+                if settings.get('fan_status', False):
+                    changes['fan_status'] = False
                     print(f"🌪️ Auto: Fan turned OFF (temp: {temp}°C)")
         
         # Auto curtain control based on temperature
-        if control_settings.get('curtain_auto', True) and temp is not None:
-            if temp > control_settings.get('temp_threshold_max', 30.0):
-                if not control_settings.get('curtain_status', False):
-                    control_settings['curtain_status'] = True
-                    settings_updated = True
+        if settings.get('curtain_auto', True) and temp is not None:
+            if temp > settings.get('temp_threshold_max', 30.0):
+                if not settings.get('curtain_status', False):
+                    changes['curtain_status'] = True
                     print(f"🪟 Auto: Curtain CLOSED (temp: {temp}°C)")
-            elif temp < control_settings.get('temp_threshold_min', 20.0):
-                if control_settings.get('curtain_status', False):
-                    control_settings['curtain_status'] = False
-                    settings_updated = True
+            elif temp < settings.get('temp_threshold_min', 20.0):
+                if settings.get('curtain_status', False):
+                    changes['curtain_status'] = False
                     print(f"🪟 Auto: Curtain OPENED (temp: {temp}°C)")
         
-        # Save updated settings to MySQL if any changes were made
-        if settings_updated:
-            ControlDB.update_control_settings(device_id=1, settings=control_settings)
+        # Publish and save to MySQL if any output changed
+        if changes and control_settings.update(changes):
+            save_control_settings()
             
     except Exception as e:
         print(f"❌ Error in automatic controls: {str(e)}")
@@ -388,20 +385,38 @@ def database_monitor():
             print(f"❌ Database monitor error: {str(e)}")
             time.sleep(30)
 
+def startup():
+    """Connect to MySQL, load the control settings and warm the latest-reading
+    cache, False if MySQL is unreachable
+
+    Opens this process's connection pool, so run_server.py calls it in each
+    worker after the fork rather than once in the parent.
+    """
+    if not init_db():
+        return False
+    load_control_settings()
+    warm_latest_readings()
+    return True
+
+monitor_thread = None
+
+def start_background_tasks():
+    """Start the database monitor of this process (once per worker)"""
+    global monitor_thread
+    if monitor_thread is None or not monitor_thread.is_alive():
+        monitor_thread = threading.Thread(target=database_monitor, daemon=True)
+        monitor_thread.start()
+
 if __name__ == '__main__':
     print("🚀 Starting Terraponix Server with XAMPP MySQL...")
     
-    # Initialize database
-    if not init_db():
+    # Initialize database and load existing control settings
+    if not startup():
         print("❌ Failed to initialize database. Please check XAMPP MySQL is running.")
         exit(1)
     
-    # Load existing control settings
-    load_control_settings()
-    
     # Start database monitor in background
-    monitor_thread = threading.Thread(target=database_monitor, daemon=True)
-    monitor_thread.start()
+    start_background_tasks()
     
     print("✅ Server ready with XAMPP MySQL!")
     print("📊 Chart implementation using MySQL database")
@@ -409,5 +424,6 @@ if __name__ == '__main__':
     print("📱 ESP32 can send data to: http://localhost:5000/api/sensor-data")
     print("📈 Historical data API: http://localhost:5000/api/historical-data")
     print("💾 Database status: http://localhost:5000/api/database-status")
+    print("💡 Production: python run_server.py --app mysql")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,97 @@
+"""
+In-memory control settings for the SQLite backend
+
+The latest control_settings row is loaded once at startup into an immutable
+ControlSettings tuple with named fields. Readers (threshold checks on every
+ingest, GET /api/controls) take the current tuple without a query;
+ControlSettingsStore.update() writes through: the row is updated and re-read
+in one transaction and the new tuple replaces the old one atomically.
+
+Like the ETag counters, the copy is per process: a change written to the
+database by another process is picked up by load() or a restart.
+"""
+
+import threading
+from collections import namedtuple
+
+# Columns of control_settings and the defaults POST /api/controls falls back to
+CONTROL_DEFAULTS = {
+    'pump_auto': True,
+    'fan_auto': True,
+    'curtain_auto': True,
+    'pump_status': False,
+    'fan_status': False,
+    'curtain_status': False,
+    'temp_threshold_min': 20.0,
+    'temp_threshold_max': 30.0,
+    'humidity_threshold_min': 60.0,
+    'humidity_threshold_max': 80.0,
+    'ph_threshold_min': 5.5,
+    'ph_threshold_max': 6.5,
+}
+
+ControlSettings = namedtuple('ControlSettings', ['id', *CONTROL_DEFAULTS, 'updated_at'])
+
+
+def _from_row(cursor, row):
+    values = dict(zip((description[0] for description in cursor.description), row))
+    return ControlSettings(**{field: values.get(field) for field in ControlSettings._fields})
+
+
+class ControlSettingsStore:
+    """Current control settings of one process, updated write-through"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._current = None
+        self._loads = 0
+        self._updates = 0
+
+    def _read_latest(self):
+        cursor = self.db.execute('SELECT * FROM control_settings ORDER BY id DESC LIMIT 1')
+        row = cursor.fetchone()
+        return _from_row(cursor, row) if row else None
+
+    def load(self):
+        """(Re)read the latest row from the database, returning it"""
+        with self._lock:
+            self._current = self._read_latest()
+            self._loads += 1
+            return self._current
+
+    def get(self):
+        """The current settings, or None when the table is empty"""
+        return self._current
+
+    def update(self, values):
+        """Write settings (missing fields get CONTROL_DEFAULTS) and return the stored tuple"""
+        settings = [values.get(field, default) for field, default in CONTROL_DEFAULTS.items()]
+        assignments = ',\n                    '.join(f'{field} = ?' for field in CONTROL_DEFAULTS)
+        # The lock keeps two concurrent updates from publishing out of order
+        with self._lock:
+            with self.db.transaction():
+                self.db.execute(f'''
+                    UPDATE control_settings SET
+                    {assignments},
+                    updated_at = CURRENT_TIMESTAMP
+                    WHERE id = (SELECT MAX(id) FROM control_settings)
+                ''', settings)
+                current = self._read_latest()
+            self._current = current
+            self._updates += 1
+        return current
+
+    def as_dict(self):
+        current = self._current
+        return current._asdict() if current is not None else {}
+
+    def stats(self):
+        return {
+            'loaded': self._current is not None,
+            'loads': self._loads,
+            'updates': self._updates
+        }
+
+
+__all__ = ['ControlSettings', 'ControlSettingsStore', 'CONTROL_DEFAULTS']
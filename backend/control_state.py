@@ -0,0 +1,83 @@
+"""
+Versioned in-memory control settings for the MySQL backend
+
+ControlState holds the current settings map and the version it was published
+under. Every change (POST /api/controls, the automatic controls on ingest, the
+startup load) goes through update(), which bumps the version only when a value
+actually changed, so GET /api/controls and /api/esp32-config answer from
+memory and their version-based ETags stay valid for as long as the settings
+do. Only the known setting keys are accepted.
+
+persist() writes the current map to the database. Writes are serialised and
+always take the newest snapshot, so two concurrent changes can never leave
+the older one stored. persisted_version shows how far the database has caught
+up (it lags after a failed write).
+
+Like the ETag counters, the map is per process: a change written by another
+process is picked up by a restart.
+"""
+
+import threading
+
+
+class ControlState:
+    """Control settings map published under a version from a VersionCounter"""
+
+    def __init__(self, defaults, version_counter):
+        self._settings = dict(defaults)
+        self._counter = version_counter
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._version = version_counter.get()
+        self._persisted_version = None
+        self._changes = 0
+        self._persist_failures = 0
+
+    def snapshot(self):
+        """(version, copy of the settings) taken together"""
+        with self._lock:
+            return self._version, dict(self._settings)
+
+    def update(self, changes):
+        """Apply the known keys of `changes`, returning the ones that changed a value"""
+        with self._lock:
+            changed = {key: value for key, value in changes.items()
+                       if key in self._settings and self._settings[key] != value}
+            if changed:
+                # Settings are replaced, never mutated, so snapshots stay consistent
+                self._settings = {**self._settings, **changed}
+                self._counter.bump()
+                self._version = self._counter.get()
+                self._changes += 1
+            return changed
+
+    def load(self, settings):
+        """Apply settings read from the database, which is then up to date"""
+        with self._persist_lock:
+            changed = self.update(settings)
+            self._persisted_version = self._version
+            return changed
+
+    def persist(self, write):
+        """Store the newest snapshot with write(settings), returning its result"""
+        with self._persist_lock:
+            version, settings = self.snapshot()
+            if self._persisted_version == version:
+                return True
+            ok = write(settings)
+            if ok:
+                self._persisted_version = version
+            else:
+                self._persist_failures += 1
+            return ok
+
+    def stats(self):
+        return {
+            'version': self._version,
+            'persisted_version': self._persisted_version,
+            'changes': self._changes,
+            'persist_failures': self._persist_failures
+        }
+
+
+__all__ = ['ControlState']
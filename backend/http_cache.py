@@ -0,0 +1,197 @@
+"""
+Conditional GET and response compression for the read endpoints
+
+VersionCounter holds in-process change counters (per device, or one for a
+whole resource) that ingest and settings writes bump. An endpoint turns the
+counter into a weak ETag with conditional_response(): when the client's
+If-None-Match still matches, the handler is skipped entirely and an empty
+304 goes back, so an unchanged poll costs neither a query nor serialisation.
+
+Counters live in the process, so every ETag carries a per-process token: a
+tag issued by one worker is never taken as current by another. The token is
+renewed in every forked child, since preloaded workers import this module
+once in the parent.
+
+ResponseCompressor negotiates brotli (when the optional `brotli` package is
+installed) or gzip from Accept-Encoding for bodies over min_size bytes.
+Streamed bodies are compressed chunk by chunk with a sync flush, so rows still
+reach the client as they are produced.
+"""
+
+import hashlib
+import os
+import threading
+import time
+import zlib
+
+from flask import make_response, request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+def _new_process_token():
+    return f'{os.getpid():x}{int(time.time()):x}'
+
+# Changes whenever the process restarts, so counters never repeat a tag
+_PROCESS_TOKEN = _new_process_token()
+
+def _reset_process_token():
+    """A forked worker (gunicorn --preload) keeps its own counters, so it needs its own token"""
+    global _PROCESS_TOKEN
+    _PROCESS_TOKEN = _new_process_token()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_process_token)
+
+COMPRESSIBLE_MIMETYPES = (
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'text/html', 'text/plain', 'text/csv', 'text/css'
+)
+
+
+class VersionCounter:
+    """Thread-safe change counters, one per key (None for a single global counter)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+
+    def bump(self, *keys):
+        with self._lock:
+            for key in keys or (None,):
+                self._versions[key] = self._versions.get(key, 0) + 1
+
+    def get(self, key=None):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+
+def make_etag(scope, version, *variant):
+    """Opaque ETag value for `scope` at `version`, varied by request parameters"""
+    digest = hashlib.blake2s(repr(variant).encode(), digest_size=6).hexdigest()
+    return f'{scope}-{_PROCESS_TOKEN}-{version}-{digest}'
+
+
+def conditional_response(etag, build, since=None):
+    """304 if If-None-Match (or `since`) carries `etag`, otherwise build() tagged with it
+
+    `since` is for clients that cannot send headers easily: the version the
+    endpoint handed out earlier, passed back as a query parameter.
+    Only successful responses are tagged; errors from build(), and fallback
+    bodies it marks Cache-Control: no-store, pass through untagged.
+    """
+    if request.if_none_match.contains_weak(etag) or (since is not None and since == etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200 or response.cache_control.no_store:
+            return response
+    response.set_etag(etag, weak=True)
+    # Clients may keep the body but must revalidate it on every use
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+class ResponseCompressor:
+    """after_request hook compressing large text responses per Accept-Encoding"""
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._responses = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._streams = 0
+        self._not_modified = 0
+
+    def init_app(self, app):
+        app.after_request(self.process)
+        return self
+
+    def _encoding(self):
+        accept = request.accept_encodings
+        if brotli is not None and accept.quality('br') > 0:
+            return 'br'
+        if accept.quality('gzip') > 0:
+            return 'gzip'
+        return None
+
+    def _compressor(self, encoding):
+        """(compress, sync flush, finish) callables for one response body"""
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def process(self, response):
+        if response.status_code == 304:
+            with self._lock:
+                self._not_modified += 1
+            return response
+        if (response.status_code < 200 or response.status_code == 204
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        encoding = self._encoding()
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.iter_encoded(), encoding)
+            response.direct_passthrough = False
+            response.headers.pop('Content-Length', None)
+            with self._lock:
+                self._streams += 1
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            compress, _, finish = self._compressor(encoding)
+            compressed = compress(body) + finish()
+            response.set_data(compressed)
+            with self._lock:
+                self._responses += 1
+                self._bytes_in += len(body)
+                self._bytes_out += len(compressed)
+
+        response.headers['Content-Encoding'] = encoding
+        # The encoded bytes differ from the identity body, so only a weak tag still applies
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, encoding):
+        compress, flush, finish = self._compressor(encoding)
+        for chunk in chunks:
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+
+    def stats(self):
+        with self._lock:
+            ratio = self._bytes_out / self._bytes_in if self._bytes_in else None
+            return {
+                'brotli_available': brotli is not None,
+                'min_size': self.min_size,
+                'compressed_responses': self._responses,
+                'compressed_streams': self._streams,
+                'bytes_before': self._bytes_in,
+                'bytes_after': self._bytes_out,
+                'ratio': round(ratio, 3) if ratio is not None else None,
+                'not_modified': self._not_modified
+            }
+
+
+__all__ = [
+    'VersionCounter', 'make_etag', 'conditional_response', 'ResponseCompressor',
+    'COMPRESSIBLE_MIMETYPES'
+]
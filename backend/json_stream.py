@@ -0,0 +1,61 @@
+"""
+Streaming JSON responses for large result sets
+
+Turns chunks of database rows (see SQLitePool.iter_query) into a response body
+that is written as it is produced, either as NDJSON (one object per line) or
+as the usual JSON envelope with its row array streamed element by element.
+Only one chunk of rows is held in memory at a time.
+"""
+
+import json
+
+from flask import Response, stream_with_context
+
+# Accepted values for the ?stream= query parameter
+STREAM_FORMATS = ('ndjson', 'json')
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def ndjson_body(chunks, to_dict):
+    """Yield one JSON line per row, ending with an error line if the query fails"""
+    try:
+        for rows in chunks:
+            yield ''.join(json.dumps(to_dict(row)) + '\n' for row in rows)
+    except Exception as e:
+        yield json.dumps({'status': 'error', 'message': str(e)}) + '\n'
+
+
+def json_array_body(chunks, to_dict, envelope, key):
+    """Yield `envelope` with a streamed `key` array and a trailing total_records
+
+    The status code is already sent when rows start flowing, so a failure
+    part-way through closes the array and reports it in an "error" field.
+    """
+    head = json.dumps(envelope)[:-1]
+    yield f'{head}{", " if envelope else ""}"{key}": ['
+    total = 0
+    error = None
+    try:
+        for rows in chunks:
+            body = ', '.join(json.dumps(to_dict(row)) for row in rows)
+            yield (', ' if total else '') + body
+            total += len(rows)
+    except Exception as e:
+        error = str(e)
+    tail = {'total_records': total}
+    if error is not None:
+        tail['error'] = error
+    yield '], ' + json.dumps(tail)[1:]
+
+
+def streaming_response(chunks, to_dict, stream_format, envelope, key):
+    """Response streaming rows as NDJSON or as a JSON envelope, per stream_format"""
+    if stream_format == 'ndjson':
+        body, mimetype = ndjson_body(chunks, to_dict), NDJSON_MIMETYPE
+    else:
+        body, mimetype = json_array_body(chunks, to_dict, envelope, key), 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={'X-Accel-Buffering': 'no'})
+
+
+__all__ = ['STREAM_FORMATS', 'NDJSON_MIMETYPE', 'ndjson_body', 'json_array_body', 'streaming_response']
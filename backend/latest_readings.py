@@ -0,0 +1,100 @@
+"""
+Per-device latest-reading cache for the MySQL backend
+
+Ingest puts every stored reading here, and a startup query warms the cache
+with the newest row of each device. GET /api/sensor-data and
+/api/database-status are then answered from memory; MySQL is only asked on a
+miss (a device the warm-up did not cover, or a failed warm-up), and the
+answer is cached.
+
+Entries carry the sensor_data id they were stored under, so a slower request
+holding an older reading never replaces a newer one. Like the ETag counters,
+the cache is per process: readings stored by another worker are only seen
+after a miss or a restart.
+"""
+
+import threading
+import time
+
+
+def _key(device_id):
+    try:
+        return int(device_id)
+    except (TypeError, ValueError):
+        return device_id
+
+
+def reading_from_row(row):
+    """A sensor_data row in the shape GET /api/sensor-data returns"""
+    reading = dict(row)
+    reading.pop('id', None)
+    reading.pop('device_id', None)
+    timestamp = reading.get('timestamp')
+    if hasattr(timestamp, 'isoformat'):
+        reading['timestamp'] = timestamp.isoformat()
+    return reading
+
+
+class LatestReadingCache:
+    """Newest reading of each device, keyed by device id"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._hits = 0
+        self._misses = 0
+        self._puts = 0
+        self._stale_puts = 0
+        self._warmed_at = None
+
+    def warm(self, rows):
+        """Cache the newest row of each device, returning how many devices it covered"""
+        entries = {_key(row['device_id']): (row.get('id'), reading_from_row(row)) for row in rows}
+        with self._lock:
+            for device_id, (row_id, reading) in entries.items():
+                current = self._entries.get(device_id)
+                # Keep readings ingested while the warm-up query was running
+                if current is None or (current[0] or 0) <= (row_id or 0):
+                    self._entries[device_id] = (row_id, reading)
+            self._warmed_at = time.time()
+        return len(entries)
+
+    def put(self, device_id, row_id, reading):
+        """Store a device's reading unless a newer one is already cached"""
+        device_id = _key(device_id)
+        with self._lock:
+            current = self._entries.get(device_id)
+            if current is not None and row_id is not None and (current[0] or 0) > row_id:
+                self._stale_puts += 1
+                return False
+            self._entries[device_id] = (row_id, dict(reading))
+            self._puts += 1
+        return True
+
+    def get(self, device_id):
+        """A copy of the device's cached reading, or None on a miss"""
+        device_id = _key(device_id)
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            return dict(entry[1])
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'devices': len(self._entries),
+                'warmed': self._warmed_at is not None,
+                'warmed_at': self._warmed_at,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+                'puts': self._puts,
+                'stale_puts': self._stale_puts
+            }
+
+
+__all__ = ['LatestReadingCache', 'reading_from_row']
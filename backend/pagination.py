@@ -0,0 +1,46 @@
+"""
+Opaque keyset cursors for paginated history endpoints
+
+A cursor encodes the (timestamp, id) of the last row on a page. The next page
+seeks past it with a row-value comparison that an index on the timestamp
+column can answer directly, so every page costs the same however deep the
+client has paged (unlike OFFSET, which reads and discards the skipped rows).
+"""
+
+import base64
+import json
+
+# Appended to a WHERE clause for newest-first pages: rows strictly after the cursor
+SEEK_BEFORE_SQL = '(timestamp, id) < (?, ?)'
+
+
+def encode_cursor(timestamp, row_id):
+    """Opaque URL-safe token for the row at (timestamp, row_id)"""
+    raw = json.dumps([timestamp, row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(timestamp, row_id) from a token made by encode_cursor, or ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, row_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {token}') from e
+    if not isinstance(timestamp, str) or not isinstance(row_id, int):
+        raise ValueError(f'Invalid cursor: {token}')
+    return timestamp, row_id
+
+
+def split_page(rows, limit, timestamp_index, id_index=0):
+    """Trim a limit + 1 row fetch to one page, returning (rows, next_cursor or None)"""
+    if limit < 0 or len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    if not rows:
+        return rows, None
+    last = rows[-1]
+    return rows, encode_cursor(last[timestamp_index], last[id_index])
+
+
+__all__ = ['SEEK_BEFORE_SQL', 'encode_cursor', 'decode_cursor', 'split_page']
@@ -1,14 +1,48 @@
 #!/usr/bin/env python3
 """
-Terraponix Backend Server Launcher
+Terraponix Server Launcher
 
-Simple script to run the Flask backend server with proper configuration.
+Serves any of the Flask APIs with a production WSGI server:
+
+    python run_server.py                              # backend/app.py
+    python run_server.py --app greenhouse --threads 16
+    python run_server.py --app mysql --server waitress
+    python run_server.py --app sensor --workers 4 --no-preload
+
+gunicorn (Linux/macOS) runs --workers pre-forked processes with --threads
+threads each; waitress (any platform, including Windows) runs one process
+with a thread pool. By default the app module is imported once in the
+gunicorn master and shared copy-on-write by the workers (--no-preload imports
+it in each worker instead). Module-level background threads are deferred
+(TERRAPONIX_DEFER_BACKGROUND_TASKS=1) and each worker starts its own after
+the fork, together with the app's startup hook.
+SIGTERM or Ctrl+C stops accepting connections, lets in-flight requests finish
+within --graceful-timeout and then stops the background threads.
 """
 
-import sys
+import argparse
+import importlib
 import os
-import subprocess
 import platform
+import signal
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BACKEND_DIR)
+
+# name -> (directory the app runs from, module, description, health endpoint)
+APPS = {
+    'backend': (BACKEND_DIR, 'app', 'Terraponix backend (SQLite)', '/api/health'),
+    'mysql': (BACKEND_DIR, 'app_mysql', 'Terraponix backend (XAMPP MySQL)', '/api/health'),
+    'greenhouse': (ROOT_DIR, 'greenhouse_api', 'Greenhouse API', '/'),
+    'sensor': (ROOT_DIR, 'sensor_api', 'Sensor API', '/'),
+}
+
+# Request threads per worker unless --threads / TERRAPONIX_THREADS says otherwise.
+# The greenhouse API keeps SSE streams and long polls open, each holding a thread.
+DEFAULT_THREADS = 8
+APP_THREADS = {'greenhouse': 32}
 
 def check_python_version():
     """Check if Python version is compatible"""
@@ -41,52 +75,235 @@ def get_local_ip():
     except:
         return "127.0.0.1"
 
+def choose_server(requested):
+    """Resolve --server auto to gunicorn where it can run, else waitress"""
+    if requested != 'auto':
+        return requested
+    if platform.system() != 'Windows':
+        try:
+            import gunicorn  # noqa: F401
+            return 'gunicorn'
+        except ImportError:
+            pass
+    try:
+        import waitress  # noqa: F401
+        return 'waitress'
+    except ImportError:
+        return 'dev'
+
+def check_thread_budget(args):
+    """Check the greenhouse API's stream and long-poll cap against --threads
+
+    Streams and long polls may hold all but GREENHOUSE_RESERVED_THREADS threads
+    (greenhouse_api.MAX_HELD_REQUESTS). An explicit cap that would take every
+    thread is clamped so ingest and commands keep at least one.
+    """
+    if args.app != 'greenhouse':
+        return
+    reserved = int(os.getenv('GREENHOUSE_RESERVED_THREADS', 4))
+    held = int(os.getenv('GREENHOUSE_MAX_HELD_REQUESTS', max(0, args.threads - reserved)))
+    if held >= args.threads:
+        held = max(0, args.threads - 1)
+        os.environ['GREENHOUSE_MAX_HELD_REQUESTS'] = str(held)
+        print(f"⚠️ GREENHOUSE_MAX_HELD_REQUESTS would let streams and long polls take all "
+              f"{args.threads} threads; clamped to {held}")
+    if held == 0:
+        print(f"⚠️ --threads {args.threads} leaves no thread for SSE streams or long polls "
+              f"(GREENHOUSE_RESERVED_THREADS={reserved}); dashboards fall back to polling")
+    else:
+        print(f"⚙️ SSE streams + long polls: up to {held} of {args.threads} threads, "
+              f"{args.threads - held} kept for ingest and commands")
+
+def load_app(name):
+    """Import an app module from its own directory (its relative paths point there)"""
+    directory, module_name, _, _ = APPS[name]
+    os.chdir(directory)
+    for path in (ROOT_DIR, BACKEND_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(module_name)
+
+def init_worker(module):
+    """Per-process startup: the app's startup hook, then its background threads"""
+    startup = getattr(module, 'startup', None)
+    if startup is not None and startup() is False:
+        raise RuntimeError(f"{module.__name__} startup failed")
+    start_background_tasks = getattr(module, 'start_background_tasks', None)
+    if start_background_tasks is not None:
+        start_background_tasks()
+
+def stop_worker(module):
+    """Stop the worker's background threads (draining queued writes)"""
+    stop_background_tasks = getattr(module, 'stop_background_tasks', None)
+    if stop_background_tasks is not None:
+        stop_background_tasks()
+
+def run_gunicorn(args):
+    """Pre-forking server: --workers processes of --threads threads each"""
+    from gunicorn.app.base import BaseApplication
+
+    state = {}
+
+    def module():
+        if 'module' not in state:
+            state['module'] = load_app(args.app)
+        return state['module']
+
+    def post_fork(server, worker):
+        # Without --preload the worker imports the app itself in load()
+        if args.preload:
+            init_worker(module())
+
+    def worker_exit(server, worker):
+        if 'module' in state:
+            stop_worker(state['module'])
+
+    class TerraponixApplication(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{args.host}:{args.port}',
+                'workers': args.workers,
+                'threads': args.threads,
+                'worker_class': 'gthread' if args.threads > 1 else 'sync',
+                'preload_app': args.preload,
+                'timeout': args.timeout,
+                'graceful_timeout': args.graceful_timeout,
+                'keepalive': 5,
+                'post_fork': post_fork,
+                'worker_exit': worker_exit,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # With --preload this runs once in the master, before any fork
+            first_load = 'module' not in state
+            app = module().app
+            if first_load and not args.preload:
+                init_worker(state['module'])
+            return app
+
+    TerraponixApplication().run()
+
+def run_waitress(args):
+    """Single process, --threads worker threads (also runs on Windows)"""
+    from waitress import create_server
+
+    module = load_app(args.app)
+    init_worker(module)
+    server = create_server(module.app, host=args.host, port=args.port, threads=args.threads)
+
+    def terminate(signum, frame):
+        # waitress closes its socket and finishes running tasks on SystemExit
+        raise SystemExit(0)
+
+    if hasattr(signal, 'SIGTERM'):
+        signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.run()
+    finally:
+        stop_worker(module)
+
+def run_dev(args):
+    """Werkzeug development server (no reloader, so startup runs once)"""
+    module = load_app(args.app)
+    init_worker(module)
+    try:
+        module.app.run(host=args.host, port=args.port, debug=args.debug, use_reloader=False,
+                       threaded=True)
+    finally:
+        stop_worker(module)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run a Terraponix API with a production WSGI server')
+    parser.add_argument('--app', choices=sorted(APPS), default=os.getenv('TERRAPONIX_APP', 'backend'),
+                        help='Which Flask app to serve')
+    parser.add_argument('--host', default=os.getenv('TERRAPONIX_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('TERRAPONIX_PORT', 5000)))
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'dev'],
+                        default=os.getenv('TERRAPONIX_SERVER', 'auto'),
+                        help='auto picks gunicorn, then waitress, then the dev server')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('TERRAPONIX_WORKERS', 1)),
+                        help='Worker processes (gunicorn only)')
+    parser.add_argument('--threads', type=int, default=None,
+                        help=f'Request threads per worker (default {DEFAULT_THREADS}, '
+                             f'{APP_THREADS["greenhouse"]} for greenhouse)')
+    parser.add_argument('--no-preload', dest='preload', action='store_false',
+                        default=os.getenv('TERRAPONIX_PRELOAD', '1') == '1',
+                        help='Import the app in every worker instead of once before forking (gunicorn only)')
+    parser.add_argument('--timeout', type=int, default=int(os.getenv('TERRAPONIX_TIMEOUT', 60)),
+                        help='Seconds before a silent worker is restarted (gunicorn only)')
+    parser.add_argument('--graceful-timeout', type=int,
+                        default=int(os.getenv('TERRAPONIX_GRACEFUL_TIMEOUT', 30)),
+                        help='Seconds in-flight requests get to finish on shutdown')
+    parser.add_argument('--install-deps', action='store_true',
+                        help='pip install requirements.txt before starting')
+    parser.add_argument('--debug', action='store_true', help='Flask debug mode (dev server only)')
+    args = parser.parse_args(argv)
+    if args.threads is None:
+        args.threads = int(os.getenv('TERRAPONIX_THREADS', APP_THREADS.get(args.app, DEFAULT_THREADS)))
+    return args
+
 def main():
     """Main function to run the server"""
-    print("🌱 Terraponix Backend Server")
+    args = parse_args()
+    directory, module_name, description, health = APPS[args.app]
+
+    print(f"🌱 Terraponix Server Launcher: {description}")
     print("=" * 50)
-    
+
     # Check Python version
     if not check_python_version():
         sys.exit(1)
-    
-    # Check if requirements.txt exists
-    if not os.path.exists("requirements.txt"):
-        print("❌ requirements.txt not found")
-        sys.exit(1)
-    
-    # Install dependencies
-    if not install_dependencies():
-        sys.exit(1)
-    
+
+    if args.install_deps:
+        os.chdir(directory if os.path.exists(os.path.join(directory, "requirements.txt")) else BACKEND_DIR)
+        if not install_dependencies():
+            sys.exit(1)
+
+    server = choose_server(args.server)
+    if server == 'dev':
+        print("⚠️ Neither gunicorn nor waitress is installed, falling back to the development server")
+        print("   pip install gunicorn  (Linux/macOS)  or  pip install waitress  (any platform)")
+    if args.workers > 1:
+        if server != 'gunicorn':
+            print(f"⚠️ --workers needs gunicorn; {server} serves one process with {args.threads} threads")
+        else:
+            print("⚠️ Each worker keeps its own in-memory state (latest readings, status snapshots,")
+            print("   command queue, ETag counters); scale with --threads unless a proxy pins")
+            print("   every device to one worker")
+
+    # Background threads start per worker, after the fork
+    os.environ['TERRAPONIX_DEFER_BACKGROUND_TASKS'] = '1'
+    # The apps size their thread budgets from the real thread count
+    os.environ['TERRAPONIX_THREADS'] = str(args.threads)
+    check_thread_budget(args)
+
     # Get local IP
     local_ip = get_local_ip()
-    
-    print("\n🚀 Starting Terraponix Backend Server...")
+
+    print(f"\n🚀 Starting {module_name}.py with {server}...")
+    if server == 'gunicorn':
+        print(f"⚙️ Workers: {args.workers} x {args.threads} threads, "
+              f"preload: {'on' if args.preload else 'off'}, graceful timeout: {args.graceful_timeout}s")
+    elif server == 'waitress':
+        print(f"⚙️ Threads: {args.threads}")
     print(f"📡 Server will be available at:")
-    print(f"   Local:    http://127.0.0.1:5000")
-    print(f"   Network:  http://{local_ip}:5000")
-    print(f"   Health:   http://{local_ip}:5000/api/health")
-    print("\n📱 Configure your mobile app to use:")
-    print(f"   API URL:  http://{local_ip}:5000/api")
-    print("\n🔌 ESP32 should send data to:")
-    print(f"   Endpoint: http://{local_ip}:5000/api/sensor-data")
-    print("\n" + "=" * 50)
-    print("📊 Dashboard endpoints:")
-    print(f"   Current Data:    GET  /api/current-data")
-    print(f"   Historical Data: GET  /api/historical-data")
-    print(f"   Controls:        GET  /api/controls")
-    print(f"   Alerts:          GET  /api/alerts")
-    print(f"   Send Command:    POST /api/device-command")
+    print(f"   Local:    http://127.0.0.1:{args.port}")
+    print(f"   Network:  http://{local_ip}:{args.port}")
+    print(f"   Health:   http://{local_ip}:{args.port}{health}")
     print("\n💡 Press Ctrl+C to stop the server")
     print("=" * 50)
-    
-    # Import and run the Flask app
+
     try:
-        from app import app
-        app.run(debug=True, host='0.0.0.0', port=5000)
-    except ImportError:
-        print("❌ Could not import Flask app. Make sure app.py exists.")
+        if server == 'gunicorn':
+            run_gunicorn(args)
+        elif server == 'waitress':
+            run_waitress(args)
+        else:
+            run_dev(args)
+    except ImportError as e:
+        print(f"❌ Could not import the server or app: {e}")
         sys.exit(1)
     except KeyboardInterrupt:
         print("\n\n🛑 Server stopped by user")
@@ -95,4 +312,4 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,461 @@
+"""
+Retention and archival of old time-series rows
+
+RetentionJob moves rows older than a configurable age out of a hot SQLite
+table into SegmentArchive: one gzip-compressed columnar segment per device per
+day (<root>/<device>/<YYYY-MM-DD>.json.gz, one JSON list per column). A run
+reads each device's old rows in chunks of chunk_rows, oldest first, and
+collects them per day, so each segment is rewritten once per run however big
+the backlog. A day's rows are written to its segment before they are deleted,
+and the deletes are short transactions of at most chunk_rows ids, so ingest
+only ever waits for one small write. A crash between the two steps leaves
+rows in both places; segments are merged by id, so the next run simply
+archives them again.
+
+Every server process (each gunicorn worker) starts its own RetentionJob, but
+only one of them archives at a time: a run first takes an exclusive lock on
+<root>/.retention.lock (flock, or msvcrt on Windows) and keeps it while its
+thread lives. The others skip their runs and take over if the holder exits.
+Segments are written to a unique temporary file and renamed into place.
+
+read_archived_rows() serves history queries that reach past the hot table.
+"""
+
+import datetime
+import gzip
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import quote, unquote
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_FORMAT = 1
+SEGMENT_SUFFIX = '.json.gz'
+
+# Segment directory for tables without a device column
+ALL_DEVICES = '_all'
+
+# Lock file in the archive root held by the process that runs retention
+LEADER_LOCK_NAME = '.retention.lock'
+
+
+class ProcessLock:
+    """Exclusive, non-blocking lock on a file, shared by all processes on the host
+
+    The lock belongs to the open file, so it is released when the holder
+    closes it or exits, however it exits.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._forget_after_fork)
+
+    def _forget_after_fork(self):
+        """A forked child shares the parent's lock; drop its copy without unlocking"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """Take the lock if it is free, returning whether this process holds it"""
+        if self._file is not None:
+            return True
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class SegmentArchive:
+    """Directory of per-device, per-day compressed columnar segments"""
+
+    def __init__(self, root, cache_segments=32, compresslevel=6):
+        self.root = root
+        self.cache_segments = cache_segments
+        self.compresslevel = compresslevel
+        self._cache = OrderedDict()  # path -> (mtime, columns, rows)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _device_dir(self, device_id):
+        return os.path.join(self.root, quote(device_id or ALL_DEVICES, safe=''))
+
+    def segment_path(self, device_id, day):
+        return os.path.join(self._device_dir(device_id), day + SEGMENT_SUFFIX)
+
+    def devices(self):
+        """Device ids that have at least one segment"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(unquote(name) for name in os.listdir(self.root)
+                      if os.path.isdir(os.path.join(self.root, name)))
+
+    def days(self, device_id):
+        """Archived days (YYYY-MM-DD) of a device, oldest first"""
+        directory = self._device_dir(device_id)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def read(self, device_id, day):
+        """(columns, rows) of one segment, rows as tuples in column order"""
+        path = self.segment_path(device_id, day)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return [], []
+
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._cache.move_to_end(path)
+                return cached[1], cached[2]
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            segment = json.load(f)
+        columns = segment['columns']
+        rows = list(zip(*segment['data'])) if segment['data'] else []
+
+        with self._lock:
+            self._cache[path] = (mtime, columns, rows)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_segments:
+                self._cache.popitem(last=False)
+        return columns, rows
+
+    def write(self, device_id, day, columns, rows, id_index=0, timestamp_index=1):
+        """Merge rows into a day's segment (rows already archived are replaced by id)"""
+        with self._write_lock:
+            existing_columns, existing = self.read(device_id, day)
+            if existing and existing_columns != columns:
+                raise ValueError(f'Segment {day} for {device_id} has columns {existing_columns}, '
+                                 f'not {columns}')
+            merged = {row[id_index]: row for row in existing}
+            merged.update((row[id_index], tuple(row)) for row in rows)
+            ordered = sorted(merged.values(), key=lambda row: (row[timestamp_index], row[id_index]))
+
+            path = self.segment_path(device_id, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # A name of its own, so no other writer can ever share the file
+            fd, temp_path = tempfile.mkstemp(prefix=day + '.', suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as raw:
+                    with gzip.open(raw, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as f:
+                        json.dump({
+                            'format': SEGMENT_FORMAT,
+                            'device_id': device_id,
+                            'day': day,
+                            'columns': columns,
+                            'data': [list(column) for column in zip(*ordered)]
+                        }, f, separators=(',', ':'))
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            return len(ordered)
+
+    def stats(self):
+        segments = 0
+        size = 0
+        for device_id in self.devices():
+            for day in self.days(device_id):
+                segments += 1
+                size += os.path.getsize(self.segment_path(device_id, day))
+        return {
+            'root': self.root,
+            'devices': len(self.devices()),
+            'segments': segments,
+            'bytes': size
+        }
+
+
+def iter_archived_days(archive, device_id, since, before=None, since_inclusive=False,
+                       id_index=0, timestamp_index=1):
+    """Yield each archived day's rows after `since` (and before the (timestamp, id) key `before`)
+
+    Days come newest first and rows within a day newest first, so the chunks
+    concatenate into one newest-first sequence. Only one day is decoded at a time.
+    """
+    for day in reversed(archive.days(device_id)):
+        if since and day < since[:10]:
+            break
+        if before is not None and day > before[0][:10]:
+            continue
+        _, rows = archive.read(device_id, day)
+        matching = []
+        for row in rows:
+            timestamp = row[timestamp_index]
+            if since and (timestamp < since if since_inclusive else timestamp <= since):
+                continue
+            if before is not None and (timestamp, row[id_index]) >= tuple(before):
+                continue
+            matching.append(row)
+        if matching:
+            matching.sort(key=lambda row: (row[timestamp_index], row[id_index]), reverse=True)
+            yield matching
+
+
+def read_archived_rows(archive, device_id, since, limit, before=None, since_inclusive=False,
+                       id_index=0, timestamp_index=1):
+    """Up to `limit` newest archived rows in range (limit < 0 reads them all)
+
+    Together with the top rows of the hot table this gives the top rows overall.
+    """
+    collected = []
+    for rows in iter_archived_days(archive, device_id, since, before, since_inclusive,
+                                   id_index, timestamp_index):
+        collected.extend(rows)
+        if 0 <= limit <= len(collected):
+            break
+    return collected if limit < 0 else collected[:limit]
+
+
+def merge_newest(hot_rows, archived_rows, limit, id_index=0, timestamp_index=1):
+    """Combine newest-first hot and archived rows, dropping rows present in both"""
+    seen = set()
+    merged = []
+    for row in sorted(list(hot_rows) + list(archived_rows),
+                      key=lambda row: (row[timestamp_index], row[id_index]), reverse=True):
+        if row[id_index] in seen:
+            continue
+        seen.add(row[id_index])
+        merged.append(row)
+    return merged if limit < 0 else merged[:limit]
+
+
+class RetentionJob:
+    """Background thread archiving rows older than retain_days, in small chunks"""
+
+    def __init__(self, pool, archive, table, retain_days, device_column=None, devices_sql=None,
+                 chunk_rows=500, interval_seconds=3600, pause_ms=50,
+                 clock=datetime.datetime.now, timestamp_format=None, name='retention'):
+        self.pool = pool
+        self.archive = archive
+        self.table = table
+        self.retain_days = retain_days
+        self.device_column = device_column
+        self.devices_sql = devices_sql or (
+            f'SELECT DISTINCT {device_column} FROM {table}' if device_column else None
+        )
+        self.chunk_rows = chunk_rows
+        self.interval_seconds = interval_seconds
+        self.pause = pause_ms / 1000.0
+        self.clock = clock
+        self.timestamp_format = timestamp_format
+        self.name = name
+        self.leader_lock = ProcessLock(os.path.join(archive.root, LEADER_LOCK_NAME))
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._runs = 0
+        self._archived = 0
+        self._chunks = 0
+        self._segments = 0
+        self._errors = 0
+        self._last_run_at = None
+        self._last_run_ms = 0.0
+        self._last_error = None
+
+    @property
+    def enabled(self):
+        return self.retain_days > 0
+
+    def cutoff(self):
+        """Timestamp string before which rows are archived, in the table's format"""
+        cutoff = self.clock() - datetime.timedelta(days=self.retain_days)
+        return cutoff.strftime(self.timestamp_format) if self.timestamp_format else cutoff.isoformat()
+
+    def _fetch_chunk(self, device_id, cutoff, after):
+        """(columns, rows): the next chunk_rows old rows after the (timestamp, id) key `after`"""
+        conditions, params = ['timestamp < ?'], [cutoff]
+        if self.device_column:
+            conditions.insert(0, f'{self.device_column} = ?')
+            params.insert(0, device_id)
+        if after is not None:
+            conditions.append('(timestamp > ? OR (timestamp = ? AND id > ?))')
+            params.extend((after[0], after[0], after[1]))
+        cursor = self.pool.execute(f'''
+            SELECT * FROM {self.table}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''', params + [self.chunk_rows])
+        return [description[0] for description in cursor.description], cursor.fetchall()
+
+    def _archive_day(self, device_id, day, columns, rows, id_index, timestamp_index):
+        """Write one day's rows to its segment, then delete them in chunk_rows batches"""
+        self.archive.write(device_id, day, columns, rows, id_index, timestamp_index)
+        ids = [row[id_index] for row in rows]
+        for start in range(0, len(ids), self.chunk_rows):
+            batch = ids[start:start + self.chunk_rows]
+            with self.pool.transaction():
+                self.pool.execute(
+                    f'DELETE FROM {self.table} WHERE id IN ({", ".join("?" * len(batch))})', batch
+                )
+            # Let ingest take the write lock between deletes
+            time.sleep(self.pause)
+        return len(rows)
+
+    def _archive_device(self, device_id, cutoff):
+        """Archive a device's old rows, returning (rows moved, chunks read, segments written)
+
+        Rows arrive oldest first, so a day is complete as soon as a later day
+        shows up; only that one day's rows are held in memory at a time.
+        """
+        moved = chunks = segments = 0
+        columns, day, pending, after = None, None, [], None
+        while not self._stop.is_set():
+            columns, rows = self._fetch_chunk(device_id, cutoff, after)
+            if not rows:
+                break
+            chunks += 1
+            id_index, timestamp_index = columns.index('id'), columns.index('timestamp')
+            for row in rows:
+                row_day = str(row[timestamp_index])[:10]
+                if row_day != day:
+                    if pending:
+                        moved += self._archive_day(device_id, day, columns, pending, id_index, timestamp_index)
+                        segments += 1
+                    day, pending = row_day, []
+                pending.append(row)
+            after = (rows[-1][timestamp_index], rows[-1][id_index])
+        # A stop leaves the unwritten day in the table for the next run
+        if pending and not self._stop.is_set():
+            moved += self._archive_day(device_id, day, columns, pending,
+                                       columns.index('id'), columns.index('timestamp'))
+            segments += 1
+        return moved, chunks, segments
+
+    def run_once(self):
+        """Archive everything older than the cutoff, returning the number of rows moved
+
+        Does nothing (returns 0) while another process holds the retention lock.
+        """
+        if not self.enabled or not self.leader_lock.acquire():
+            return 0
+        started = time.perf_counter()
+        cutoff = self.cutoff()
+        devices = [row[0] for row in self.pool.query(self.devices_sql)] if self.device_column else [None]
+
+        moved = chunks = segments = 0
+        for device_id in devices:
+            if self._stop.is_set():
+                break
+            device_moved, device_chunks, device_segments = self._archive_device(device_id, cutoff)
+            moved += device_moved
+            chunks += device_chunks
+            segments += device_segments
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._runs += 1
+            self._archived += moved
+            self._chunks += chunks
+            self._segments += segments
+            self._last_run_at = time.time()
+            self._last_run_ms = elapsed_ms
+        if moved:
+            logger.info(f"{self.table}: archived {moved} rows older than {cutoff} into {segments} "
+                        f"segments in {elapsed_ms:.0f}ms")
+        return moved
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Retention run for {self.table} failed: {e}")
+                with self._stats_lock:
+                    self._errors += 1
+                    self._last_error = str(e)
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        """Start the background thread (no-op when retention is disabled)"""
+        if self.enabled and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Let another process take over retention
+        if self._thread is None or not self._thread.is_alive():
+            self.leader_lock.release()
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'enabled': self.enabled,
+                'running': self._thread is not None and self._thread.is_alive(),
+                'leader': self.leader_lock.held,
+                'retain_days': self.retain_days,
+                'chunk_rows': self.chunk_rows,
+                'interval_seconds': self.interval_seconds,
+                'runs': self._runs,
+                'rows_archived': self._archived,
+                'chunks': self._chunks,
+                'segments_written': self._segments,
+                'errors': self._errors,
+                'last_error': self._last_error,
+                'last_run_at': self._last_run_at,
+                'last_run_ms': round(self._last_run_ms, 3)
+            }
+
+
+__all__ = [
+    'SegmentArchive', 'RetentionJob', 'iter_archived_days', 'read_archived_rows', 'merge_newest',
+    'ProcessLock', 'SEGMENT_FORMAT', 'ALL_DEVICES'
+]
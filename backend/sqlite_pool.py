@@ -0,0 +1,545 @@
+"""
+Shared SQLite access layer for the Terraponix Flask servers
+
+Keeps one long-lived connection per worker thread instead of opening a new
+connection for every request, switches the database to WAL mode with tuned
+pragmas and tracks pool and prepared-statement cache statistics.
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Pragmas applied to every new connection. WAL lets readers run alongside the
+# single writer and synchronous=NORMAL only fsyncs at checkpoints, which is
+# safe in WAL mode (a power cut can lose the last commits, never corrupt).
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'temp_store': 'MEMORY',
+    'cache_size': -16000,  # 16 MB page cache per connection
+    'mmap_size': 134217728,  # 128 MB memory-mapped I/O
+    'wal_autocheckpoint': 1000
+}
+
+# Number of prepared statements sqlite3 keeps per connection
+DEFAULT_STATEMENT_CACHE_SIZE = 128
+
+
+class _PooledConnection:
+    """A pooled connection plus the bookkeeping for its statement cache"""
+
+    __slots__ = ('conn', 'owner', 'statements', 'hits', 'misses', 'depth', 'created_at')
+
+    def __init__(self, conn, owner):
+        self.conn = conn
+        self.owner = owner
+        # Mirrors sqlite3's internal LRU statement cache so we can report on it
+        self.statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.depth = 0  # transaction nesting level
+        self.created_at = time.time()
+
+
+class SQLitePool:
+    """Per-thread SQLite connection pool
+
+    Each thread gets its own connection on first use and keeps it for the rest
+    of its life. Connections left behind by finished threads (the Werkzeug dev
+    server starts a thread per request) are handed to the next new thread
+    instead of being reopened.
+
+    A forked child (a pre-forking server worker) never touches the parent's
+    connections: they are dropped unclosed in the child and it opens its own.
+    """
+
+    def __init__(self, path, pragmas=None, statement_cache_size=DEFAULT_STATEMENT_CACHE_SIZE,
+                 timeout=5.0):
+        self.path = path
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self.statement_cache_size = statement_cache_size
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._opened = 0
+        self._adopted = 0
+        self._acquired = 0
+        self._closed = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _reset_after_fork(self):
+        """Forget connections inherited from the parent process
+
+        A SQLite connection must not be used, or closed, across fork(), so the
+        child simply abandons them.
+        """
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def _open(self):
+        """Open and configure a new connection"""
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            cached_statements=self.statement_cache_size,
+            check_same_thread=False,  # ownership is tracked by the pool
+            isolation_level=None  # transactions are managed explicitly
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _acquire(self):
+        """Return the pooled connection owned by the current thread"""
+        pooled = getattr(self._local, 'pooled', None)
+        if pooled is not None:
+            return pooled
+
+        current = threading.current_thread()
+        with self._lock:
+            self._acquired += 1
+            # Reuse a connection whose owning thread has exited
+            for candidate in self._connections:
+                if not candidate.owner.is_alive():
+                    candidate.owner = current
+                    candidate.depth = 0
+                    self._adopted += 1
+                    pooled = candidate
+                    break
+
+            if pooled is None:
+                pooled = _PooledConnection(self._open(), current)
+                self._connections.append(pooled)
+                self._opened += 1
+
+        self._local.pooled = pooled
+        return pooled
+
+    def _track(self, pooled, sql):
+        """Record a statement cache hit or miss for sql"""
+        statements = pooled.statements
+        if sql in statements:
+            statements.move_to_end(sql)
+            pooled.hits += 1
+        else:
+            statements[sql] = True
+            pooled.misses += 1
+            if len(statements) > self.statement_cache_size:
+                statements.popitem(last=False)
+
+    def connection(self):
+        """Get the current thread's sqlite3 connection"""
+        return self._acquire().conn
+
+    def execute(self, sql, params=()):
+        """Execute a statement on the current thread's connection"""
+        pooled = self._acquire()
+        self._track(pooled, sql)
+        return pooled.conn.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        """Execute a statement for every parameter tuple in seq_of_params"""
+        pooled = self._acquire()
+        self._track(pooled, sql)
+        return pooled.conn.executemany(sql, seq_of_params)
+
+    def query(self, sql, params=()):
+        """Execute a SELECT and return all rows"""
+        return self.execute(sql, params).fetchall()
+
+    def iter_query(self, sql, params=(), chunk_size=500):
+        """Execute a SELECT and yield its rows in lists of up to chunk_size
+
+        Rows are pulled from the cursor with fetchmany(), so memory stays flat
+        however large the result is. The cursor is closed when the generator
+        finishes or is closed early, which ends its read transaction.
+        """
+        cursor = self.execute(sql, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed statements in one write transaction
+
+        Uses BEGIN IMMEDIATE so the write lock is taken up front rather than
+        on the first write, which avoids SQLITE_BUSY deadlocks between two
+        readers upgrading at the same time. Nested blocks join the outer one.
+        """
+        pooled = self._acquire()
+        if pooled.depth == 0:
+            pooled.conn.execute('BEGIN IMMEDIATE')
+        pooled.depth += 1
+        try:
+            yield self
+        except BaseException:
+            pooled.depth -= 1
+            if pooled.depth == 0:
+                pooled.conn.rollback()
+            raise
+        else:
+            pooled.depth -= 1
+            if pooled.depth == 0:
+                pooled.conn.commit()
+
+    def stats(self):
+        """Pool and statement cache statistics"""
+        with self._lock:
+            connections = list(self._connections)
+            stats = {
+                'database': self.path,
+                'journal_mode': self.pragmas.get('journal_mode'),
+                'connections_open': len(connections),
+                'connections_in_use': sum(1 for c in connections if c.owner.is_alive()),
+                'connections_opened': self._opened,
+                'connections_reused': self._adopted,
+                'connections_closed': self._closed,
+                'thread_acquisitions': self._acquired
+            }
+
+        hits = sum(c.hits for c in connections)
+        misses = sum(c.misses for c in connections)
+        total = hits + misses
+        stats['statement_cache'] = {
+            'capacity_per_connection': self.statement_cache_size,
+            'cached_statements': sum(len(c.statements) for c in connections),
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else None
+        }
+        return stats
+
+    def close_all(self):
+        """Close every pooled connection (used at shutdown)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            for pooled in connections:
+                try:
+                    pooled.conn.close()
+                except sqlite3.Error as e:
+                    logger.warning(f"Error closing SQLite connection: {e}")
+                self._closed += 1
+        self._local = threading.local()
+
+
+def get_schema_version(pool):
+    """Read the schema version stored in PRAGMA user_version"""
+    return pool.execute('PRAGMA user_version').fetchone()[0]
+
+def apply_migrations(pool, migrations):
+    """Bring the database schema up to date
+
+    migrations is an ordered list of (version, description, statements). Each
+    pending migration runs in its own transaction together with the bump of
+    PRAGMA user_version, so a failed migration leaves the previous version in
+    place. When the schema is already current no DDL is executed at all.
+    Returns the list of versions that were applied.
+    """
+    current = get_schema_version(pool)
+    latest = migrations[-1][0] if migrations else 0
+    if current >= latest:
+        return []
+
+    applied = []
+    for version, description, statements in migrations:
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        with pool.transaction():
+            for statement in statements:
+                pool.execute(statement)
+            pool.execute(f'PRAGMA user_version = {int(version)}')
+        elapsed = time.perf_counter() - started
+        logger.info(f"{pool.path}: applied migration {version} ({description}) in {elapsed:.2f}s")
+        applied.append(version)
+    return applied
+
+
+class BatchWorker:
+    """Bounded queue drained in batches by a single background thread
+
+    Producers hand items to submit() and return immediately; a full queue
+    drops the item (counted) instead of blocking. The worker thread collects
+    items until batch_size are waiting or flush_interval_ms has passed since
+    the first one arrived, then passes them to _handle(items). A batch that
+    hits lock contention (sqlite3.OperationalError) is retried, so _handle
+    must leave no trace of a failed attempt; any other error fails the batch.
+    Lag is measured from submit() to the end of the batch that handled the item.
+
+    Subclasses implement _handle and may override _committed(items, result),
+    which runs after a successful batch, and build their stats() on _counters().
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_queue, batch_size, flush_interval_ms, max_retries, name):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_retries = max_retries
+        self.name = name
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+        self._submitted = 0
+        self._done = 0
+        self._dropped = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_batch_ms = 0.0
+        self._max_batch_ms = 0.0
+        self._total_batch_ms = 0.0
+        self._last_batch_at = None
+        self._last_lag_ms = 0.0
+        self._max_lag_ms = 0.0
+        self._total_lag_ms = 0.0
+
+    def start(self):
+        """Start the worker thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, item):
+        """Queue one item, returning False (and counting a drop) if the queue is full"""
+        if self._stopping:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((time.monotonic(), item))
+        except queue.Full:
+            with self._stats_lock:
+                self._dropped += 1
+            return False
+        with self._stats_lock:
+            self._submitted += 1
+        return True
+
+    def submit_many(self, items):
+        """Queue several items, returning one accepted flag per item"""
+        return [self.submit(item) for item in items]
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is due
+
+        Returns (batch, stop) where stop is True once the stop marker is seen.
+        """
+        first = self._queue.get()
+        if first is self._STOP:
+            self._queue.task_done()
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is self._STOP:
+                self._queue.task_done()
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _handle(self, items):
+        raise NotImplementedError
+
+    def _committed(self, items, result):
+        """Called after a batch was handled successfully"""
+
+    def _attempt(self, items):
+        """Run _handle(items), retrying on lock contention; (ok, result)"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return True, self._handle(items)
+            except sqlite3.OperationalError as e:
+                if attempt == self.max_retries:
+                    logger.error(f"{self.name}: batch of {len(items)} failed: {e}")
+                    return False, None
+                time.sleep(0.05 * (attempt + 1))
+            except Exception as e:
+                logger.error(f"{self.name}: batch of {len(items)} failed: {e}")
+                return False, None
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        items = [item for _, item in batch]
+        ok, result = self._attempt(items)
+        if ok:
+            try:
+                self._committed(items, result)
+            except Exception as e:
+                logger.error(f"{self.name}: post-commit callback failed: {e}")
+
+        now = time.monotonic()
+        lags = [(now - submitted) * 1000 for submitted, _ in batch]
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            if ok:
+                self._done += len(batch)
+                self._batches += 1
+                self._last_batch_ms = elapsed_ms
+                self._max_batch_ms = max(self._max_batch_ms, elapsed_ms)
+                self._total_batch_ms += elapsed_ms
+                self._last_batch_at = time.time()
+            else:
+                self._failed += len(batch)
+            self._last_lag_ms = max(lags)
+            self._max_lag_ms = max(self._max_lag_ms, self._last_lag_ms)
+            self._total_lag_ms += sum(lags)
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._collect()
+            if not batch:
+                continue
+            try:
+                self._process(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self, timeout=None):
+        """Wait until every queued item has been handled (or timeout seconds pass)"""
+        if timeout is None:
+            self._queue.join()
+            return True
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self, timeout=10.0):
+        """Stop accepting items, handle the queued ones and stop the thread"""
+        if not self.running:
+            return True
+        self._stopping = True
+        # The stop marker is queued behind every pending item so they all get handled
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+        drained = not self._thread.is_alive()
+        if not drained:
+            logger.warning(f"{self.name} did not drain within {timeout}s "
+                           f"({self._queue.qsize()} items left)")
+        return drained
+
+    def _counters(self):
+        """Shared counters for stats(); called with the stats lock held"""
+        batches = self._batches
+        processed = self._done + self._failed
+        return {
+            'running': self.running,
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue,
+            'flush_interval_ms': int(self.flush_interval * 1000),
+            'submitted': self._submitted,
+            'done': self._done,
+            'dropped': self._dropped,
+            'failed': self._failed,
+            'batches': batches,
+            'avg_batch_size': round(self._done / batches, 1) if batches else None,
+            'last_batch_ms': round(self._last_batch_ms, 3),
+            'avg_batch_ms': round(self._total_batch_ms / batches, 3) if batches else None,
+            'max_batch_ms': round(self._max_batch_ms, 3),
+            'last_batch_at': self._last_batch_at,
+            'last_lag_ms': round(self._last_lag_ms, 3),
+            'avg_lag_ms': round(self._total_lag_ms / processed, 3) if processed else None,
+            'max_lag_ms': round(self._max_lag_ms, 3)
+        }
+
+
+class WriteBehindQueue(BatchWorker):
+    """Bounded write-behind queue with a single group-commit writer thread
+
+    Request threads hand rows to submit() and return immediately. The writer
+    thread collects rows until flush_rows are waiting or flush_interval_ms has
+    passed since the first one arrived, then inserts them with one
+    executemany in one transaction. Having a single writer also means request
+    threads never contend for SQLite's write lock.
+
+    on_flush, if given, is called with each batch inside the same transaction,
+    so derived tables (rollups, counters) commit or roll back with the rows.
+    on_commit, if given, is called with each batch once it has committed and
+    is visible to readers (cache invalidation, version counters).
+    """
+
+    def __init__(self, pool, sql, max_queue=10000, flush_interval_ms=200, flush_rows=500,
+                 max_retries=3, name='sqlite-writer', on_flush=None, on_commit=None):
+        super().__init__(max_queue, flush_rows, flush_interval_ms, max_retries, name)
+        self.pool = pool
+        self.sql = sql
+        self.on_flush = on_flush
+        self.on_commit = on_commit
+        self.flush_rows = flush_rows
+
+    def _handle(self, rows):
+        with self.pool.transaction():
+            self.pool.executemany(self.sql, rows)
+            if self.on_flush is not None:
+                self.on_flush(rows)
+
+    def _committed(self, rows, result):
+        if self.on_commit is not None:
+            self.on_commit(rows)
+
+    def stats(self):
+        """Queue depth, flush latency and drop counters"""
+        with self._stats_lock:
+            counters = self._counters()
+        return {
+            'running': counters['running'],
+            'queue_depth': counters['queue_depth'],
+            'queue_capacity': counters['queue_capacity'],
+            'flush_interval_ms': counters['flush_interval_ms'],
+            'flush_rows': self.flush_rows,
+            'rows_enqueued': counters['submitted'],
+            'rows_written': counters['done'],
+            'rows_dropped': counters['dropped'],
+            'rows_failed': counters['failed'],
+            'flushes': counters['batches'],
+            'avg_rows_per_flush': counters['avg_batch_size'],
+            'last_flush_ms': counters['last_batch_ms'],
+            'avg_flush_ms': counters['avg_batch_ms'],
+            'max_flush_ms': counters['max_batch_ms'],
+            'last_flush_at': counters['last_batch_at'],
+            'avg_lag_ms': counters['avg_lag_ms'],
+            'max_lag_ms': counters['max_lag_ms']
+        }
+
+
+__all__ = ['SQLitePool', 'BatchWorker', 'WriteBehindQueue', 'apply_migrations', 'get_schema_version', 'DEFAULT_PRAGMAS', 'DEFAULT_STATEMENT_CACHE_SIZE']
@@ -0,0 +1,48 @@
+"""
+ETag process tokens across forked workers
+
+Run with: python -m pytest backend/test_http_cache.py
+"""
+
+import os
+
+import pytest
+
+import http_cache
+from http_cache import make_etag
+
+
+def test_simulated_fork_renews_token():
+    before = make_etag('controls', 1)
+    token = http_cache._PROCESS_TOKEN
+    try:
+        http_cache._PROCESS_TOKEN = 'parent'
+        parent_tag = make_etag('controls', 1)
+        http_cache._reset_process_token()
+        assert make_etag('controls', 1) != parent_tag
+    finally:
+        http_cache._PROCESS_TOKEN = token
+    assert make_etag('controls', 1) == before
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_forked_workers_issue_different_tags():
+    # Like gunicorn --preload: the module is imported once, then workers fork
+    parent_tag = make_etag('controls', 1)
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            os.write(write_fd, make_etag('controls', 1).encode())
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        child_tag = pipe.read()
+    os.waitpid(pid, 0)
+
+    assert child_tag
+    assert child_tag != parent_tag
+    # Same scope, version and variant: only the process token differs
+    assert child_tag.split('-')[-2:] == parent_tag.split('-')[-2:]
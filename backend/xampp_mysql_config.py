@@ -269,6 +269,37 @@ class SensorDataDB:
             logger.error(f"Error getting latest data: {e}")
             return None
     
+    @staticmethod
+    def get_latest_per_device():
+        """Get the latest sensor data row of every device"""
+        conn = get_connection()
+        if not conn:
+            return None
+            
+        try:
+            cursor = conn.cursor(dictionary=True)
+            
+            query = """
+                SELECT s.* FROM sensor_data s
+                JOIN (
+                    SELECT device_id, MAX(id) AS id
+                    FROM sensor_data
+                    GROUP BY device_id
+                ) latest ON s.id = latest.id
+            """
+            
+            cursor.execute(query)
+            results = cursor.fetchall()
+            
+            cursor.close()
+            conn.close()
+            
+            return results
+            
+        except Error as e:
+            logger.error(f"Error getting latest data per device: {e}")
+            return None
+    
     @staticmethod
     def get_historical_data(device_id=1, hours=24, limit=100):
         """Get historical sensor data for charts"""
@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+In-process HTTP benchmark for the Flask APIs
+
+Drives greenhouse_api.py, sensor_api.py and backend/app.py through the Flask
+test client (no sockets, no server) against scratch databases in a temporary
+directory. Each app is seeded with synthetic device traffic, then every
+endpoint is replayed --requests times and reported as throughput plus
+p50/p95/p99 latency per route. backend/app_mysql.py needs a MySQL server and
+is not covered.
+
+Results can be saved as a JSON baseline and later runs compared against it;
+the comparison exits with status 1 when a route's p50/p95 latency or its
+throughput regresses by more than --tolerance.
+
+Usage:
+    python benchmarks/api_benchmark.py --app all --save-baseline
+    python benchmarks/api_benchmark.py --app greenhouse --compare
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARK_DIR)
+BACKEND_DIR = os.path.join(ROOT_DIR, 'backend')
+BASELINE_DIR = os.path.join(BENCHMARK_DIR, 'baselines')
+
+# backend/ goes first so `import app` finds backend/app.py, not the Expo app/ folder
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, BACKEND_DIR)
+
+# Scratch databases only: no retention runs and no background threads
+os.environ.setdefault('GREENHOUSE_RETENTION_DAYS', '0')
+os.environ.setdefault('TERRAPONIX_RETENTION_DAYS', '0')
+os.environ['TERRAPONIX_DEFER_BACKGROUND_TASKS'] = '1'
+
+APPS = ('greenhouse', 'sensor', 'backend')
+
+
+def route(name, prepare, expect=(200,), first_chunk=False):
+    """One benchmarked request
+
+    prepare(client, i) returns the keyword arguments of client.open() for
+    iteration i; anything it sends itself (setup requests) is not timed.
+    first_chunk times only the first body chunk of an endless stream.
+    """
+    return {'name': name, 'prepare': prepare, 'expect': expect, 'first_chunk': first_chunk}
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of sorted samples"""
+    return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+
+def summarize(samples, elapsed, errors, statuses):
+    samples.sort()
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(samples) / len(samples), 3),
+        'p50_ms': round(percentile(samples, 0.50), 3),
+        'p95_ms': round(percentile(samples, 0.95), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+        'max_ms': round(samples[-1], 3)
+    }
+
+
+def run_route(client, spec, requests, warmup):
+    """Replay one route and return its latency summary"""
+    samples = []
+    statuses = {}
+    errors = 0
+    elapsed = 0.0
+    for i in range(-warmup, requests):
+        kwargs = spec['prepare'](client, i)
+        started = time.perf_counter()
+        response = client.open(**kwargs)
+        if spec['first_chunk']:
+            next(response.iter_encoded(), b'')
+        else:
+            response.get_data()
+        duration = time.perf_counter() - started
+        response.close()
+        if i < 0:
+            continue
+        elapsed += duration
+        samples.append(duration * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if response.status_code not in spec['expect']:
+            errors += 1
+    return summarize(samples, elapsed, errors, statuses)
+
+
+# --- greenhouse_api.py -------------------------------------------------------
+
+def greenhouse_routes(module, devices):
+    from greenhouse_simulator import generate_reading
+    from greenhouse_binary import READING_MIMETYPE, encode_reading
+
+    device_ids = [f'bench_greenhouse_{d:02d}' for d in range(devices)]
+
+    def device(i):
+        return device_ids[i % len(device_ids)]
+
+    def reading(i):
+        return generate_reading(device(i), i % len(device_ids))
+
+    def post_command(client, i, actuator=None):
+        return client.post('/api/greenhouse-control', json={
+            'device_id': device(i), 'device': actuator or random.choice(['pump', 'fan', 'curtain']),
+            'value': random.choice([True, False])
+        })
+
+    def lease_one(client, i):
+        post_command(client, i, 'pump')
+        commands = client.get(f'/api/greenhouse-control?device_id={device(i)}').get_json()['commands']
+        return {'method': 'POST', 'path': '/api/greenhouse-control/ack',
+                'json': {'device_id': device(i), 'command_ids': [c['id'] for c in commands]}}
+
+    def poll(client, i):
+        post_command(client, i)
+        return {'method': 'GET', 'path': f'/api/greenhouse-control?device_id={device(i)}&ack=auto'}
+
+    def status_revalidation(client, i):
+        path = f'/api/greenhouse/status?device_id={device(i)}'
+        etag = client.get(path).headers.get('ETag')
+        return {'method': 'GET', 'path': path, 'headers': {'If-None-Match': etag}}
+
+    def seed(client, readings_per_device):
+        now = time.time()
+        for device_id in device_ids:
+            client.post('/api/register', json={'device_id': device_id, 'device_type': 'greenhouse_controller',
+                                               'ip_address': '192.168.1.100'})
+            for start in range(0, readings_per_device, 100):
+                count = min(100, readings_per_device - start)
+                body = b''.join(
+                    encode_reading(generate_reading(device_id, 0), now - (start + n) * 60)
+                    for n in range(count)
+                )
+                client.post('/api/greenhouse-data/batch', data=body, content_type=READING_MIMETYPE)
+
+    routes = [
+        route('GET /', lambda c, i: {'method': 'GET', 'path': '/'}),
+        route('POST /api/register', lambda c, i: {'method': 'POST', 'path': '/api/register', 'json': {
+            'device_id': device(i), 'device_type': 'greenhouse_controller', 'ip_address': '192.168.1.100'}}),
+        route('POST /api/greenhouse-data', lambda c, i: {
+            'method': 'POST', 'path': '/api/greenhouse-data', 'json': reading(i)}),
+        route('POST /api/greenhouse-data [binary]', lambda c, i: {
+            'method': 'POST', 'path': '/api/greenhouse-data', 'data': encode_reading(reading(i)),
+            'content_type': READING_MIMETYPE}),
+        route('POST /api/greenhouse-data/batch [10]', lambda c, i: {
+            'method': 'POST', 'path': '/api/greenhouse-data/batch',
+            'json': {'readings': [reading(i) for _ in range(10)]}}),
+        route('POST /api/greenhouse-control', lambda c, i: {
+            'method': 'POST', 'path': '/api/greenhouse-control',
+            'json': {'device_id': device(i), 'device': 'fan', 'value': i % 2 == 0}}),
+        route('GET /api/greenhouse-control', poll),
+        route('POST /api/greenhouse-control/ack', lease_one),
+        route('GET /api/greenhouse/status', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/status?device_id={device(i)}'}),
+        route('GET /api/greenhouse/status [304]', status_revalidation, expect=(304,)),
+        route('GET /api/greenhouse/stream [first event]', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/stream?device_id={device(i)}'}, first_chunk=True),
+        route('GET /api/greenhouse/history', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/history?device_id={device(i)}&hours=24&limit=100'}),
+        route('GET /api/greenhouse/history [gzip]', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/history?device_id={device(i)}&hours=24&limit=100',
+            'headers': {'Accept-Encoding': 'gzip'}}),
+        route('GET /api/greenhouse/history [ndjson]', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/history?device_id={device(i)}&hours=24&stream=ndjson'}),
+        route('GET /api/greenhouse/history [points=200]', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/history?device_id={device(i)}&hours=24&points=200'}),
+        route('GET /api/greenhouse/aggregate', lambda c, i: {
+            'method': 'GET', 'path': f'/api/greenhouse/aggregate?device_id={device(i)}&hours=24&bucket=1h'}),
+        route('GET /api/devices', lambda c, i: {'method': 'GET', 'path': '/api/devices'}),
+        route('GET /api/db/stats', lambda c, i: {'method': 'GET', 'path': '/api/db/stats'}),
+        route('GET /dashboard', lambda c, i: {'method': 'GET', 'path': '/dashboard'}),
+    ]
+    return seed, routes
+
+
+# --- sensor_api.py -----------------------------------------------------------
+
+SENSOR_TYPES = (('temperature', '°C', 20.0, 35.0), ('humidity', '%', 40.0, 80.0),
+                ('ph', 'pH', 6.0, 8.0), ('light', 'lux', 100.0, 4000.0))
+
+
+def sensor_routes(module, devices):
+    sensor_ids = [f'bench_sensor_{d:02d}' for d in range(devices)]
+
+    def sensor(i):
+        sensor_type, unit, low, high = SENSOR_TYPES[i % len(SENSOR_TYPES)]
+        return sensor_ids[i % len(sensor_ids)], sensor_type, unit, low, high
+
+    def data(i):
+        sensor_id, sensor_type, unit, low, high = sensor(i)
+        return {'sensor_id': sensor_id, 'sensor_type': sensor_type, 'unit': unit,
+                'value': round(random.uniform(low, high), 2)}
+
+    def seed(client, readings_per_device):
+        for i, sensor_id in enumerate(sensor_ids):
+            client.post('/api/sensor/register', json={'sensor_id': sensor_id,
+                                                      'sensor_type': sensor(i)[1]})
+        for n in range(readings_per_device * len(sensor_ids)):
+            client.post('/api/sensor/data', json=data(n))
+
+    routes = [
+        route('GET /', lambda c, i: {'method': 'GET', 'path': '/'}),
+        route('POST /api/sensor/register', lambda c, i: {'method': 'POST', 'path': '/api/sensor/register',
+                                                         'json': {'sensor_id': sensor(i)[0],
+                                                                  'sensor_type': sensor(i)[1]}}),
+        route('POST /api/sensor/data', lambda c, i: {'method': 'POST', 'path': '/api/sensor/data', 'json': data(i)}),
+        route('GET /api/sensor/data/<id>', lambda c, i: {'method': 'GET', 'path': f'/api/sensor/data/{sensor(i)[0]}'}),
+        route('GET /api/sensors/all', lambda c, i: {'method': 'GET', 'path': '/api/sensors/all'}),
+        route('GET /api/sensor/history/<id>', lambda c, i: {
+            'method': 'GET', 'path': f'/api/sensor/history/{sensor(i)[0]}?limit=100'}),
+        route('GET /api/sensor/history/<id> [ndjson]', lambda c, i: {
+            'method': 'GET', 'path': f'/api/sensor/history/{sensor(i)[0]}?limit=1000&stream=ndjson'}),
+        route('GET /api/sensor/status', lambda c, i: {'method': 'GET', 'path': '/api/sensor/status'}),
+        route('GET /api/db/stats', lambda c, i: {'method': 'GET', 'path': '/api/db/stats'}),
+    ]
+    return seed, routes
+
+
+# --- backend/app.py ----------------------------------------------------------
+
+def backend_routes(module, devices):
+    def reading(i):
+        return {
+            'temperature': round(random.uniform(18.0, 34.0), 1),
+            'humidity': round(random.uniform(45.0, 90.0), 1),
+            'ph': round(random.uniform(5.0, 7.0), 2),
+            'tds': round(random.uniform(250.0, 900.0), 1),
+            'light_intensity': random.randint(100, 4000),
+            'co2': random.randint(350, 1200),
+            'soil_moisture': random.randint(20, 90),
+            'water_level': random.randint(10, 100)
+        }
+
+    def controls(i):
+        return {'pump_auto': True, 'fan_auto': i % 2 == 0, 'curtain_auto': True,
+                'pump_status': False, 'fan_status': i % 2 == 1, 'curtain_status': False,
+                'temp_threshold_min': 20.0, 'temp_threshold_max': 30.0,
+                'humidity_threshold_min': 60.0, 'humidity_threshold_max': 80.0,
+                'ph_threshold_min': 5.5, 'ph_threshold_max': 6.5}
+
+    def controls_revalidation(client, i):
+        etag = client.get('/api/controls').headers.get('ETag')
+        return {'method': 'GET', 'path': '/api/controls', 'headers': {'If-None-Match': etag}}
+
+    def seed(client, readings_per_device):
+        for n in range(readings_per_device * devices):
+            client.post('/api/sensor-data', json=reading(n))
+
+    routes = [
+        route('POST /api/sensor-data', lambda c, i: {'method': 'POST', 'path': '/api/sensor-data',
+                                                     'json': reading(i)}),
+        route('GET /api/current-data', lambda c, i: {'method': 'GET', 'path': '/api/current-data'}),
+        route('GET /api/historical-data', lambda c, i: {'method': 'GET',
+                                                        'path': '/api/historical-data?hours=24&limit=100'}),
+        route('GET /api/historical-data [gzip]', lambda c, i: {
+            'method': 'GET', 'path': '/api/historical-data?hours=24&limit=100',
+            'headers': {'Accept-Encoding': 'gzip'}}),
+        route('GET /api/controls', lambda c, i: {'method': 'GET', 'path': '/api/controls'}),
+        route('GET /api/controls [304]', controls_revalidation, expect=(304,)),
+        route('POST /api/controls', lambda c, i: {'method': 'POST', 'path': '/api/controls',
+                                                  'json': controls(i)}),
+        route('GET /api/alerts', lambda c, i: {'method': 'GET', 'path': '/api/alerts'}),
+        route('GET /api/alerts/active', lambda c, i: {'method': 'GET', 'path': '/api/alerts/active'}),
+        route('POST /api/device-command', lambda c, i: {'method': 'POST', 'path': '/api/device-command',
+                                                        'json': {'command': 'pump', 'value': i % 2 == 0}}),
+        route('GET /api/health', lambda c, i: {'method': 'GET', 'path': '/api/health'}),
+        route('GET /api/db/stats', lambda c, i: {'method': 'GET', 'path': '/api/db/stats'}),
+    ]
+    return seed, routes
+
+
+SCENARIOS = {
+    'greenhouse': ('greenhouse_api', greenhouse_routes),
+    'sensor': ('sensor_api', sensor_routes),
+    'backend': ('app', backend_routes),
+}
+
+
+def benchmark_app(name, requests, warmup, devices, seed_readings, only=None):
+    """Import an app in the scratch directory, seed it and time each route"""
+    import importlib
+    module_name, build = SCENARIOS[name]
+    module = importlib.import_module(module_name)
+    # Background workers (alert evaluation, write-behind) take part as in production
+    if hasattr(module, 'start_background_tasks'):
+        module.start_background_tasks()
+    seed, routes = build(module, devices)
+    client = module.app.test_client()
+
+    started = time.perf_counter()
+    seed(client, seed_readings)
+    print(f"   seeded {seed_readings} readings per device in {time.perf_counter() - started:.1f}s")
+
+    results = {}
+    for spec in routes:
+        if only and only not in spec['name']:
+            continue
+        results[spec['name']] = result = run_route(client, spec, requests, warmup)
+        flag = f"  ⚠️ {result['errors']} unexpected status" if result['errors'] else ''
+        print(f"   {spec['name']:<44}{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.3f}"
+              f"{result['p95_ms']:>10.3f}{result['p99_ms']:>10.3f}{flag}")
+
+    if hasattr(module, 'stop_background_tasks'):
+        module.stop_background_tasks()
+    return results
+
+
+def compare(baseline, results, tolerance, min_delta_ms):
+    """Regressed routes as (route, metric, baseline value, current value)"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('routes', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            before, after = previous[metric], current[metric]
+            if after > before * (1 + tolerance) and after - before > min_delta_ms:
+                regressions.append((name, metric, before, after))
+        before, after = previous['throughput_rps'], current['throughput_rps']
+        if before and after is not None and after < before * (1 - tolerance) \
+                and 1000 / after - 1000 / before > min_delta_ms:
+            regressions.append((name, 'throughput_rps', before, after))
+    return regressions
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f'api_{name}.json')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Flask API routes in-process')
+    parser.add_argument('--app', choices=APPS + ('all',), default='all', help='app to benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests per route first')
+    parser.add_argument('--devices', type=int, default=5, help='simulated devices (sensors)')
+    parser.add_argument('--seed-readings', type=int, default=500, help='readings stored per device before timing')
+    parser.add_argument('--route', help='only routes whose name contains this text')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the synthetic traffic')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help=f'write results to {os.path.relpath(BASELINE_DIR, ROOT_DIR)}/api_<app>.json')
+    parser.add_argument('--compare', action='store_true', help='compare against the saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown before a route counts as regressed')
+    parser.add_argument('--min-delta-ms', type=float, default=0.2,
+                        help='ignore latency differences smaller than this (timer noise)')
+    parser.add_argument('--output', help='also write all results to this JSON file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    output = os.path.abspath(args.output) if args.output else None
+    apps = APPS if args.app == 'all' else (args.app,)
+    scratch = tempfile.mkdtemp(prefix='terraponix_api_bench_')
+    # The apps open their databases relative to the working directory
+    os.chdir(scratch)
+
+    print("🌱 Terraponix API Benchmark")
+    print("=" * 50)
+    print(f"📦 Scratch directory: {scratch}")
+    print(f"⚙️ {args.requests} requests per route (+{args.warmup} warmup), {args.devices} devices")
+
+    runs = {}
+    failed = False
+    try:
+        for name in apps:
+            print(f"\n⏱️ {name}")
+            print(f"   {'route':<44}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+            results = benchmark_app(name, args.requests, args.warmup, args.devices,
+                                    args.seed_readings, args.route)
+            runs[name] = run = {
+                'app': name,
+                'created': datetime.datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'parameters': {'requests': args.requests, 'warmup': args.warmup, 'devices': args.devices,
+                               'seed_readings': args.seed_readings, 'seed': args.seed},
+                'routes': results
+            }
+            failed = failed or any(r['errors'] for r in results.values())
+
+            if args.compare:
+                path = baseline_path(name)
+                if not os.path.exists(path):
+                    print(f"   ℹ️ No baseline at {path}, nothing to compare")
+                else:
+                    with open(path) as f:
+                        regressions = compare(json.load(f), results, args.tolerance, args.min_delta_ms)
+                    for route_name, metric, before, after in regressions:
+                        print(f"   ❌ {route_name}: {metric} {before} -> {after}")
+                    if regressions:
+                        failed = True
+                    else:
+                        print(f"   ✅ Within {args.tolerance:.0%} of the baseline")
+
+            if args.save_baseline:
+                os.makedirs(BASELINE_DIR, exist_ok=True)
+                with open(baseline_path(name), 'w') as f:
+                    json.dump(run, f, indent=2)
+                    f.write('\n')
+                print(f"   💾 Baseline saved to {baseline_path(name)}")
+    finally:
+        os.chdir(ROOT_DIR)
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(runs, f, indent=2)
+            f.write('\n')
+        print(f"\n💾 Results written to {output}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Greenhouse index benchmark
+
+Builds a scratch greenhouse database at schema version 1 (no indexes), times
+the history query and the pending-command poll, applies the remaining
+migrations (indexes and rollup tables) and times them again. Finally compares
+a month of hourly aggregates read from raw rows and from the rollup tier.
+
+Usage:
+    python benchmarks/index_benchmark.py --rows 1000000 --devices 20
+"""
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.sqlite_pool import SQLitePool, apply_migrations, get_schema_version
+from greenhouse_schema import GREENHOUSE_MIGRATIONS, NUMERIC_METRICS
+from greenhouse_aggregate import build_aggregate_sql
+from greenhouse_rollup import build_rollup_aggregate_sql, pick_aggregate_tier, reading_epoch
+
+HISTORY_SQL = '''
+    SELECT * FROM greenhouse_data
+    WHERE device_id = ? AND timestamp > ?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+
+INSERT_READING_SQL = '''
+    INSERT INTO greenhouse_data
+    (device_id, timestamp, temperature, humidity, ph, light_intensity,
+     water_level, water_status, soil_moisture, curtain_status, pump_status,
+     fan_status, mode, wifi_status, ip_address, wifi_signal)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+PENDING_COMMANDS_SQL = '''
+    SELECT * FROM control_commands
+    WHERE device_id = ? AND executed = FALSE
+    ORDER BY timestamp ASC
+'''
+
+def populate(db, rows, devices, commands):
+    """Fill the scratch database with synthetic readings and commands"""
+    start = datetime.datetime.now() - datetime.timedelta(days=30)
+    step = datetime.timedelta(days=30) / max(rows // devices, 1)
+    batch = []
+
+    with db.transaction():
+        for i in range(rows):
+            device = f'greenhouse_{i % devices:03d}'
+            timestamp = (start + step * (i // devices)).isoformat()
+            batch.append((
+                device, timestamp, random.uniform(18, 34), random.uniform(35, 85),
+                random.uniform(5.5, 7.8), random.randint(0, 4095), random.randint(0, 4095),
+                'OK', random.randint(0, 100), 'OPEN', 'OFF', 'OFF', 'AUTO',
+                'CONNECTED', '192.168.1.50', random.randint(-90, -40)
+            ))
+            if len(batch) >= 10000:
+                db.executemany(INSERT_READING_SQL, batch)
+                batch = []
+        if batch:
+            db.executemany(INSERT_READING_SQL, batch)
+
+        # Almost every historical command has been executed; a few are pending
+        db.executemany('''
+            INSERT INTO control_commands
+            (device_id, command_type, device_name, value, timestamp, executed)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [
+            (f'greenhouse_{i % devices:03d}', 'control', random.choice(['pump', 'fan', 'curtain']),
+             random.choice(['True', 'False']), (start + step * i).isoformat(), i < commands - devices)
+            for i in range(commands)
+        ])
+
+def time_query(db, sql, params_list, iterations):
+    """Run a query repeatedly and return latency percentiles in milliseconds"""
+    samples = []
+    for i in range(iterations):
+        params = params_list[i % len(params_list)]
+        started = time.perf_counter()
+        db.query(sql, params)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'p50': statistics.median(samples),
+        'p95': samples[int(len(samples) * 0.95) - 1],
+        'max': samples[-1]
+    }
+
+def query_plan(db, sql, params):
+    return '; '.join(row[-1] for row in db.query('EXPLAIN QUERY PLAN ' + sql, params))
+
+def run(rows, devices, commands, iterations):
+    path = os.path.join(tempfile.mkdtemp(prefix='greenhouse_bench_'), 'greenhouse_bench.db')
+    db = SQLitePool(path)
+
+    print(f"📦 Building scratch database with {rows:,} readings for {devices} devices...")
+    apply_migrations(db, GREENHOUSE_MIGRATIONS[:1])
+    started = time.perf_counter()
+    populate(db, rows, devices, commands)
+    print(f"   done in {time.perf_counter() - started:.1f}s ({path})")
+
+    threshold = (datetime.datetime.now() - datetime.timedelta(hours=24)).isoformat()
+    history_params = [(f'greenhouse_{d:03d}', threshold, 100) for d in range(devices)]
+    command_params = [(f'greenhouse_{d:03d}',) for d in range(devices)]
+
+    results = {}
+    for phase in ('before', 'after'):
+        if phase == 'after':
+            started = time.perf_counter()
+            apply_migrations(db, GREENHOUSE_MIGRATIONS)
+            print(f"\n🗄️ Migrated to schema version {get_schema_version(db)} "
+                  f"in {time.perf_counter() - started:.1f}s")
+
+        print(f"\n⏱️ Schema version {get_schema_version(db)} ({phase} migration)")
+        print(f"   history plan: {query_plan(db, HISTORY_SQL, history_params[0])}")
+        print(f"   command plan: {query_plan(db, PENDING_COMMANDS_SQL, command_params[0])}")
+        results[phase] = {
+            'history': time_query(db, HISTORY_SQL, history_params, iterations),
+            'command_poll': time_query(db, PENDING_COMMANDS_SQL, command_params, iterations)
+        }
+
+    print("\n📊 Latency (ms)")
+    print(f"   {'query':<14}{'before p50':>12}{'after p50':>12}{'before p95':>12}{'after p95':>12}{'speedup':>10}")
+    for name in ('history', 'command_poll'):
+        before, after = results['before'][name], results['after'][name]
+        speedup = before['p50'] / after['p50'] if after['p50'] else float('inf')
+        print(f"   {name:<14}{before['p50']:>12.3f}{after['p50']:>12.3f}"
+              f"{before['p95']:>12.3f}{after['p95']:>12.3f}{speedup:>9.1f}x")
+
+    # A month of hourly buckets: raw scan versus the rollup tier
+    end = datetime.datetime.now()
+    start = end - datetime.timedelta(days=30)
+    tier, tier_width = pick_aggregate_tier(3600)
+    first, last = reading_epoch(start.isoformat()) // tier_width, reading_epoch(end.isoformat()) // tier_width + 1
+    raw_params = [(3600, f'greenhouse_{d:03d}', start.isoformat(), end.isoformat(), 3600) for d in range(devices)]
+    rollup_params = [(f'greenhouse_{d:03d}', first, last) for d in range(devices)]
+    aggregate_iterations = max(iterations // 10, 5)
+    results['aggregate_raw'] = time_query(db, build_aggregate_sql(NUMERIC_METRICS), raw_params, aggregate_iterations)
+    results['aggregate_rollup'] = time_query(
+        db, build_rollup_aggregate_sql(tier, 3600 // tier_width, NUMERIC_METRICS), rollup_params, aggregate_iterations
+    )
+    raw, rollup = results['aggregate_raw'], results['aggregate_rollup']
+    print(f"\n📈 30 days of 1h buckets: raw p50 {raw['p50']:.1f}ms, rollup_{tier} p50 {rollup['p50']:.1f}ms "
+          f"({raw['p50'] / rollup['p50'] if rollup['p50'] else float('inf'):.1f}x)")
+
+    db.close_all()
+    shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark greenhouse_data.db indexes')
+    parser.add_argument('--rows', type=int, default=500000, help='synthetic readings to insert')
+    parser.add_argument('--devices', type=int, default=20, help='number of devices')
+    parser.add_argument('--commands', type=int, default=50000, help='control commands to insert')
+    parser.add_argument('--iterations', type=int, default=200, help='queries per measurement')
+    args = parser.parse_args()
+
+    print("🌱 Terraponix Greenhouse Index Benchmark")
+    print("=" * 50)
+    run(args.rows, args.devices, args.commands, args.iterations)
+
+if __name__ == "__main__":
+    main()
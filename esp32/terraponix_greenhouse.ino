@@ -13,6 +13,10 @@ const char* password = "jougen92";
 const char* serverURL = "http://192.168.106.38:5000/api/greenhouse-data";
 const char* controlURL = "http://192.168.106.38:5000/api/greenhouse-control";
 
+// Uplink format: uncomment to send the compact binary reading
+// (application/x-terraponix-reading, ~41 bytes) instead of JSON
+// #define USE_BINARY_UPLINK
+
 // Pin Definitions
 #define DHTPIN 25         // Pin DHT11
 #define DHTTYPE DHT11
@@ -271,7 +275,73 @@ void printSensorData() {
   Serial.println("================================\n");
 }
 
+#ifdef USE_BINARY_UPLINK
+// Layout must match greenhouse_binary.py (format version 1, little-endian)
+struct __attribute__((packed)) BinaryReading {
+  uint8_t version;
+  uint8_t flags;
+  float temperature;
+  float humidity;
+  float ph;
+  uint16_t light_intensity;
+  uint16_t water_level;
+  uint8_t soil_moisture;
+  int8_t wifi_signal;
+  uint8_t ip_address[4];
+  uint8_t device_id_length;
+};
+
+void sendGreenhouseDataBinary() {
+  const char* deviceId = "greenhouse_esp32";
+  uint8_t payload[sizeof(BinaryReading) + 32];
+  
+  BinaryReading reading;
+  reading.version = 1;
+  reading.flags = 0;
+  if (currentData.water_status == "OK") reading.flags |= 0x01;
+  if (currentData.curtain_status == "OPEN") reading.flags |= 0x02;
+  if (currentData.pump_status == "ON") reading.flags |= 0x04;
+  if (currentData.fan_status == "ON") reading.flags |= 0x08;
+  if (currentData.mode == "MANUAL") reading.flags |= 0x10;
+  if (WiFi.status() == WL_CONNECTED) reading.flags |= 0x20;
+  reading.temperature = currentData.temperature;  // NaN when the DHT read failed
+  reading.humidity = currentData.humidity;
+  reading.ph = currentData.ph;
+  reading.light_intensity = currentData.light_intensity;
+  reading.water_level = currentData.water_level;
+  reading.soil_moisture = constrain(currentData.soil_moisture, 0, 255);
+  reading.wifi_signal = constrain(WiFi.RSSI(), -128, 127);
+  IPAddress ip = WiFi.localIP();
+  for (int i = 0; i < 4; i++) reading.ip_address[i] = ip[i];
+  reading.device_id_length = strlen(deviceId);
+  
+  memcpy(payload, &reading, sizeof(reading));
+  memcpy(payload + sizeof(reading), deviceId, reading.device_id_length);
+  size_t length = sizeof(reading) + reading.device_id_length;
+  
+  HTTPClient http;
+  http.begin(serverURL);
+  http.addHeader("Content-Type", "application/x-terraponix-reading");
+  
+  Serial.printf("📡 Sending %u byte binary reading to server...\n", length);
+  int httpResponseCode = http.POST(payload, length);
+  
+  if (httpResponseCode > 0) {
+    Serial.printf("✅ Server Response: %d\n", httpResponseCode);
+  } else {
+    Serial.printf("❌ HTTP Error: %d\n", httpResponseCode);
+    Serial.println("⚠️ Failed to send data to server");
+  }
+  
+  http.end();
+}
+#endif
+
 void sendGreenhouseData() {
+#ifdef USE_BINARY_UPLINK
+  sendGreenhouseDataBinary();
+  return;
+#endif
   HTTPClient http;
   http.begin(serverURL);
   http.addHeader("Content-Type", "application/json");
@@ -329,9 +399,18 @@ void checkForControlCommands() {
     if (deserializeJson(doc, response) == DeserializationError::Ok) {
       if (doc.containsKey("commands")) {
         JsonArray commands = doc["commands"];
+        DynamicJsonDocument ack(512);
+        ack["device_id"] = "greenhouse_esp32";
+        JsonArray ackIds = ack.createNestedArray("command_ids");
         for (JsonObject cmd : commands) {
           executeControlCommand(cmd);
+          ackIds.add(cmd["id"].as<long>());
+        }
+        http.end();
+        if (ackIds.size() > 0) {
+          acknowledgeCommands(ack);
         }
+        return;
       }
     }
   }
@@ -339,6 +418,22 @@ void checkForControlCommands() {
   http.end();
 }
 
+void acknowledgeCommands(DynamicJsonDocument& ack) {
+  // Unacknowledged commands are redelivered by the server after their lease expires
+  HTTPClient http;
+  http.begin(String(controlURL) + "/ack");
+  http.addHeader("Content-Type", "application/json");
+  
+  String jsonString;
+  serializeJson(ack, jsonString);
+  int httpResponseCode = http.POST(jsonString);
+  if (httpResponseCode != 200) {
+    Serial.printf("⚠️ Command ack failed: %d\n", httpResponseCode);
+  }
+  
+  http.end();
+}
+
 void executeControlCommand(JsonObject command) {
   String action = command["action"];
   String device = command["device"];
@@ -0,0 +1,92 @@
+"""
+Time-bucketed aggregation over greenhouse_data
+
+Groups readings into fixed buckets (1m, 5m, 1h, 1d) inside SQLite using an
+integer bucket number derived from the reading's epoch seconds, and returns
+min, max, mean, count and last per metric for every bucket.
+"""
+
+import datetime
+
+from greenhouse_schema import NUMERIC_METRICS as AGGREGATE_METRICS, INTEGER_METRICS
+
+# Supported bucket widths in seconds
+BUCKET_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '1h': 3600,
+    '1d': 86400
+}
+
+# Refuse requests that would return more buckets than this
+MAX_BUCKETS = 10000
+
+# Integer bucket number of a stored timestamp (ISO text, treated as naive time)
+BUCKET_EXPR = "CAST(strftime('%s', timestamp) AS INTEGER) / ?"
+
+
+def build_aggregate_sql(metrics):
+    """SQL returning one row per bucket: bucket, count, then min/max/avg/count/last per metric
+
+    "last" is the metric's value in the bucket's most recent reading. A single
+    shared window keeps it to one sort, whatever the number of metrics.
+    """
+    last_columns = ',\n'.join(
+        f'FIRST_VALUE({m}) OVER latest AS last_{m}' for m in metrics
+    )
+    aggregates = ',\n'.join(
+        f'MIN({m}), MAX({m}), AVG({m}), COUNT({m}), MAX(last_{m})' for m in metrics
+    )
+    return f'''
+        SELECT bucket, COUNT(*), {aggregates}
+        FROM (
+            SELECT {BUCKET_EXPR} AS bucket, {', '.join(metrics)},
+                   {last_columns}
+            FROM greenhouse_data
+            WHERE device_id = ? AND timestamp >= ? AND timestamp < ?
+            WINDOW latest AS (PARTITION BY {BUCKET_EXPR} ORDER BY timestamp DESC)
+        )
+        GROUP BY bucket
+        ORDER BY bucket
+    '''
+
+
+def bucket_start(bucket, width):
+    """ISO timestamp for the start of a bucket number"""
+    start = datetime.datetime.fromtimestamp(bucket * width, datetime.timezone.utc)
+    return start.replace(tzinfo=None).isoformat()
+
+
+def format_bucket_rows(rows, width, metrics):
+    """Turn aggregate rows into the API's bucket dictionaries"""
+    buckets = []
+    for row in rows:
+        bucket = {
+            'bucket_start': bucket_start(row[0], width),
+            'count': row[1]
+        }
+        for i, metric in enumerate(metrics):
+            low, high, mean, count, last = row[2 + i * 5:7 + i * 5]
+            if metric in INTEGER_METRICS:
+                low, high, last = (None if v is None else int(v) for v in (low, high, last))
+            bucket[metric] = {
+                'min': low,
+                'max': high,
+                'mean': round(mean, 4) if mean is not None else None,
+                'count': count,
+                'last': last
+            }
+        buckets.append(bucket)
+    return buckets
+
+
+def aggregate_history(db, device_id, start, end, width, metrics):
+    """Aggregate a device's readings in [start, end) into buckets of `width` seconds"""
+    rows = db.query(build_aggregate_sql(metrics), (width, device_id, start, end, width))
+    return format_bucket_rows(rows, width, metrics)
+
+
+__all__ = [
+    'BUCKET_SECONDS', 'MAX_BUCKETS', 'AGGREGATE_METRICS',
+    'build_aggregate_sql', 'bucket_start', 'format_bucket_rows', 'aggregate_history'
+]
@@ -1,81 +1,282 @@
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
 import json
 import datetime
-import sqlite3
+import os
+import atexit
 import threading
 import time
-from collections import deque
+import zlib
+from collections import deque, namedtuple
+from types import MappingProxyType
+
+from backend.sqlite_pool import SQLitePool, WriteBehindQueue, apply_migrations, get_schema_version
+from backend.json_stream import STREAM_FORMATS, streaming_response
+from backend.pagination import SEEK_BEFORE_SQL, decode_cursor, split_page
+from backend.segment_archive import SegmentArchive, RetentionJob, iter_archived_days, read_archived_rows, merge_newest
+from backend.http_cache import VersionCounter, ResponseCompressor, make_etag, conditional_response
+from greenhouse_schema import GREENHOUSE_MIGRATIONS, READING_COLUMNS, rollup_table
+from greenhouse_binary import READING_MIMETYPE, decode_readings
+from greenhouse_downsample import (
+    CHART_METRICS, numpy_available, load_history_arrays, load_rollup_arrays, window_arrays, downsample_series
+)
+from greenhouse_aggregate import (
+    BUCKET_SECONDS, MAX_BUCKETS, AGGREGATE_METRICS, aggregate_history, bucket_start, format_bucket_rows
+)
+from greenhouse_rollup import update_rollups, pick_tier, aggregate_from_rollup, reading_epoch
+from greenhouse_window import RecentWindow, aggregate_window, to_micros
+from greenhouse_commands import CommandQueue
 
 app = Flask(__name__)
 CORS(app)  # Enable cross-origin requests
 
+# gzip/brotli for large JSON bodies, negotiated per request
+compressor = ResponseCompressor(min_size=int(os.getenv('GREENHOUSE_COMPRESS_MIN_BYTES', 1024))).init_app(app)
+
+# Change counters behind the ETags of the read endpoints: stored readings per
+# device (history, aggregates) and device registrations. Status ETags come
+# from the status snapshot versions (see StatusBoard).
+data_versions = VersionCounter()
+device_versions = VersionCounter()
+
+# Relative ranges (?hours=) slide with the clock, so their tags also expire
+HISTORY_ETAG_SECONDS = int(os.getenv('GREENHOUSE_HISTORY_ETAG_SECONDS', 60))
+
+# Shared per-thread connection pool for the greenhouse database
+db = SQLitePool('greenhouse_data.db')
+
 # Database initialization for greenhouse data
 def init_greenhouse_db():
-    conn = sqlite3.connect('greenhouse_data.db')
-    cursor = conn.cursor()
-    
-    # Greenhouse sensor data table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS greenhouse_data (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            temperature REAL,
-            humidity REAL,
-            ph REAL,
-            light_intensity INTEGER,
-            water_level INTEGER,
-            water_status TEXT,
-            soil_moisture INTEGER,
-            curtain_status TEXT,
-            pump_status TEXT,
-            fan_status TEXT,
-            mode TEXT,
-            wifi_status TEXT,
-            ip_address TEXT,
-            wifi_signal INTEGER
-        )
-    ''')
-    
-    # Device control commands table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS control_commands (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id TEXT NOT NULL,
-            command_type TEXT NOT NULL,
-            device_name TEXT NOT NULL,
-            value TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            executed BOOLEAN DEFAULT FALSE,
-            execution_time TEXT
-        )
-    ''')
-    
-    # Device registration table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS registered_devices (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_id TEXT UNIQUE NOT NULL,
-            device_type TEXT NOT NULL,
-            ip_address TEXT,
-            capabilities TEXT,
-            last_seen TEXT,
-            status TEXT DEFAULT 'online'
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    """Apply pending schema migrations (no DDL runs when the schema is current)"""
+    applied = apply_migrations(db, GREENHOUSE_MIGRATIONS)
+    if applied:
+        print(f"🗄️ greenhouse_data.db migrated to schema version {applied[-1]}")
 
 # Initialize database
 init_greenhouse_db()
 
-# In-memory storage for real-time data
-greenhouse_cache = {}
-control_queue = deque()
+# In-memory storage for real-time data (latest status per device: status_board)
 device_registry = {}
 
+# Control commands: leased to the polling device and redelivered unless it
+# acknowledges them within the lease (control_commands is the durable copy)
+command_queue = CommandQueue(db, lease_seconds=float(os.getenv('GREENHOUSE_COMMAND_LEASE_SECONDS', 30)))
+command_queue.load()
+
+# Last few hours of numeric readings per device, kept as typed ring buffers so
+# short-window history and aggregates are answered without SQLite
+recent_window = RecentWindow(
+    hours=float(os.getenv('GREENHOUSE_WINDOW_HOURS', 6)),
+    capacity=int(os.getenv('GREENHOUSE_WINDOW_ROWS', 4096))
+)
+if recent_window.enabled:
+    warmed = recent_window.warm(db, datetime.datetime.now())
+    print(f"🧠 Recent window warmed with {warmed} readings ({recent_window.hours:g}h per device)")
+
+# Upper bound for GET /api/greenhouse-control?wait=<seconds>
+MAX_LONG_POLL_SECONDS = float(os.getenv('GREENHOUSE_MAX_LONG_POLL', 30))
+
+# SSE streams and long polls each hold a request thread while open. Together
+# they may take all but GREENHOUSE_RESERVED_THREADS of the server's request
+# threads (run_server.py --threads), which stay free for ingest and commands.
+REQUEST_THREADS = int(os.getenv('GREENHOUSE_REQUEST_THREADS', os.getenv('TERRAPONIX_THREADS', 8)))
+RESERVED_THREADS = int(os.getenv('GREENHOUSE_RESERVED_THREADS', 4))
+MAX_HELD_REQUESTS = int(os.getenv('GREENHOUSE_MAX_HELD_REQUESTS', max(0, REQUEST_THREADS - RESERVED_THREADS)))
+
+class HeldRequestBudget:
+    """Shared cap on requests that hold a thread open (SSE streams, long polls)"""
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._held = {}
+        self._rejected = {}
+    
+    def acquire(self, kind):
+        """Take a slot for a `kind` request, False (and counted) when none is left"""
+        with self._lock:
+            if sum(self._held.values()) >= self.limit:
+                self._rejected[kind] = self._rejected.get(kind, 0) + 1
+                return False
+            self._held[kind] = self._held.get(kind, 0) + 1
+            return True
+    
+    def release(self, kind):
+        with self._lock:
+            self._held[kind] -= 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'request_threads': REQUEST_THREADS,
+                'held': dict(self._held),
+                'rejected': dict(self._rejected)
+            }
+
+held_requests = HeldRequestBudget(MAX_HELD_REQUESTS)
+
+class CommandNotifier:
+    """Per-device wake-up signal for long-polling command requests
+
+    Every new command bumps the device's version and wakes its waiters. A
+    poller snapshots the version before it checks the database, so a command
+    that lands between the check and the wait is never missed.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = {}
+        self._versions = {}
+        self.waiting = 0
+    
+    def _condition(self, device_id):
+        with self._lock:
+            condition = self._conditions.get(device_id)
+            if condition is None:
+                condition = self._conditions[device_id] = threading.Condition()
+                self._versions[device_id] = 0
+            return condition
+    
+    def version(self, device_id):
+        with self._condition(device_id):
+            return self._versions[device_id]
+    
+    def notify(self, device_id):
+        condition = self._condition(device_id)
+        with condition:
+            self._versions[device_id] += 1
+            condition.notify_all()
+    
+    def wait(self, device_id, since, timeout):
+        """Wait until the device's version moves past since; False on timeout"""
+        condition = self._condition(device_id)
+        with condition:
+            self.waiting += 1
+            try:
+                return condition.wait_for(lambda: self._versions[device_id] != since, timeout)
+            finally:
+                self.waiting -= 1
+
+command_notifier = CommandNotifier()
+
+# Server-Sent Events settings for /api/greenhouse/stream
+SSE_BUFFER_SIZE = int(os.getenv('GREENHOUSE_SSE_BUFFER', 16))
+SSE_KEEPALIVE_SECONDS = float(os.getenv('GREENHOUSE_SSE_KEEPALIVE', 15))
+# Streams also count against MAX_HELD_REQUESTS; this only caps them further
+SSE_MAX_CLIENTS = int(os.getenv('GREENHOUSE_SSE_MAX_CLIENTS', MAX_HELD_REQUESTS))
+
+class StatusSubscription:
+    """One SSE client: a bounded event buffer plus a wake-up flag"""
+    
+    def __init__(self, device_id, buffer_size):
+        self.device_id = device_id  # None means every device
+        self.events = deque(maxlen=buffer_size)
+        self.ready = threading.Event()
+        self.dropped = 0
+    
+    def push(self, event):
+        # A slow client loses its oldest events, never blocks ingest
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        self.ready.set()
+    
+    def drain(self, timeout):
+        """Wait up to timeout seconds and return the buffered events"""
+        self.ready.wait(timeout)
+        self.ready.clear()
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+class StatusBroadcaster:
+    """Fans status updates out to the connected SSE clients"""
+    
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._sequence = 0
+        self.published = 0
+        self.dropped = 0
+    
+    def subscribe(self, device_id=None):
+        subscription = StatusSubscription(device_id, self.buffer_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            self.dropped += subscription.dropped
+    
+    def publish(self, device_id, data):
+        """Queue an already-encoded JSON status for the device's subscribers"""
+        with self._lock:
+            self._sequence += 1
+            event = (self._sequence, data)
+            for subscription in self._subscribers:
+                if subscription.device_id in (None, device_id):
+                    subscription.push(event)
+            self.published += 1
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._subscribers),
+                'events_published': self.published,
+                'events_dropped': self.dropped + sum(s.dropped for s in self._subscribers)
+            }
+
+status_broadcaster = StatusBroadcaster(SSE_BUFFER_SIZE)
+
+# A device's latest status, complete with indicators, encoded body and ETag.
+# Never mutated: an update builds a new snapshot and swaps it in.
+StatusSnapshot = namedtuple('StatusSnapshot', 'device_id version timestamp reading indicators body etag')
+
+class StatusBoard:
+    """Latest StatusSnapshot per device
+
+    Ingest builds and serialises a snapshot once, then replaces the dict
+    entry in a single assignment. Readers take no lock and always see one
+    whole snapshot; the lock only orders concurrent writers.
+    """
+    
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+    
+    def get(self, device_id):
+        return self._snapshots.get(device_id)
+    
+    def snapshots(self):
+        return list(self._snapshots.values())
+    
+    def __len__(self):
+        return len(self._snapshots)
+    
+    def publish(self, device_id, entry, only_if_newer=False):
+        """Swap in a snapshot of `entry`, returning it (None if an older reading was skipped)"""
+        with self._lock:
+            current = self._snapshots.get(device_id)
+            if only_if_newer and current is not None and entry['timestamp'] < current.timestamp:
+                return None
+            version = current.version + 1 if current is not None else 1
+            payload = build_status_payload(device_id, entry)
+            snapshot = StatusSnapshot(
+                device_id, version, entry['timestamp'], MappingProxyType(dict(entry)),
+                MappingProxyType(payload['status_indicators']),
+                json.dumps(payload, separators=(',', ':')).encode(),
+                make_etag('status', version, device_id)
+            )
+            self._snapshots[device_id] = snapshot
+        return snapshot
+
+status_board = StatusBoard()
+
 @app.route('/', methods=['GET'])
 def home():
     """API status endpoint"""
@@ -85,12 +286,18 @@ def home():
         'version': '2.0',
         'timestamp': datetime.datetime.now().isoformat(),
         'active_devices': len(device_registry),
+        'long_poll_waiters': command_notifier.waiting,
         'endpoints': {
             'data_collection': '/api/greenhouse-data',
+            'batch_data_collection': '/api/greenhouse-data/batch',
             'device_control': '/api/greenhouse-control',
+            'command_ack': '/api/greenhouse-control/ack',
             'device_registration': '/api/register',
             'real_time_data': '/api/greenhouse/status',
+            'real_time_stream': '/api/greenhouse/stream',
             'historical_data': '/api/greenhouse/history',
+            'aggregated_data': '/api/greenhouse/aggregate',
+            'database_stats': '/api/db/stats',
             'dashboard': '/dashboard'
         }
     })
@@ -123,15 +330,13 @@ def register_device():
         }
         
         # Save to database
-        conn = sqlite3.connect('greenhouse_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT OR REPLACE INTO registered_devices 
-            (device_id, device_type, ip_address, capabilities, last_seen, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (device_id, device_type, ip_address, capabilities, timestamp, 'online'))
-        conn.commit()
-        conn.close()
+        with db.transaction():
+            db.execute('''
+                INSERT OR REPLACE INTO registered_devices 
+                (device_id, device_type, ip_address, capabilities, last_seen, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (device_id, device_type, ip_address, capabilities, timestamp, 'online'))
+        device_versions.bump()
         
         return jsonify({
             'status': 'success',
@@ -146,65 +351,224 @@ def register_device():
             'message': str(e)
         }), 500
 
+# Readings must carry these fields
+REQUIRED_READING_FIELDS = ['temperature', 'humidity', 'ph', 'light_intensity', 'water_level', 'soil_moisture']
+
+# Upper bounds for the batch ingest endpoint
+MAX_BATCH_READINGS = 1000
+MAX_BATCH_BYTES = 8 * 1024 * 1024  # after gzip decompression
+
+INSERT_GREENHOUSE_DATA_SQL = '''
+    INSERT INTO greenhouse_data 
+    (device_id, timestamp, temperature, humidity, ph, light_intensity, 
+     water_level, water_status, soil_moisture, curtain_status, pump_status, 
+     fan_status, mode, wifi_status, ip_address, wifi_signal)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# Retention: readings older than GREENHOUSE_RETENTION_DAYS are moved to
+# compressed per-device, per-day segment files (rollups keep their summaries)
+archive = SegmentArchive(os.getenv('GREENHOUSE_ARCHIVE_DIR', os.path.join('archive', 'greenhouse_data')))
+
+retention = RetentionJob(
+    db,
+    archive,
+    'greenhouse_data',
+    retain_days=float(os.getenv('GREENHOUSE_RETENTION_DAYS', 30)),
+    device_column='device_id',
+    devices_sql=f'SELECT DISTINCT device_id FROM {rollup_table("1d")}',
+    chunk_rows=int(os.getenv('GREENHOUSE_RETENTION_CHUNK_ROWS', 500)),
+    interval_seconds=float(os.getenv('GREENHOUSE_RETENTION_INTERVAL', 3600)),
+    name='greenhouse-retention'
+)
+
+# Optional write-behind mode: readings are acknowledged once they are queued
+# and a single writer thread group-commits them in the background
+WRITE_BEHIND_ENABLED = os.getenv('GREENHOUSE_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+
+writer = WriteBehindQueue(
+    db,
+    INSERT_GREENHOUSE_DATA_SQL,
+    max_queue=int(os.getenv('GREENHOUSE_WRITE_QUEUE_SIZE', 10000)),
+    flush_interval_ms=int(os.getenv('GREENHOUSE_FLUSH_INTERVAL_MS', 200)),
+    flush_rows=int(os.getenv('GREENHOUSE_FLUSH_ROWS', 500)),
+    name='greenhouse-writer',
+    on_flush=lambda batch: update_rollups(db, batch),
+    on_commit=lambda batch: data_versions.bump(*{row[0] for row in batch})
+)
+
+def start_background_tasks():
+    """Start this process's retention and writer threads
+
+    Runs at import unless TERRAPONIX_DEFER_BACKGROUND_TASKS=1; the production
+    launcher (backend/run_server.py) sets it and calls this once per worker,
+    after the fork, so no thread is running while the parent forks.
+    """
+    retention.start()
+    if WRITE_BEHIND_ENABLED:
+        writer.start()
+
+def stop_background_tasks():
+    """Drain queued readings and stop the background threads"""
+    writer.stop()
+    retention.stop()
+
+if os.getenv('TERRAPONIX_DEFER_BACKGROUND_TASKS') != '1':
+    start_background_tasks()
+atexit.register(stop_background_tasks)
+
+def store_readings(rows):
+    """Persist greenhouse_data rows, returning an accepted flag per row"""
+    if WRITE_BEHIND_ENABLED:
+        accepted = writer.submit_many(rows)
+        recent_window.append_rows([row for row, ok in zip(rows, accepted) if ok])
+        return accepted
+    
+    with db.transaction():
+        db.executemany(INSERT_GREENHOUSE_DATA_SQL, rows)
+        update_rollups(db, rows)
+    recent_window.append_rows(rows)
+    data_versions.bump(*{row[0] for row in rows})
+    return [True] * len(rows)
+
+def build_reading_row(device_id, timestamp, data):
+    """Build the greenhouse_data insert tuple for a reading"""
+    return (
+        device_id, timestamp, data.get('temperature'), data.get('humidity'),
+        data.get('ph'), data.get('light_intensity'), data.get('water_level'),
+        data.get('water_status'), data.get('soil_moisture'), data.get('curtain_status'),
+        data.get('pump_status'), data.get('fan_status'), data.get('mode'),
+        data.get('wifi_status'), data.get('ip_address'), data.get('wifi_signal', 0)
+    )
+
+def build_cache_entry(timestamp, data):
+    """Build the status_board entry for a reading"""
+    return {
+        'timestamp': timestamp,
+        'temperature': data.get('temperature'),
+        'humidity': data.get('humidity'),
+        'ph': data.get('ph'),
+        'light_intensity': data.get('light_intensity'),
+        'water_level': data.get('water_level'),
+        'water_status': data.get('water_status', 'UNKNOWN'),
+        'soil_moisture': data.get('soil_moisture'),
+        'curtain_status': data.get('curtain_status', 'UNKNOWN'),
+        'pump_status': data.get('pump_status', 'UNKNOWN'),
+        'fan_status': data.get('fan_status', 'UNKNOWN'),
+        'mode': data.get('mode', 'AUTO'),
+        'wifi_status': data.get('wifi_status', 'UNKNOWN'),
+        'ip_address': data.get('ip_address', ''),
+        'wifi_signal': data.get('wifi_signal', 0)
+    }
+
+def update_device_cache(device_id, entry, only_if_newer=False):
+    """Publish the latest reading for a device and push it to SSE clients"""
+    snapshot = status_board.publish(device_id, entry, only_if_newer)
+    if snapshot is not None:
+        status_broadcaster.publish(device_id, snapshot.body.decode())
+
+def mark_device_seen(device_id, timestamp):
+    """Update device registry"""
+    if device_id in device_registry:
+        device_registry[device_id]['last_seen'] = timestamp
+        device_registry[device_id]['status'] = 'online'
+
+def validate_batch_reading(item, received_at):
+    """Validate one batched reading, returning (device_id, timestamp) or raising ValueError"""
+    if not isinstance(item, dict):
+        raise ValueError('Reading must be a JSON object')
+    
+    for field in REQUIRED_READING_FIELDS:
+        if field not in item:
+            raise ValueError(f'Missing required field: {field}')
+    
+    # Buffered readings may carry the time they were taken
+    timestamp = item.get('timestamp')
+    if timestamp is None:
+        timestamp = received_at
+    else:
+        try:
+            parsed = datetime.datetime.fromisoformat(str(timestamp))
+        except ValueError:
+            raise ValueError(f'Invalid timestamp: {timestamp}')
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        timestamp = parsed.isoformat()
+    
+    return item.get('device_id', 'unknown'), timestamp
+
+def row_cache_entry(row):
+    """Build the status_board entry straight from an insert tuple"""
+    return dict(zip(READING_COLUMNS[1:], row[1:]))
+
+def read_request_body():
+    """Raw request body, honouring Content-Encoding: gzip"""
+    body = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, MAX_BATCH_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f'Decompressed payload exceeds {MAX_BATCH_BYTES} bytes')
+    return body
+
+def read_batch_payload(body):
+    """Decode a JSON batch body into a list of reading dicts"""
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get('readings')
+    if not isinstance(payload, list):
+        raise ValueError('Expected a JSON array of readings or {"readings": [...]}')
+    return payload
+
 @app.route('/api/greenhouse-data', methods=['POST'])
 def receive_greenhouse_data():
-    """Receive data from greenhouse ESP32 device"""
+    """Receive data from greenhouse ESP32 device (JSON or the compact binary format)"""
     try:
-        data = request.get_json()
-        device_id = data.get('device_id', 'unknown')
         timestamp = datetime.datetime.now().isoformat()
         
-        # Validate required fields
-        required_fields = ['temperature', 'humidity', 'ph', 'light_intensity', 'water_level', 'soil_moisture']
-        for field in required_fields:
-            if field not in data:
+        if request.mimetype == READING_MIMETYPE:
+            # Binary readings decode straight into the insert tuple
+            try:
+                rows = decode_readings(read_request_body(), timestamp)
+            except (ValueError, zlib.error) as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Invalid binary reading: {e}'
+                }), 400
+            if len(rows) != 1:
                 return jsonify({
                     'status': 'error',
-                    'message': f'Missing required field: {field}'
+                    'message': f'Expected one reading, got {len(rows)} (use /api/greenhouse-data/batch)'
                 }), 400
+            row = rows[0]
+            device_id, timestamp = row[0], row[1]
+            entry = row_cache_entry(row)
+        else:
+            data = request.get_json()
+            device_id = data.get('device_id', 'unknown')
+            
+            # Validate required fields
+            for field in REQUIRED_READING_FIELDS:
+                if field not in data:
+                    return jsonify({
+                        'status': 'error',
+                        'message': f'Missing required field: {field}'
+                    }), 400
+            row = build_reading_row(device_id, timestamp, data)
+            entry = build_cache_entry(timestamp, data)
+        
+        # Save to database (or the write-behind queue)
+        if not store_readings([row])[0]:
+            return jsonify({
+                'status': 'error',
+                'message': 'Server busy, write queue is full. Please retry later.'
+            }), 503
         
         # Update cache for real-time access
-        greenhouse_cache[device_id] = {
-            'timestamp': timestamp,
-            'temperature': data.get('temperature'),
-            'humidity': data.get('humidity'),
-            'ph': data.get('ph'),
-            'light_intensity': data.get('light_intensity'),
-            'water_level': data.get('water_level'),
-            'water_status': data.get('water_status', 'UNKNOWN'),
-            'soil_moisture': data.get('soil_moisture'),
-            'curtain_status': data.get('curtain_status', 'UNKNOWN'),
-            'pump_status': data.get('pump_status', 'UNKNOWN'),
-            'fan_status': data.get('fan_status', 'UNKNOWN'),
-            'mode': data.get('mode', 'AUTO'),
-            'wifi_status': data.get('wifi_status', 'UNKNOWN'),
-            'ip_address': data.get('ip_address', ''),
-            'wifi_signal': data.get('wifi_signal', 0)
-        }
+        update_device_cache(device_id, entry)
         
         # Update device registry
-        if device_id in device_registry:
-            device_registry[device_id]['last_seen'] = timestamp
-            device_registry[device_id]['status'] = 'online'
-        
-        # Save to database
-        conn = sqlite3.connect('greenhouse_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO greenhouse_data 
-            (device_id, timestamp, temperature, humidity, ph, light_intensity, 
-             water_level, water_status, soil_moisture, curtain_status, pump_status, 
-             fan_status, mode, wifi_status, ip_address, wifi_signal)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            device_id, timestamp, data.get('temperature'), data.get('humidity'),
-            data.get('ph'), data.get('light_intensity'), data.get('water_level'),
-            data.get('water_status'), data.get('soil_moisture'), data.get('curtain_status'),
-            data.get('pump_status'), data.get('fan_status'), data.get('mode'),
-            data.get('wifi_status'), data.get('ip_address'), data.get('wifi_signal', 0)
-        ))
-        conn.commit()
-        conn.close()
+        mark_device_seen(device_id, timestamp)
         
         return jsonify({
             'status': 'success',
@@ -219,6 +583,95 @@ def receive_greenhouse_data():
             'message': str(e)
         }), 500
 
+@app.route('/api/greenhouse-data/batch', methods=['POST'])
+def receive_greenhouse_data_batch():
+    """Receive a batch of buffered readings in a single request (JSON or binary records)"""
+    try:
+        received_at = datetime.datetime.now().isoformat()
+        binary = request.mimetype == READING_MIMETYPE
+        try:
+            body = read_request_body()
+            readings = decode_readings(body, received_at) if binary else read_batch_payload(body)
+        except (ValueError, zlib.error) as e:
+            return jsonify({
+                'status': 'error',
+                'message': f'Invalid batch payload: {e}'
+            }), 400
+        
+        if len(readings) > MAX_BATCH_READINGS:
+            return jsonify({
+                'status': 'error',
+                'message': f'Batch too large: {len(readings)} readings (max {MAX_BATCH_READINGS})'
+            }), 413
+        
+        results = []
+        rows = []
+        newest = {}  # device_id -> (timestamp, reading)
+        
+        # Validate everything in one pass before touching the database
+        for index, item in enumerate(readings):
+            if binary:
+                row = item  # already an insert tuple
+            else:
+                try:
+                    device_id, timestamp = validate_batch_reading(item, received_at)
+                except ValueError as e:
+                    results.append({'index': index, 'status': 'error', 'message': str(e)})
+                    continue
+                row = build_reading_row(device_id, timestamp, item)
+            
+            rows.append(row)
+            results.append({'index': index, 'status': 'success', 'device_id': row[0], 'timestamp': row[1]})
+        
+        # Save every valid reading in one transaction (or queue them)
+        accepted = store_readings(rows) if rows else []
+        stored = 0
+        valid = (r for r in results if r['status'] == 'success')
+        for result, ok in zip(valid, accepted):
+            if not ok:
+                result['status'] = 'error'
+                result['message'] = 'Write queue is full'
+                continue
+            stored += 1
+            device_id, timestamp = result['device_id'], result['timestamp']
+            if device_id not in newest or timestamp >= newest[device_id][0]:
+                newest[device_id] = (timestamp, readings[result['index']])
+        
+        # Only the newest reading per device reaches the real-time cache
+        for device_id, (timestamp, item) in newest.items():
+            entry = row_cache_entry(item) if binary else build_cache_entry(timestamp, item)
+            update_device_cache(device_id, entry, only_if_newer=True)
+            mark_device_seen(device_id, received_at)
+        
+        rejected = len(readings) - stored
+        if stored or not readings:
+            code = 200
+        elif stored < len(rows):
+            code = 503  # valid readings were turned away by a full queue
+        else:
+            code = 400
+        return jsonify({
+            'status': 'success' if rejected == 0 else ('partial' if stored else 'error'),
+            'message': f'{stored} of {len(readings)} readings stored',
+            'accepted': stored,
+            'rejected': rejected,
+            'timestamp': received_at,
+            'results': results
+        }), code
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def poll_commands(device_id, auto_ack):
+    """Lease the device's pending commands (acknowledging them at once for ack=auto)"""
+    commands = command_queue.lease(device_id)
+    if commands and auto_ack:
+        command_queue.ack(device_id, [c['id'] for c in commands], datetime.datetime.now().isoformat())
+    return commands
+
 @app.route('/api/greenhouse-control', methods=['GET', 'POST'])
 def greenhouse_control():
     """Handle device control commands"""
@@ -231,41 +684,39 @@ def greenhouse_control():
                 'message': 'device_id parameter required'
             }), 400
         
-        # Get pending commands from database
-        conn = sqlite3.connect('greenhouse_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM control_commands 
-            WHERE device_id = ? AND executed = FALSE
-            ORDER BY timestamp ASC
-        ''', (device_id,))
-        
-        commands = []
-        for row in cursor.fetchall():
-            commands.append({
-                'id': row[0],
-                'action': 'control',
-                'device': row[2],
-                'value': row[3] == 'true' or row[3] == '1',
-                'timestamp': row[4]
-            })
+        # ack=auto: clients that cannot acknowledge get at-most-once delivery
+        auto_ack = request.args.get('ack') == 'auto'
         
-        # Mark commands as executed
-        if commands:
-            cursor.execute('''
-                UPDATE control_commands 
-                SET executed = TRUE, execution_time = ?
-                WHERE device_id = ? AND executed = FALSE
-            ''', (datetime.datetime.now().isoformat(), device_id))
+        # Long-poll: hold the request open until a command arrives or the wait expires
+        wait = max(0.0, min(request.args.get('wait', 0, type=float), MAX_LONG_POLL_SECONDS))
+        since = command_notifier.version(device_id)
         
-        conn.commit()
-        conn.close()
+        commands = poll_commands(device_id, auto_ack)
+        retry_after = None
+        if not commands and wait > 0:
+            if held_requests.acquire('long_poll'):
+                try:
+                    # Wake up in time to redeliver a lease that runs out meanwhile
+                    expiry = command_queue.next_expiry(device_id)
+                    if expiry is not None:
+                        wait = min(wait, expiry)
+                    command_notifier.wait(device_id, since, wait)
+                finally:
+                    held_requests.release('long_poll')
+                commands = poll_commands(device_id, auto_ack)
+            else:
+                # No thread to spare: answer now and tell the device to poll again later
+                retry_after = wait
         
-        return jsonify({
+        response = {
             'status': 'success',
             'device_id': device_id,
-            'commands': commands
-        })
+            'commands': commands,
+            'lease_seconds': None if auto_ack else command_queue.lease_seconds
+        }
+        if retry_after is not None:
+            response['retry_after'] = retry_after
+        return jsonify(response)
     
     elif request.method == 'POST':
         # Add new control command
@@ -284,25 +735,24 @@ def greenhouse_control():
             
             timestamp = datetime.datetime.now().isoformat()
             
-            # Save command to database
-            conn = sqlite3.connect('greenhouse_data.db')
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO control_commands 
-                (device_id, command_type, device_name, value, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (device_id, command_type, device_name, value, timestamp))
-            conn.commit()
-            conn.close()
+            # Save command to database and queue it for the device (coalesced
+            # with a still-pending command for the same actuator)
+            command = command_queue.enqueue(device_id, command_type, device_name, value, timestamp)
+            
+            # Wake a device that is long-polling for commands
+            command_notifier.notify(device_id)
             
             return jsonify({
                 'status': 'success',
                 'message': f'Control command sent to {device_name}',
                 'device_id': device_id,
                 'command': {
+                    'id': command['id'],
                     'device': device_name,
                     'value': value,
-                    'timestamp': timestamp
+                    'timestamp': timestamp,
+                    # Earlier presses for this actuator replaced before delivery
+                    'superseded': command['superseded']
                 }
             })
             
@@ -312,31 +762,79 @@ def greenhouse_control():
                 'message': str(e)
             }), 500
 
+@app.route('/api/greenhouse-control/ack', methods=['POST'])
+def acknowledge_commands():
+    """Acknowledge leased commands once the device has applied them"""
+    try:
+        data = request.get_json()
+        device_id = data.get('device_id')
+        command_ids = data.get('command_ids')
+        
+        if not device_id or not isinstance(command_ids, list):
+            return jsonify({
+                'status': 'error',
+                'message': 'device_id and a command_ids list are required'
+            }), 400
+        
+        try:
+            command_ids = [int(command_id) for command_id in command_ids]
+        except (TypeError, ValueError):
+            return jsonify({
+                'status': 'error',
+                'message': 'command_ids must be integers'
+            }), 400
+        
+        acked = command_queue.ack(device_id, command_ids, datetime.datetime.now().isoformat())
+        
+        return jsonify({
+            'status': 'success',
+            'device_id': device_id,
+            'acknowledged': acked,
+            # Already acknowledged, or not a command of this device
+            'unknown': [command_id for command_id in command_ids if command_id not in acked]
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def in_range(value, low, high=None):
+    """True if a reading is present and within [low, high]"""
+    return value is not None and value >= low and (high is None or value <= high)
+
+def build_status_payload(device_id, data):
+    """Build the status response body for a cached reading"""
+    # Calculate status indicators (a missing reading counts as a warning)
+    status_indicators = {
+        'temperature_status': 'normal' if in_range(data['temperature'], 20, 30) else 'warning',
+        'humidity_status': 'normal' if in_range(data['humidity'], 40, 70) else 'warning',
+        'ph_status': 'normal' if in_range(data['ph'], 6.0, 7.5) else 'warning',
+        'water_status': 'normal' if data['water_status'] == 'OK' else 'warning',
+        'soil_moisture_status': 'normal' if in_range(data['soil_moisture'], 30) else 'warning'
+    }
+    
+    return {
+        'status': 'success',
+        'device_id': device_id,
+        'data': data,
+        'status_indicators': status_indicators,
+        'last_update': data['timestamp']
+    }
+
 @app.route('/api/greenhouse/status', methods=['GET'])
 def get_greenhouse_status():
     """Get current status of all greenhouse devices"""
     try:
         device_id = request.args.get('device_id', 'greenhouse_esp32')
         
-        if device_id in greenhouse_cache:
-            data = greenhouse_cache[device_id]
-            
-            # Calculate status indicators
-            status_indicators = {
-                'temperature_status': 'normal' if 20 <= data['temperature'] <= 30 else 'warning',
-                'humidity_status': 'normal' if 40 <= data['humidity'] <= 70 else 'warning',
-                'ph_status': 'normal' if 6.0 <= data['ph'] <= 7.5 else 'warning',
-                'water_status': 'normal' if data['water_status'] == 'OK' else 'warning',
-                'soil_moisture_status': 'normal' if data['soil_moisture'] >= 30 else 'warning'
-            }
-            
-            return jsonify({
-                'status': 'success',
-                'device_id': device_id,
-                'data': data,
-                'status_indicators': status_indicators,
-                'last_update': data['timestamp']
-            })
+        # One lookup; the body was encoded when the reading arrived
+        snapshot = status_board.get(device_id)
+        if snapshot is not None:
+            return conditional_response(
+                snapshot.etag, lambda: Response(snapshot.body, mimetype='application/json')
+            )
         else:
             return jsonify({
                 'status': 'error',
@@ -349,9 +847,103 @@ def get_greenhouse_status():
             'message': str(e)
         }), 500
 
+@app.route('/api/greenhouse/stream', methods=['GET'])
+def stream_greenhouse_status():
+    """Push a status event whenever a device reports (Server-Sent Events)"""
+    device_id = request.args.get('device_id')  # omit to follow every device
+    
+    if not held_requests.acquire('stream'):
+        admitted = False
+    elif status_broadcaster.stats()['clients'] >= SSE_MAX_CLIENTS:
+        held_requests.release('stream')
+        admitted = False
+    else:
+        admitted = True
+    if not admitted:
+        return jsonify({
+            'status': 'error',
+            'message': 'Too many stream clients, fall back to polling /api/greenhouse/status'
+        }), 503
+    
+    subscription = status_broadcaster.subscribe(device_id)
+    closed = threading.Event()
+    
+    def close():
+        # Runs from the generator and from the response's close(), whichever comes first
+        if not closed.is_set():
+            closed.set()
+            status_broadcaster.unsubscribe(subscription)
+            held_requests.release('stream')
+    
+    def format_event(sequence, data):
+        return f'id: {sequence}\nevent: status\ndata: {data}\n\n'
+    
+    def generate():
+        try:
+            yield 'retry: 5000\n\n'
+            # Send what we already know so the client renders straight away
+            if device_id is None:
+                current = status_board.snapshots()
+            else:
+                current = [s for s in [status_board.get(device_id)] if s is not None]
+            for snapshot in current:
+                yield format_event(0, snapshot.body.decode())
+            
+            while True:
+                events = subscription.drain(SSE_KEEPALIVE_SECONDS)
+                if not events:
+                    # Comment line keeps proxies and the browser from timing out
+                    yield ': keepalive\n\n'
+                for sequence, data in events:
+                    yield format_event(sequence, data)
+        finally:
+            close()
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # A client that disconnects before the first chunk never runs the generator
+    response.call_on_close(close)
+    return response
+
+def history_row_to_dict(row):
+    """Convert a greenhouse_data row to its API dictionary"""
+    return {
+        'id': row[0],
+        'device_id': row[1],
+        'timestamp': row[2],
+        'temperature': row[3],
+        'humidity': row[4],
+        'ph': row[5],
+        'light_intensity': row[6],
+        'water_level': row[7],
+        'water_status': row[8],
+        'soil_moisture': row[9],
+        'curtain_status': row[10],
+        'pump_status': row[11],
+        'fan_status': row[12],
+        'mode': row[13],
+        'wifi_status': row[14],
+        'ip_address': row[15],
+        'wifi_signal': row[16]
+    }
+
+def history_etag(scope, device_id):
+    """ETag for a history-style response: the device's data version plus the query"""
+    return make_etag(scope, data_versions.get(device_id), sorted(request.args.items(multi=True)),
+                     int(time.time() // HISTORY_ETAG_SECONDS))
+
 @app.route('/api/greenhouse/history', methods=['GET'])
 def get_greenhouse_history():
-    """Get historical greenhouse data"""
+    """Get historical greenhouse data (streamed responses are not tagged)"""
+    if request.args.get('stream') is not None:
+        return build_greenhouse_history()
+    device_id = request.args.get('device_id', 'greenhouse_esp32')
+    return conditional_response(history_etag('history', device_id), build_greenhouse_history)
+
+def build_greenhouse_history():
+    """History response body for the current request"""
     try:
         device_id = request.args.get('device_id', 'greenhouse_esp32')
         limit = request.args.get('limit', 100, type=int)
@@ -360,45 +952,232 @@ def get_greenhouse_history():
         # Calculate time threshold
         time_threshold = datetime.datetime.now() - datetime.timedelta(hours=hours)
         
-        conn = sqlite3.connect('greenhouse_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        # Chart mode: the whole range, downsampled to a fixed number of points
+        points = request.args.get('points', type=int)
+        if points is not None:
+            return get_downsampled_history(device_id, hours, time_threshold, points)
+        
+        # Keyset pagination: ?cursor= continues after the last row of a page
+        seek_sql, seek_params = '', ()
+        if request.args.get('cursor'):
+            try:
+                seek_params = decode_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 400
+            seek_sql = f'AND {SEEK_BEFORE_SQL}'
+        
+        history_sql = f'''
             SELECT * FROM greenhouse_data 
-            WHERE device_id = ? AND timestamp > ?
-            ORDER BY timestamp DESC 
+            WHERE device_id = ? AND timestamp > ? {seek_sql}
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
-        ''', (device_id, time_threshold.isoformat(), limit))
+        '''
+        params = (device_id, time_threshold.isoformat(), *seek_params, limit)
         
-        history = []
-        for row in cursor.fetchall():
-            history.append({
-                'id': row[0],
-                'device_id': row[1],
-                'timestamp': row[2],
-                'temperature': row[3],
-                'humidity': row[4],
-                'ph': row[5],
-                'light_intensity': row[6],
-                'water_level': row[7],
-                'water_status': row[8],
-                'soil_moisture': row[9],
-                'curtain_status': row[10],
-                'pump_status': row[11],
-                'fan_status': row[12],
-                'mode': row[13],
-                'wifi_status': row[14],
-                'ip_address': row[15],
-                'wifi_signal': row[16]
-            })
+        # Streaming mode: rows go out as they are read, for large limits
+        stream_format = request.args.get('stream')
+        if stream_format is not None:
+            if stream_format not in STREAM_FORMATS:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'stream must be one of: {", ".join(STREAM_FORMATS)}'
+                }), 400
+            return streaming_response(
+                iter_history_chunks(history_sql, params, device_id, time_threshold.isoformat(),
+                                    limit, seek_params or None),
+                history_row_to_dict, stream_format,
+                {'status': 'success', 'device_id': device_id, 'time_range_hours': hours}, 'history'
+            )
         
-        conn.close()
+        # One extra row tells whether another page follows
+        fetch = limit + 1 if limit >= 0 else limit
+        rows = db.query(history_sql, params[:-1] + (fetch,))
+        if limit < 0 or len(rows) < fetch:
+            # The hot table ran out inside the range: continue in the archive
+            archived = read_archived_rows(archive, device_id, time_threshold.isoformat(), fetch,
+                                          before=seek_params or None, timestamp_index=2)
+            rows = merge_newest(rows, archived, fetch, timestamp_index=2)
+        rows, next_cursor = split_page(rows, limit, timestamp_index=2)
+        history = [history_row_to_dict(row) for row in rows]
         
         return jsonify({
             'status': 'success',
             'device_id': device_id,
             'history': history,
             'total_records': len(history),
-            'time_range_hours': hours
+            'time_range_hours': hours,
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+def iter_history_chunks(history_sql, params, device_id, since, limit, before):
+    """Streamed history: hot rows from SQLite, then archived rows once they run out"""
+    emitted = 0
+    for rows in db.iter_query(history_sql, params):
+        emitted += len(rows)
+        # Archived rows must come after everything already sent
+        before = (rows[-1][2], rows[-1][0])
+        yield rows
+    
+    for rows in iter_archived_days(archive, device_id, since, before, timestamp_index=2):
+        if 0 <= limit <= emitted:
+            break
+        if limit >= 0:
+            rows = rows[:limit - emitted]
+        emitted += len(rows)
+        yield rows
+
+# Upper bound for ?points= on the history endpoint
+MAX_CHART_POINTS = 5000
+
+def get_downsampled_history(device_id, hours, time_threshold, points):
+    """History response with each metric reduced to `points` points by LTTB"""
+    if not numpy_available():
+        return jsonify({
+            'status': 'error',
+            'message': 'Downsampled history requires numpy (pip install numpy)'
+        }), 501
+    
+    if not 3 <= points <= MAX_CHART_POINTS:
+        return jsonify({
+            'status': 'error',
+            'message': f'points must be between 3 and {MAX_CHART_POINTS}'
+        }), 400
+    
+    try:
+        metrics = parse_metrics_arg(CHART_METRICS)
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    
+    # Recent ranges come from memory; long ones read the coarsest rollup tier
+    # that still gives every point at least one bucket; the rest need raw rows
+    recent = recent_window.series(device_id, to_micros(time_threshold.isoformat()) + 1, None, metrics)
+    tier = pick_tier(hours * 3600 / points)
+    if recent is not None:
+        timestamps, x, columns = window_arrays(*recent, metrics)
+        source = 'memory'
+    elif tier is not None:
+        name, width = tier
+        timestamps, x, columns = load_rollup_arrays(db, name, width, device_id, time_threshold.isoformat(), metrics)
+        source = f'rollup_{name}'
+    else:
+        timestamps, x, columns = load_history_arrays(db, device_id, time_threshold.isoformat(), metrics)
+        source = 'raw'
+    
+    return jsonify({
+        'status': 'success',
+        'device_id': device_id,
+        'series': downsample_series(timestamps, x, columns, points),
+        'points': points,
+        'total_records': len(timestamps),
+        'time_range_hours': hours,
+        'downsampling': 'lttb',
+        'source': source
+    })
+
+def parse_metrics_arg(available):
+    """Read ?metrics=a,b (default: all available), raising ValueError on unknown names"""
+    metrics = request.args.get('metrics')
+    metrics = metrics.split(',') if metrics else list(available)
+    unknown = [m for m in metrics if m not in available]
+    if unknown:
+        raise ValueError(f'Unknown metrics: {", ".join(unknown)}. Available: {", ".join(available)}')
+    return metrics
+
+def parse_time_range():
+    """Read ?start=&end= (ISO) or ?hours= (default 24) into (start, end) datetimes"""
+    end = request.args.get('end')
+    end = datetime.datetime.fromisoformat(end) if end else datetime.datetime.now()
+    start = request.args.get('start')
+    if start:
+        start = datetime.datetime.fromisoformat(start)
+    else:
+        start = end - datetime.timedelta(hours=request.args.get('hours', 24, type=int))
+    if start >= end:
+        raise ValueError('start must be before end')
+    return start, end
+
+@app.route('/api/greenhouse/aggregate', methods=['GET'])
+def get_greenhouse_aggregate():
+    """Get min/max/mean/count/last per metric for fixed time buckets"""
+    device_id = request.args.get('device_id', 'greenhouse_esp32')
+    return conditional_response(history_etag('aggregate', device_id), build_greenhouse_aggregate)
+
+def build_greenhouse_aggregate():
+    """Aggregate response body for the current request"""
+    try:
+        device_id = request.args.get('device_id', 'greenhouse_esp32')
+        bucket = request.args.get('bucket', '1h')
+        
+        if bucket not in BUCKET_SECONDS:
+            return jsonify({
+                'status': 'error',
+                'message': f'bucket must be one of: {", ".join(BUCKET_SECONDS)}'
+            }), 400
+        width = BUCKET_SECONDS[bucket]
+        
+        try:
+            start, end = parse_time_range()
+            metrics = parse_metrics_arg(AGGREGATE_METRICS)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        if (end - start).total_seconds() / width > MAX_BUCKETS:
+            return jsonify({
+                'status': 'error',
+                'message': f'Range too long for {bucket} buckets (max {MAX_BUCKETS} buckets)'
+            }), 400
+        
+        # Recent ranges come from memory, older ones from rollups (both cover
+        # whole buckets); ?source=raw scans the exact range in SQLite instead
+        recent = rollup = None
+        if request.args.get('source') != 'raw':
+            first = reading_epoch(start.isoformat()) // width
+            last = -(-reading_epoch(end.isoformat()) // width)
+            recent = recent_window.series(
+                device_id, first * width * 1_000_000, last * width * 1_000_000, metrics
+            )
+            if recent is None:
+                rollup = aggregate_from_rollup(db, device_id, start.isoformat(), end.isoformat(), width, metrics)
+        
+        if recent is not None:
+            buckets = format_bucket_rows(aggregate_window(*recent, width, metrics), width, metrics)
+            start, end = bucket_start(first, width), bucket_start(last, width)
+            source = 'memory'
+        elif rollup is not None:
+            tier, first, last, rows = rollup
+            buckets = format_bucket_rows(rows, width, metrics)
+            start, end = bucket_start(first, width), bucket_start(last, width)
+            source = f'rollup_{tier}'
+        else:
+            buckets = aggregate_history(db, device_id, start.isoformat(), end.isoformat(), width, metrics)
+            start, end = start.isoformat(), end.isoformat()
+            source = 'raw'
+        
+        return jsonify({
+            'status': 'success',
+            'device_id': device_id,
+            'bucket': bucket,
+            'bucket_seconds': width,
+            'start': start,
+            'end': end,
+            'buckets': buckets,
+            'total_buckets': len(buckets),
+            'source': source
         })
         
     except Exception as e:
@@ -410,13 +1189,13 @@ def get_greenhouse_history():
 @app.route('/api/devices', methods=['GET'])
 def get_registered_devices():
     """Get all registered devices"""
+    return conditional_response(make_etag('devices', device_versions.get()), build_registered_devices)
+
+def build_registered_devices():
+    """Device list response body"""
     try:
-        conn = sqlite3.connect('greenhouse_data.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM registered_devices')
-        
         devices = []
-        for row in cursor.fetchall():
+        for row in db.query('SELECT * FROM registered_devices'):
             devices.append({
                 'id': row[0],
                 'device_id': row[1],
@@ -427,8 +1206,6 @@ def get_registered_devices():
                 'status': row[6]
             })
         
-        conn.close()
-        
         return jsonify({
             'status': 'success',
             'devices': devices,
@@ -441,6 +1218,22 @@ def get_registered_devices():
             'message': str(e)
         }), 500
 
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    """Get SQLite connection pool and statement cache statistics"""
+    return jsonify({
+        'status': 'success',
+        'timestamp': datetime.datetime.now().isoformat(),
+        'database': dict(db.stats(), schema_version=get_schema_version(db)),
+        'write_behind': dict(writer.stats(), enabled=WRITE_BEHIND_ENABLED),
+        'status_stream': dict(status_broadcaster.stats(), snapshots=len(status_board)),
+        'held_requests': held_requests.stats(),
+        'commands': command_queue.stats(),
+        'recent_window': recent_window.stats(),
+        'retention': dict(retention.stats(), archive=archive.stats()),
+        'http': compressor.stats()
+    })
+
 @app.route('/dashboard')
 def dashboard():
     """Simple web dashboard for greenhouse monitoring"""
@@ -548,33 +1341,35 @@ def dashboard():
         </div>
         
         <script>
+            function renderStatus(data) {
+                if (data.status === 'success') {
+                    const d = data.data;
+                    document.getElementById('temperature').textContent = d.temperature + '°C';
+                    document.getElementById('humidity').textContent = d.humidity + '%';
+                    document.getElementById('ph').textContent = d.ph.toFixed(2);
+                    document.getElementById('light').textContent = d.light_intensity;
+                    document.getElementById('soil').textContent = d.soil_moisture + '%';
+                    document.getElementById('water').textContent = d.water_status;
+                    
+                    document.getElementById('pumpStatus').textContent = d.pump_status;
+                    document.getElementById('fanStatus').textContent = d.fan_status;
+                    document.getElementById('curtainStatus').textContent = d.curtain_status;
+                    document.getElementById('controlMode').textContent = d.mode;
+                    document.getElementById('wifiSignal').textContent = d.wifi_signal + ' dBm';
+                    document.getElementById('lastUpdate').textContent = new Date(d.timestamp).toLocaleString();
+                    
+                    document.getElementById('deviceStatus').textContent = 'Online';
+                    document.getElementById('deviceStatus').className = 'status-online';
+                } else {
+                    document.getElementById('deviceStatus').textContent = 'Offline';
+                    document.getElementById('deviceStatus').className = 'status-offline';
+                }
+            }
+            
             function refreshData() {
                 fetch('/api/greenhouse/status?device_id=greenhouse_esp32')
                     .then(response => response.json())
-                    .then(data => {
-                        if (data.status === 'success') {
-                            const d = data.data;
-                            document.getElementById('temperature').textContent = d.temperature + '°C';
-                            document.getElementById('humidity').textContent = d.humidity + '%';
-                            document.getElementById('ph').textContent = d.ph.toFixed(2);
-                            document.getElementById('light').textContent = d.light_intensity;
-                            document.getElementById('soil').textContent = d.soil_moisture + '%';
-                            document.getElementById('water').textContent = d.water_status;
-                            
-                            document.getElementById('pumpStatus').textContent = d.pump_status;
-                            document.getElementById('fanStatus').textContent = d.fan_status;
-                            document.getElementById('curtainStatus').textContent = d.curtain_status;
-                            document.getElementById('controlMode').textContent = d.mode;
-                            document.getElementById('wifiSignal').textContent = d.wifi_signal + ' dBm';
-                            document.getElementById('lastUpdate').textContent = new Date(d.timestamp).toLocaleString();
-                            
-                            document.getElementById('deviceStatus').textContent = 'Online';
-                            document.getElementById('deviceStatus').className = 'status-online';
-                        } else {
-                            document.getElementById('deviceStatus').textContent = 'Offline';
-                            document.getElementById('deviceStatus').className = 'status-offline';
-                        }
-                    })
+                    .then(renderStatus)
                     .catch(error => {
                         console.error('Error:', error);
                         document.getElementById('deviceStatus').textContent = 'Error';
@@ -607,8 +1402,23 @@ def dashboard():
                 });
             }
             
-            // Auto refresh every 10 seconds
-            setInterval(refreshData, 10000);
+            // Live updates pushed by the server; poll only if the browser lacks SSE
+            if (window.EventSource) {
+                const stream = new EventSource('/api/greenhouse/stream?device_id=greenhouse_esp32');
+                stream.addEventListener('status', event => renderStatus(JSON.parse(event.data)));
+                stream.onerror = () => {
+                    if (stream.readyState === EventSource.CLOSED) {
+                        // Refused (server out of stream slots): poll instead
+                        setInterval(refreshData, 10000);
+                        return;
+                    }
+                    // EventSource reconnects on its own; just flag the gap
+                    document.getElementById('deviceStatus').textContent = 'Reconnecting...';
+                    document.getElementById('deviceStatus').className = 'status-offline';
+                };
+            } else {
+                setInterval(refreshData, 10000);
+            }
             
             // Initial load
             refreshData();
@@ -627,11 +1437,17 @@ if __name__ == '__main__':
     print("   - GET  /                           : API status")
     print("   - POST /api/register               : Register device")
     print("   - POST /api/greenhouse-data        : Receive sensor data")
-    print("   - GET/POST /api/greenhouse-control : Device control")
+    print("   - POST /api/greenhouse-data/batch  : Receive buffered readings")
+    print("   - GET/POST /api/greenhouse-control : Device control (GET ?wait=N to long-poll)")
+    print("   - POST /api/greenhouse-control/ack : Acknowledge applied commands")
     print("   - GET  /api/greenhouse/status      : Current status")
+    print("   - GET  /api/greenhouse/stream      : Live status (Server-Sent Events)")
     print("   - GET  /api/greenhouse/history     : Historical data")
+    print("   - GET  /api/greenhouse/aggregate   : Bucketed min/max/mean/last")
     print("   - GET  /api/devices                : Registered devices")
+    print("   - GET  /api/db/stats               : Database pool statistics")
     print("   - GET  /dashboard                  : Web dashboard")
+    print("\n💡 Production: python backend/run_server.py --app greenhouse")
     print("\n✅ Server starting...\n")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
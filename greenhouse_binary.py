@@ -0,0 +1,144 @@
+"""
+Compact binary encoding for greenhouse readings
+
+An alternative to the JSON document the ESP32 posts, selected with
+Content-Type: application/x-terraponix-reading. A record is a fixed
+little-endian struct followed by the device id:
+
+    offset  type     field
+    0       uint8    format version (1)
+    1       uint8    flags (see FLAG_*)
+    2       float32  temperature
+    6       float32  humidity
+    10      float32  ph
+    14      uint16   light_intensity
+    16      uint16   water_level
+    18      uint8    soil_moisture
+    19      int8     wifi_signal (RSSI, dBm)
+    20      4 bytes  ip_address (IPv4)
+    24      uint8    device id length n
+    25      n bytes  device id (UTF-8)
+    [25+n   uint32   unix time the reading was taken, if FLAG_HAS_TIMESTAMP]
+
+The status strings of the JSON format are two-valued, so they travel as flag
+bits. A reading is 41 bytes for "greenhouse_esp32" against roughly 350 bytes
+of JSON. Records can be concatenated for the batch endpoint. Decoding goes
+straight to the greenhouse_data insert tuple (READING_COLUMNS order).
+"""
+
+import datetime
+import math
+import struct
+
+READING_MIMETYPE = 'application/x-terraponix-reading'
+FORMAT_VERSION = 1
+
+FLAG_WATER_OK = 0x01        # water_status OK (else LOW)
+FLAG_CURTAIN_OPEN = 0x02    # curtain_status OPEN (else CLOSED)
+FLAG_PUMP_ON = 0x04         # pump_status ON (else OFF)
+FLAG_FAN_ON = 0x08          # fan_status ON (else OFF)
+FLAG_MANUAL = 0x10          # mode MANUAL (else AUTO)
+FLAG_WIFI_CONNECTED = 0x20  # wifi_status CONNECTED (else DISCONNECTED)
+FLAG_HAS_TIMESTAMP = 0x80   # a uint32 unix time follows the device id
+
+_RECORD = struct.Struct('<BBfffHHBb4sB')
+_TIMESTAMP = struct.Struct('<I')
+
+
+def _status(flags, flag, on, off):
+    return on if flags & flag else off
+
+
+def _optional(value):
+    # The firmware sends NaN when a sensor read fails; otherwise drop the
+    # float32 noise (25.3 would come back as 25.299999237060547)
+    return None if math.isnan(value) else float(f'{value:.7g}')
+
+
+def decode_readings(payload, received_at):
+    """Decode concatenated records into greenhouse_data insert tuples
+
+    Readings without their own time get `received_at`. Raises ValueError on
+    an unknown version or a truncated record.
+    """
+    rows = []
+    offset = 0
+    size = len(payload)
+    while offset < size:
+        if size - offset < _RECORD.size:
+            raise ValueError(f'Truncated reading at byte {offset}')
+        (version, flags, temperature, humidity, ph, light_intensity, water_level,
+         soil_moisture, wifi_signal, ip_address, id_length) = _RECORD.unpack_from(payload, offset)
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported reading format version {version} at byte {offset}')
+        offset += _RECORD.size
+
+        end = offset + id_length
+        if end > size:
+            raise ValueError(f'Truncated device id at byte {offset}')
+        device_id = payload[offset:end].decode('utf-8', errors='replace') or 'unknown'
+        offset = end
+
+        timestamp = received_at
+        if flags & FLAG_HAS_TIMESTAMP:
+            if size - offset < _TIMESTAMP.size:
+                raise ValueError(f'Truncated timestamp at byte {offset}')
+            (epoch,) = _TIMESTAMP.unpack_from(payload, offset)
+            offset += _TIMESTAMP.size
+            timestamp = datetime.datetime.fromtimestamp(epoch).isoformat()
+
+        rows.append((
+            device_id, timestamp, _optional(temperature), _optional(humidity), _optional(ph),
+            light_intensity, water_level, _status(flags, FLAG_WATER_OK, 'OK', 'LOW'), soil_moisture,
+            _status(flags, FLAG_CURTAIN_OPEN, 'OPEN', 'CLOSED'), _status(flags, FLAG_PUMP_ON, 'ON', 'OFF'),
+            _status(flags, FLAG_FAN_ON, 'ON', 'OFF'), _status(flags, FLAG_MANUAL, 'MANUAL', 'AUTO'),
+            _status(flags, FLAG_WIFI_CONNECTED, 'CONNECTED', 'DISCONNECTED'),
+            '.'.join(str(octet) for octet in ip_address), wifi_signal
+        ))
+    return rows
+
+
+def encode_reading(reading, taken_at=None):
+    """Encode a reading dict (JSON field names) as one binary record
+
+    taken_at is an optional unix time for buffered readings. Used by the
+    device simulator and tests; the firmware packs the same layout in C++.
+    """
+    flags = 0
+    if reading.get('water_status', 'OK') == 'OK':
+        flags |= FLAG_WATER_OK
+    if reading.get('curtain_status', 'OPEN') == 'OPEN':
+        flags |= FLAG_CURTAIN_OPEN
+    if reading.get('pump_status') == 'ON':
+        flags |= FLAG_PUMP_ON
+    if reading.get('fan_status') == 'ON':
+        flags |= FLAG_FAN_ON
+    if reading.get('mode', 'AUTO') == 'MANUAL':
+        flags |= FLAG_MANUAL
+    if reading.get('wifi_status', 'CONNECTED') == 'CONNECTED':
+        flags |= FLAG_WIFI_CONNECTED
+    if taken_at is not None:
+        flags |= FLAG_HAS_TIMESTAMP
+
+    def number(field):
+        value = reading.get(field)
+        return math.nan if value is None else float(value)
+
+    device_id = reading.get('device_id', 'unknown').encode('utf-8')[:255]
+    ip_address = bytes(int(octet) for octet in reading.get('ip_address', '0.0.0.0').split('.'))
+    record = _RECORD.pack(
+        FORMAT_VERSION, flags, number('temperature'), number('humidity'), number('ph'),
+        int(reading.get('light_intensity', 0)), int(reading.get('water_level', 0)),
+        int(reading.get('soil_moisture', 0)), max(-128, min(127, int(reading.get('wifi_signal', 0)))),
+        ip_address, len(device_id)
+    ) + device_id
+    if taken_at is not None:
+        record += _TIMESTAMP.pack(int(taken_at))
+    return record
+
+
+__all__ = [
+    'READING_MIMETYPE', 'FORMAT_VERSION', 'decode_readings', 'encode_reading',
+    'FLAG_WATER_OK', 'FLAG_CURTAIN_OPEN', 'FLAG_PUMP_ON', 'FLAG_FAN_ON',
+    'FLAG_MANUAL', 'FLAG_WIFI_CONNECTED', 'FLAG_HAS_TIMESTAMP'
+]
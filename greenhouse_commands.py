@@ -0,0 +1,285 @@
+"""
+Leased, acknowledged control-command queue
+
+control_commands stays the durable record: a command is inserted when it is
+posted and marked executed once the device acknowledges it. Delivery state
+lives in memory, one CommandQueue entry per device:
+
+- pending: commands not yet handed out, oldest first
+- leased: commands handed to the device, each with a lease deadline
+
+A poll moves pending commands to leased (no table scan, no write) and an
+acknowledgement marks them executed. A lease that runs out puts its command
+back at the front of pending, so a device that crashed while applying a
+command gets it again on its next poll. Delivery is at least once: the
+queue is rebuilt from the unexecuted rows at startup, leases included.
+
+Commands are coalesced per (device, actuator): a new command for an actuator
+that still has one pending overwrites that row's value in place and bumps
+its superseded_count, so repeated button presses never queue up. A leased
+command whose lease runs out while a newer one for the same actuator is
+pending is dropped and marked superseded_by the newer one. It is also marked
+executed (with no execution_time) so it leaves the pending-command index and
+is not read again at startup.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+_TRUE_VALUES = ('true', '1', 'on', 'yes')
+
+
+def command_to_dict(row):
+    """Poll payload for a control_commands row
+
+    (id, device_id, command_type, device_name, value, timestamp, superseded_count)
+    """
+    return {
+        'id': row[0],
+        'action': row[2],
+        'device': row[3],
+        'value': str(row[4]).strip().lower() in _TRUE_VALUES,
+        'timestamp': row[5],
+        'superseded': row[6]
+    }
+
+
+class DeviceCommands:
+    """One device's pending and leased commands, keyed by command id"""
+
+    def __init__(self):
+        self.pending = OrderedDict()  # id -> command
+        self.leased = OrderedDict()   # id -> (deadline, command), in lease order
+        self.deliveries = {}          # id -> times handed out
+        self.by_name = {}             # actuator -> id of its pending command
+
+    def add_pending(self, command, front=False):
+        self.pending[command['id']] = command
+        self.pending.move_to_end(command['id'], last=not front)
+        self.by_name[command['device']] = command['id']
+
+    def pop_pending(self, command_id=None):
+        """Remove a pending command (the oldest by default), or None"""
+        if command_id is None:
+            if not self.pending:
+                return None
+            _, command = self.pending.popitem(last=False)
+        else:
+            command = self.pending.pop(command_id, None)
+            if command is None:
+                return None
+        if self.by_name.get(command['device']) == command['id']:
+            del self.by_name[command['device']]
+        return command
+
+    def requeue_expired(self, now):
+        """Move commands whose lease ran out back to the front of pending
+
+        Returns (requeued, superseded) where superseded lists (old id, newer id)
+        for expired commands dropped in favour of a newer pending one.
+        """
+        expired = []
+        # Leases share one timeout, so they expire in the order they were granted
+        while self.leased:
+            command_id, (deadline, command) = next(iter(self.leased.items()))
+            if deadline > now:
+                break
+            del self.leased[command_id]
+            expired.append(command)
+
+        requeued = 0
+        superseded = []
+        for command in sorted(expired, key=lambda c: c['id'], reverse=True):
+            newer = self.by_name.get(command['device'])
+            if newer is not None:
+                self.deliveries.pop(command['id'], None)
+                superseded.append((command['id'], newer))
+                continue
+            self.add_pending(command, front=True)
+            requeued += 1
+        return requeued, superseded
+
+
+class CommandQueue:
+    """Per-device leased command index backed by the control_commands table"""
+
+    def __init__(self, db, lease_seconds=30.0, clock=time.monotonic):
+        self.db = db
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._enqueued = 0
+        self._delivered = 0
+        self._redelivered = 0
+        self._expired = 0
+        self._acked = 0
+        self._superseded = 0
+
+    def _device(self, device_id):
+        commands = self._devices.get(device_id)
+        if commands is None:
+            commands = self._devices[device_id] = DeviceCommands()
+        return commands
+
+    def load(self):
+        """Rebuild the index from unexecuted commands, returning how many were loaded
+
+        Older pending commands for the same actuator (queued before coalescing
+        existed) are superseded by the newest one.
+        """
+        # No ORDER BY: this way only the partial pending index is read, and
+        # the few unexecuted rows are sorted here
+        rows = sorted(self.db.query('''
+            SELECT id, device_id, command_type, device_name, value, timestamp, superseded_count
+            FROM control_commands
+            WHERE executed = FALSE
+        '''))
+        superseded = []
+        with self._lock:
+            self._devices = {}
+            for row in rows:
+                commands = self._device(row[1])
+                older_id = commands.by_name.get(row[3])
+                if older_id is not None:
+                    commands.pop_pending(older_id)
+                    superseded.append((older_id, row[0]))
+                commands.add_pending(command_to_dict(row))
+            self._record_superseded(superseded)
+        return len(rows) - len(superseded)
+
+    def _record_superseded(self, superseded):
+        """Persist (old id, newer id) pairs; called with the lock held"""
+        if not superseded:
+            return
+        with self.db.transaction():
+            self.db.executemany(
+                'UPDATE control_commands SET superseded_by = ?, executed = TRUE WHERE id = ?',
+                [(newer, old) for old, newer in superseded]
+            )
+            self.db.executemany(
+                'UPDATE control_commands SET superseded_count = superseded_count + 1 WHERE id = ?',
+                [(newer,) for _, newer in superseded]
+            )
+        self._superseded += len(superseded)
+
+    def _requeue_expired(self, commands, now):
+        requeued, superseded = commands.requeue_expired(now)
+        self._expired += requeued + len(superseded)
+        self._record_superseded(superseded)
+
+    def enqueue(self, device_id, command_type, device_name, value, timestamp):
+        """Queue a command, coalescing it into a pending one for the same actuator
+
+        Returns its poll payload; payload['superseded'] counts the presses it replaced.
+        """
+        # Holding the lock across the write keeps a poll from leasing the row
+        # while its value is being overwritten
+        with self._lock:
+            commands = self._device(device_id)
+            pending_id = commands.by_name.get(device_name)
+            if pending_id is not None:
+                previous = commands.pending[pending_id]
+                with self.db.transaction():
+                    self.db.execute('''
+                        UPDATE control_commands
+                        SET command_type = ?, value = ?, timestamp = ?,
+                            superseded_count = superseded_count + 1
+                        WHERE id = ?
+                    ''', (command_type, value, timestamp, pending_id))
+                command = command_to_dict((pending_id, device_id, command_type, device_name, value,
+                                           timestamp, previous['superseded'] + 1))
+                commands.pop_pending(pending_id)
+                self._superseded += 1
+            else:
+                with self.db.transaction():
+                    cursor = self.db.execute('''
+                        INSERT INTO control_commands
+                        (device_id, command_type, device_name, value, timestamp)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', (device_id, command_type, device_name, value, timestamp))
+                command = command_to_dict((cursor.lastrowid, device_id, command_type, device_name, value,
+                                           timestamp, 0))
+            # The latest press goes to the back, after the commands queued before it
+            commands.add_pending(command)
+            self._enqueued += 1
+        return command
+
+    def next_expiry(self, device_id):
+        """Seconds until the device's oldest lease runs out, or None without leases"""
+        with self._lock:
+            commands = self._devices.get(device_id)
+            if not commands or not commands.leased:
+                return None
+            deadline, _ = next(iter(commands.leased.values()))
+            return max(0.0, deadline - self.clock())
+
+    def lease(self, device_id, limit=None):
+        """Hand out pending commands (oldest first) under a lease, with their delivery attempt"""
+        now = self.clock()
+        deadline = now + self.lease_seconds
+        leased = []
+        with self._lock:
+            commands = self._devices.get(device_id)
+            if commands is None:
+                return []
+            self._requeue_expired(commands, now)
+            while commands.pending and (limit is None or len(leased) < limit):
+                command = commands.pop_pending()
+                command_id = command['id']
+                commands.leased[command_id] = (deadline, command)
+                attempt = commands.deliveries.get(command_id, 0) + 1
+                commands.deliveries[command_id] = attempt
+                if attempt > 1:
+                    self._redelivered += 1
+                leased.append(dict(command, attempt=attempt))
+            self._delivered += len(leased)
+        return leased
+
+    def ack(self, device_id, command_ids, executed_at):
+        """Mark commands executed, returning the ids that were outstanding for the device"""
+        # Held across the write, as in enqueue, so a press cannot be coalesced
+        # into a requeued row between the check and the update
+        with self._lock:
+            commands = self._devices.get(device_id)
+            if commands is None:
+                return []
+            known = [i for i in command_ids if i in commands.leased or i in commands.pending]
+            if not known:
+                return []
+
+            with self.db.transaction():
+                self.db.execute(f'''
+                    UPDATE control_commands
+                    SET executed = TRUE, execution_time = ?
+                    WHERE device_id = ? AND executed = FALSE AND id IN ({", ".join("?" * len(known))})
+                ''', (executed_at, device_id, *known))
+
+            acked = []
+            for command_id in known:
+                outstanding = commands.leased.pop(command_id, None) or commands.pop_pending(command_id)
+                commands.deliveries.pop(command_id, None)
+                if outstanding is not None:
+                    acked.append(command_id)
+            self._acked += len(acked)
+        return acked
+
+    def stats(self):
+        with self._lock:
+            devices = list(self._devices.values())
+            return {
+                'lease_seconds': self.lease_seconds,
+                'devices': len(devices),
+                'pending': sum(len(d.pending) for d in devices),
+                'leased': sum(len(d.leased) for d in devices),
+                'enqueued': self._enqueued,
+                'delivered': self._delivered,
+                'redelivered': self._redelivered,
+                'leases_expired': self._expired,
+                'acked': self._acked,
+                'superseded': self._superseded
+            }
+
+
+__all__ = ['CommandQueue', 'DeviceCommands', 'command_to_dict']
@@ -0,0 +1,137 @@
+"""
+Server-side chart downsampling for greenhouse history
+
+Implements Largest-Triangle-Three-Buckets (LTTB) with NumPy so a chart can
+cover any time range with a fixed number of points per metric. The bucket
+averages are computed in one vectorised pass; only the point selection walks
+the buckets, since each choice depends on the previous one.
+"""
+
+import datetime
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed for ?points= history requests
+    np = None
+
+from greenhouse_schema import NUMERIC_METRICS as CHART_METRICS, rollup_table
+from greenhouse_window import from_micros
+
+# Rows pulled from the cursor per fetchmany() call
+FETCH_CHUNK_ROWS = 5000
+
+
+def numpy_available():
+    return np is not None
+
+
+def load_history_arrays(db, device_id, since, metrics, chunk_size=FETCH_CHUNK_ROWS):
+    """Stream a device's readings since `since` into column arrays
+
+    Returns (timestamps, x, columns): the original timestamp strings, their
+    unix time as float64 and one float64 array per metric (NULL -> NaN).
+    """
+    cursor = db.execute(f'''
+        SELECT timestamp, (julianday(timestamp) - 2440587.5) * 86400.0, {', '.join(metrics)}
+        FROM greenhouse_data
+        WHERE device_id = ? AND timestamp > ?
+        ORDER BY timestamp ASC
+    ''', (device_id, since))
+
+    timestamps = []
+    chunks = []
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        timestamps.extend(row[0] for row in rows)
+        chunks.append(np.array([row[1:] for row in rows], dtype=np.float64))
+
+    if chunks:
+        values = np.concatenate(chunks)
+    else:
+        values = np.empty((0, len(metrics) + 1), dtype=np.float64)
+
+    columns = {metric: values[:, i + 1] for i, metric in enumerate(metrics)}
+    return timestamps, values[:, 0], columns
+
+
+def load_rollup_arrays(db, tier, width, device_id, since, metrics):
+    """Like load_history_arrays, but one point per rollup bucket (its mean) from a tier"""
+    means = ', '.join(f'{m}_sum / NULLIF({m}_count, 0)' for m in metrics)
+    rows = db.query(f'''
+        SELECT bucket * ?, {means}
+        FROM {rollup_table(tier)}
+        WHERE device_id = ? AND bucket >= CAST(strftime('%s', ?) AS INTEGER) / ?
+        ORDER BY bucket ASC
+    ''', (width, device_id, since, width))
+
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), len(metrics) + 1)
+    timestamps = [
+        datetime.datetime.fromtimestamp(row[0], datetime.timezone.utc).replace(tzinfo=None).isoformat()
+        for row in rows
+    ]
+    columns = {metric: values[:, i + 1] for i, metric in enumerate(metrics)}
+    return timestamps, values[:, 0], columns
+
+
+def window_arrays(times, window_columns, metrics):
+    """load_history_arrays' (timestamps, x, columns) from RecentWindow.series() output"""
+    micros = np.frombuffer(times, dtype=np.int64) if len(times) else np.empty(0, dtype=np.int64)
+    columns = {
+        metric: np.frombuffer(column, dtype=np.float64) if len(column) else np.empty(0, dtype=np.float64)
+        for metric, column in zip(metrics, window_columns)
+    }
+    return [from_micros(m) for m in times], micros / 1e6, columns
+
+
+def lttb_indices(x, y, threshold):
+    """Indices of the points LTTB keeps when reducing (x, y) to `threshold` points"""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # Bucket i (of threshold - 2 inner buckets) spans [starts[i], starts[i + 1])
+    every = (n - 2) / (threshold - 2)
+    starts = (np.floor(np.arange(threshold - 1) * every) + 1).astype(np.int64)
+    starts[-1] = n - 1
+
+    # Average point of every bucket, plus the last point as the final "bucket"
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    ends = np.append(starts[1:], n)
+    lengths = ends - starts
+    avg_x = (cum_x[ends] - cum_x[starts]) / lengths
+    avg_y = (cum_y[ends] - cum_y[starts]) / lengths
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = starts[i], starts[i + 1]
+        ax, ay = x[a], y[a]
+        # Twice the triangle area between a, each candidate and the next bucket's average
+        areas = np.abs((ax - avg_x[i + 1]) * (y[start:end] - ay) - (ax - x[start:end]) * (avg_y[i + 1] - ay))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def downsample_series(timestamps, x, columns, points):
+    """Downsample each metric independently, skipping its NULL readings"""
+    series = {}
+    for metric, y in columns.items():
+        valid = np.flatnonzero(~np.isnan(y))
+        keep = valid[lttb_indices(x[valid], y[valid], points)]
+        series[metric] = {
+            'timestamps': [timestamps[i] for i in keep],
+            'values': y[keep].tolist()
+        }
+    return series
+
+
+__all__ = [
+    'CHART_METRICS', 'numpy_available', 'load_history_arrays', 'load_rollup_arrays',
+    'window_arrays', 'lttb_indices', 'downsample_series'
+]
@@ -0,0 +1,169 @@
+"""
+Incrementally maintained rollups of greenhouse_data
+
+Every stored batch of readings is pre-aggregated in Python per (device,
+bucket) for each tier in ROLLUP_TIERS and merged into the rollup tables with
+one UPSERT per tier, inside the transaction that inserts the raw rows. Reads
+then pick the coarsest tier that still satisfies the requested resolution, so
+a month-long chart touches a few hundred rollup rows instead of every reading.
+"""
+
+import datetime
+
+from greenhouse_schema import NUMERIC_METRICS, READING_COLUMNS, ROLLUP_TIERS, rollup_table, rollup_metric_columns
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_TIMESTAMP_INDEX = READING_COLUMNS.index('timestamp')
+_METRIC_INDEXES = [READING_COLUMNS.index(m) for m in NUMERIC_METRICS]
+
+
+def _upsert_sql(tier):
+    """UPSERT merging a pre-aggregated bucket into an existing rollup row"""
+    updates = []
+    for m in NUMERIC_METRICS:
+        updates += [
+            f'{m}_min = CASE WHEN {m}_min IS NULL OR excluded.{m}_min < {m}_min '
+            f'THEN excluded.{m}_min ELSE {m}_min END',
+            f'{m}_max = CASE WHEN {m}_max IS NULL OR excluded.{m}_max > {m}_max '
+            f'THEN excluded.{m}_max ELSE {m}_max END',
+            f'{m}_sum = COALESCE({m}_sum, 0) + COALESCE(excluded.{m}_sum, 0)',
+            f'{m}_count = {m}_count + excluded.{m}_count',
+            f'{m}_last = CASE WHEN excluded.last_timestamp >= last_timestamp '
+            f'THEN excluded.{m}_last ELSE {m}_last END'
+        ]
+    columns = ['device_id', 'bucket', 'count', 'last_timestamp'] + rollup_metric_columns()
+    # SET expressions all see the old row, so last_timestamp can go last safely
+    return f'''
+        INSERT INTO {rollup_table(tier)} ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))})
+        ON CONFLICT(device_id, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            {', '.join(updates)},
+            last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+    '''
+
+
+UPSERT_ROLLUP_SQL = {tier: _upsert_sql(tier) for tier, _ in ROLLUP_TIERS}
+
+
+def reading_epoch(timestamp):
+    """Whole unix seconds of a stored ISO timestamp (naive, treated as UTC like SQLite does)"""
+    parsed = datetime.datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return int((parsed - _EPOCH).total_seconds() // 1)
+
+
+def _as_float(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def summarise_rows(rows, width):
+    """Aggregate insert tuples into {(device_id, bucket): state} for one tier"""
+    buckets = {}
+    for row in rows:
+        timestamp = row[_TIMESTAMP_INDEX]
+        try:
+            bucket = reading_epoch(timestamp) // width
+        except (TypeError, ValueError):
+            continue  # SQLite's strftime() would give NULL too, so the reading has no bucket
+        key = (row[0], bucket)
+        state = buckets.get(key)
+        if state is None:
+            state = buckets[key] = {
+                'count': 0,
+                'last_timestamp': timestamp,
+                'metrics': [[None, None, None, 0] for _ in NUMERIC_METRICS],
+                'last': [None] * len(NUMERIC_METRICS)
+            }
+        state['count'] += 1
+        values = [_as_float(row[i]) for i in _METRIC_INDEXES]
+        if timestamp >= state['last_timestamp']:
+            state['last_timestamp'] = timestamp
+            state['last'] = values
+        for acc, value in zip(state['metrics'], values):
+            if value is None:
+                continue
+            acc[0] = value if acc[0] is None else min(acc[0], value)
+            acc[1] = value if acc[1] is None else max(acc[1], value)
+            acc[2] = value if acc[2] is None else acc[2] + value
+            acc[3] += 1
+    return buckets
+
+
+def update_rollups(db, rows):
+    """Merge insert tuples into every rollup tier; call inside the insert's transaction"""
+    for tier, width in ROLLUP_TIERS:
+        params = []
+        for (device_id, bucket), state in summarise_rows(rows, width).items():
+            values = [device_id, bucket, state['count'], state['last_timestamp']]
+            for (low, high, total, count), last in zip(state['metrics'], state['last']):
+                values += [low, high, total, count, last]
+            params.append(values)
+        if params:
+            db.executemany(UPSERT_ROLLUP_SQL[tier], params)
+
+
+def pick_tier(resolution_seconds):
+    """Coarsest tier no wider than the requested resolution, or None if raw rows are needed"""
+    for tier, width in ROLLUP_TIERS:
+        if width <= resolution_seconds:
+            return tier, width
+    return None
+
+
+def pick_aggregate_tier(width):
+    """Coarsest tier whose buckets fit exactly inside buckets of `width` seconds"""
+    for tier, tier_width in ROLLUP_TIERS:
+        if tier_width <= width and width % tier_width == 0:
+            return tier, tier_width
+    return None
+
+
+def build_rollup_aggregate_sql(tier, factor, metrics):
+    """Same row layout as greenhouse_aggregate.build_aggregate_sql, read from a rollup tier"""
+    last_columns = ', '.join(f'FIRST_VALUE({m}_last) OVER latest AS latest_{m}' for m in metrics)
+    aggregates = ', '.join(
+        f'MIN({m}_min), MAX({m}_max), SUM({m}_sum) / NULLIF(SUM({m}_count), 0), '
+        f'SUM({m}_count), MAX(latest_{m})'
+        for m in metrics
+    )
+    return f'''
+        SELECT period, SUM(count), {aggregates}
+        FROM (
+            SELECT *, bucket / {factor} AS period, {last_columns}
+            FROM {rollup_table(tier)}
+            WHERE device_id = ? AND bucket >= ? AND bucket < ?
+            WINDOW latest AS (PARTITION BY bucket / {factor} ORDER BY last_timestamp DESC)
+        )
+        GROUP BY period
+        ORDER BY period
+    '''
+
+
+def aggregate_from_rollup(db, device_id, start, end, width, metrics):
+    """Aggregate buckets of `width` seconds covering [start, end) from the coarsest usable tier
+
+    Rollup rows hold whole tier buckets, so the range is widened to whole
+    buckets of `width`. Returns (tier, first_bucket, end_bucket, rows), or None
+    when no tier divides `width`.
+    """
+    picked = pick_aggregate_tier(width)
+    if picked is None:
+        return None
+    tier, tier_width = picked
+    factor = width // tier_width
+    first = reading_epoch(start) // width
+    last = -(-reading_epoch(end) // width)
+    rows = db.query(build_rollup_aggregate_sql(tier, factor, metrics),
+                    (device_id, first * factor, last * factor))
+    return tier, first, last, rows
+
+
+__all__ = [
+    'UPSERT_ROLLUP_SQL', 'reading_epoch', 'summarise_rows', 'update_rollups',
+    'pick_tier', 'pick_aggregate_tier', 'aggregate_from_rollup'
+]
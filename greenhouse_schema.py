@@ -0,0 +1,181 @@
+"""
+Schema migrations for greenhouse_data.db
+
+Each entry is (version, description, statements). The version is stored in
+PRAGMA user_version, so startup only runs the statements of migrations the
+database has not seen yet. Append new migrations; never edit applied ones.
+"""
+
+# Numeric greenhouse_data columns that can be charted and aggregated
+NUMERIC_METRICS = [
+    'temperature', 'humidity', 'ph', 'light_intensity',
+    'water_level', 'soil_moisture', 'wifi_signal'
+]
+
+# NUMERIC_METRICS stored as INTEGER; rollups and the recent window hold them as floats
+INTEGER_METRICS = ['light_intensity', 'water_level', 'soil_moisture', 'wifi_signal']
+
+# greenhouse_data columns in insert order (see INSERT_GREENHOUSE_DATA_SQL)
+READING_COLUMNS = [
+    'device_id', 'timestamp', 'temperature', 'humidity', 'ph', 'light_intensity',
+    'water_level', 'water_status', 'soil_moisture', 'curtain_status', 'pump_status',
+    'fan_status', 'mode', 'wifi_status', 'ip_address', 'wifi_signal'
+]
+
+# Rollup tiers, coarsest first: (name, bucket width in seconds)
+ROLLUP_TIERS = [('1d', 86400), ('1h', 3600), ('1m', 60)]
+
+# Per-metric columns kept in every rollup table
+ROLLUP_METRIC_SUFFIXES = ['min', 'max', 'sum', 'count', 'last']
+
+def rollup_table(tier):
+    return f'greenhouse_rollup_{tier}'
+
+def rollup_metric_columns():
+    return [f'{m}_{suffix}' for m in NUMERIC_METRICS for suffix in ROLLUP_METRIC_SUFFIXES]
+
+def _create_rollup_sql(tier):
+    metric_columns = ',\n'.join(
+        f'{m}_min REAL, {m}_max REAL, {m}_sum REAL, {m}_count INTEGER NOT NULL DEFAULT 0, {m}_last REAL'
+        for m in NUMERIC_METRICS
+    )
+    return f'''
+        CREATE TABLE IF NOT EXISTS {rollup_table(tier)} (
+            device_id TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            last_timestamp TEXT NOT NULL,
+            {metric_columns},
+            PRIMARY KEY (device_id, bucket)
+        ) WITHOUT ROWID
+    '''
+
+def _backfill_rollup_from_raw_sql(tier, width):
+    """Fill a rollup tier from every existing raw reading"""
+    last_columns = ', '.join(f'FIRST_VALUE({m}) OVER latest AS last_{m}' for m in NUMERIC_METRICS)
+    aggregates = ', '.join(
+        f'MIN({m}), MAX({m}), SUM({m}), COUNT({m}), MAX(last_{m})' for m in NUMERIC_METRICS
+    )
+    return f'''
+        INSERT OR REPLACE INTO {rollup_table(tier)}
+        (device_id, bucket, count, last_timestamp, {', '.join(rollup_metric_columns())})
+        SELECT device_id, period, COUNT(*), MAX(timestamp), {aggregates}
+        FROM (
+            SELECT device_id, timestamp, {', '.join(NUMERIC_METRICS)},
+                   CAST(strftime('%s', timestamp) AS INTEGER) / {width} AS period,
+                   {last_columns}
+            FROM greenhouse_data
+            WINDOW latest AS (
+                PARTITION BY device_id, CAST(strftime('%s', timestamp) AS INTEGER) / {width}
+                ORDER BY timestamp DESC
+            )
+        )
+        GROUP BY device_id, period
+    '''
+
+def _backfill_rollup_from_tier_sql(tier, width, source_tier, source_width):
+    """Fill a coarser rollup tier from a finer one"""
+    factor = width // source_width
+    last_columns = ', '.join(f'FIRST_VALUE({m}_last) OVER latest AS latest_{m}' for m in NUMERIC_METRICS)
+    aggregates = ', '.join(
+        f'MIN({m}_min), MAX({m}_max), SUM({m}_sum), SUM({m}_count), MAX(latest_{m})'
+        for m in NUMERIC_METRICS
+    )
+    return f'''
+        INSERT OR REPLACE INTO {rollup_table(tier)}
+        (device_id, bucket, count, last_timestamp, {', '.join(rollup_metric_columns())})
+        SELECT device_id, period, SUM(count), MAX(last_timestamp), {aggregates}
+        FROM (
+            SELECT *, bucket / {factor} AS period, {last_columns}
+            FROM {rollup_table(source_tier)}
+            WINDOW latest AS (PARTITION BY device_id, bucket / {factor} ORDER BY last_timestamp DESC)
+        )
+        GROUP BY device_id, period
+    '''
+
+def _rollup_migration_statements():
+    (day, day_width), (hour, hour_width), (minute, minute_width) = ROLLUP_TIERS
+    return [_create_rollup_sql(tier) for tier, _ in ROLLUP_TIERS] + [
+        _backfill_rollup_from_raw_sql(minute, minute_width),
+        _backfill_rollup_from_tier_sql(hour, hour_width, minute, minute_width),
+        _backfill_rollup_from_tier_sql(day, day_width, hour, hour_width)
+    ]
+
+GREENHOUSE_MIGRATIONS = [
+    (1, 'base tables', [
+        # Greenhouse sensor data table
+        '''
+        CREATE TABLE IF NOT EXISTS greenhouse_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            temperature REAL,
+            humidity REAL,
+            ph REAL,
+            light_intensity INTEGER,
+            water_level INTEGER,
+            water_status TEXT,
+            soil_moisture INTEGER,
+            curtain_status TEXT,
+            pump_status TEXT,
+            fan_status TEXT,
+            mode TEXT,
+            wifi_status TEXT,
+            ip_address TEXT,
+            wifi_signal INTEGER
+        )
+        ''',
+        # Device control commands table
+        '''
+        CREATE TABLE IF NOT EXISTS control_commands (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            command_type TEXT NOT NULL,
+            device_name TEXT NOT NULL,
+            value TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            executed BOOLEAN DEFAULT FALSE,
+            execution_time TEXT
+        )
+        ''',
+        # Device registration table
+        '''
+        CREATE TABLE IF NOT EXISTS registered_devices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT UNIQUE NOT NULL,
+            device_type TEXT NOT NULL,
+            ip_address TEXT,
+            capabilities TEXT,
+            last_seen TEXT,
+            status TEXT DEFAULT 'online'
+        )
+        '''
+    ]),
+    (2, 'time-series and pending-command indexes', [
+        # History queries: WHERE device_id = ? AND timestamp > ? ORDER BY timestamp DESC
+        '''
+        CREATE INDEX IF NOT EXISTS idx_greenhouse_data_device_time
+        ON greenhouse_data (device_id, timestamp)
+        ''',
+        # Command polls only ever look at the (small) set of pending commands
+        '''
+        CREATE INDEX IF NOT EXISTS idx_control_commands_pending
+        ON control_commands (device_id, timestamp)
+        WHERE executed = FALSE
+        '''
+    ]),
+    (3, 'minute/hour/day rollup tables', _rollup_migration_statements()),
+    (4, 'command coalescing columns', [
+        # Presses folded into this command while it was still pending
+        'ALTER TABLE control_commands ADD COLUMN superseded_count INTEGER NOT NULL DEFAULT 0',
+        # Set on a leased command whose lease ran out after a newer one was queued
+        'ALTER TABLE control_commands ADD COLUMN superseded_by INTEGER'
+    ]),
+    (5, 'close superseded commands', [
+        # Superseded commands are never delivered again; take them out of the
+        # pending index (execution_time stays NULL: they never ran)
+        'UPDATE control_commands SET executed = TRUE WHERE executed = FALSE AND superseded_by IS NOT NULL'
+    ])
+]
+
+SCHEMA_VERSION = GREENHOUSE_MIGRATIONS[-1][0]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Terraponix Greenhouse Device Simulator
+Posts readings from one or more simulated ESP32 devices, as JSON or in the
+compact binary format (greenhouse_binary.py), and reports bytes per reading.
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+import requests
+
+from greenhouse_binary import READING_MIMETYPE, encode_reading
+
+
+def generate_reading(device_id, index):
+    """Realistic reading for one device, matching the firmware's JSON fields"""
+    return {
+        "device_id": device_id,
+        "temperature": round(random.uniform(20.0, 35.0), 1),
+        "humidity": round(random.uniform(40.0, 80.0), 1),
+        "ph": round(random.uniform(6.0, 8.0), 2),
+        "light_intensity": random.randint(100, 4000),
+        "water_level": random.randint(500, 2000),
+        "water_status": random.choice(["OK", "LOW"]),
+        "soil_moisture": random.randint(20, 90),
+        "curtain_status": random.choice(["OPEN", "CLOSED"]),
+        "pump_status": random.choice(["ON", "OFF"]),
+        "fan_status": random.choice(["ON", "OFF"]),
+        "mode": random.choice(["AUTO", "MANUAL"]),
+        "wifi_status": "CONNECTED",
+        "ip_address": f"192.168.1.{100 + index}",
+        "wifi_signal": random.randint(-80, -30)
+    }
+
+
+def build_request(readings, data_format, taken_at=None):
+    """(url suffix, body, headers) for one reading, or a batch when len(readings) > 1
+
+    taken_at, for a batch, lists each buffered reading's capture time (unix seconds).
+    """
+    batch = len(readings) > 1
+    suffix = '/api/greenhouse-data/batch' if batch else '/api/greenhouse-data'
+    times = taken_at if batch and taken_at is not None else [None] * len(readings)
+    if data_format == 'binary':
+        body = b''.join(encode_reading(r, t) for r, t in zip(readings, times))
+        return suffix, body, {'Content-Type': READING_MIMETYPE}
+
+    if batch:
+        readings = [r if t is None else dict(r, timestamp=datetime.fromtimestamp(t).isoformat())
+                    for r, t in zip(readings, times)]
+        body = json.dumps({'readings': readings})
+    else:
+        body = json.dumps(readings[0])
+    return suffix, body.encode('utf-8'), {'Content-Type': 'application/json'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate greenhouse ESP32 devices')
+    parser.add_argument('--url', default='http://localhost:5000', help='Greenhouse API base URL')
+    parser.add_argument('--devices', type=int, default=1, help='Number of simulated devices')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between rounds')
+    parser.add_argument('--count', type=int, default=10, help='Rounds to send (0 = forever)')
+    parser.add_argument('--format', choices=['json', 'binary'], default='json', dest='data_format',
+                        help='Payload encoding')
+    parser.add_argument('--batch', type=int, default=1,
+                        help='Readings buffered per device before posting to the batch endpoint')
+    args = parser.parse_args()
+
+    base_url = args.url.rstrip('/')
+    device_ids = [f"sim_greenhouse_{i + 1:02d}" for i in range(args.devices)]
+    # Buffered (capture time, reading) pairs per device
+    pending = {device_id: [] for device_id in device_ids}
+
+    print("🌱 Terraponix Greenhouse Simulator")
+    print(f"📡 Server: {base_url}")
+    print(f"🔧 Devices: {args.devices}, format: {args.data_format}, batch: {args.batch}")
+
+    sent_bytes = 0
+    sent_readings = 0
+    errors = 0
+    round_number = 0
+    try:
+        while args.count == 0 or round_number < args.count:
+            round_number += 1
+            for index, device_id in enumerate(device_ids):
+                pending[device_id].append((int(time.time()), generate_reading(device_id, index)))
+                if len(pending[device_id]) < args.batch:
+                    continue
+
+                buffered, pending[device_id] = pending[device_id], []
+                taken_at = [taken for taken, _ in buffered]
+                readings = [reading for _, reading in buffered]
+                suffix, body, headers = build_request(readings, args.data_format, taken_at)
+                try:
+                    response = requests.post(base_url + suffix, data=body, headers=headers, timeout=5)
+                except requests.RequestException as e:
+                    errors += 1
+                    print(f"❌ {device_id}: {e}")
+                    continue
+
+                if response.status_code == 200:
+                    sent_bytes += len(body)
+                    sent_readings += len(readings)
+                else:
+                    errors += 1
+                    print(f"❌ {device_id}: HTTP {response.status_code} {response.text[:200]}")
+
+            if sent_readings:
+                print(f"✅ Round {round_number}: {sent_readings} readings, "
+                      f"{sent_bytes / sent_readings:.1f} bytes/reading")
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\n👋 Simulator stopped")
+
+    print("\n📊 Summary")
+    print(f"   Readings sent: {sent_readings}")
+    print(f"   Payload bytes: {sent_bytes}")
+    if sent_readings:
+        print(f"   Bytes per reading ({args.data_format}): {sent_bytes / sent_readings:.1f}")
+    print(f"   Errors: {errors}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+In-memory recent window of greenhouse readings
+
+Each device gets a fixed-capacity ring buffer of typed columns: an
+array('q') of epoch microseconds plus one array('d') per numeric metric (NULL
+stored as NaN). The buffer is filled as readings are stored and warmed from
+SQLite at startup, so short-window history and aggregate requests never touch
+the database. Memory per device is capped at capacity * 8 * (1 + metrics) bytes.
+
+A buffer only answers a query when it provably holds every reading of the
+range: `floor` is the newest timestamp it may be missing (the warm-up cutoff
+or the newest evicted reading), and ranges starting after it are complete.
+"""
+
+import bisect
+import datetime
+import math
+import threading
+from array import array
+
+from greenhouse_schema import NUMERIC_METRICS as WINDOW_METRICS, READING_COLUMNS, rollup_table
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_TIMESTAMP_INDEX = READING_COLUMNS.index('timestamp')
+_METRIC_INDEXES = [READING_COLUMNS.index(m) for m in WINDOW_METRICS]
+
+# Nothing is covered until the window has been warmed
+_NOT_WARMED = 2 ** 63 - 1
+
+
+def to_micros(timestamp):
+    """Epoch microseconds of a stored ISO timestamp (naive, treated as UTC like SQLite does)"""
+    parsed = datetime.datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return (parsed - _EPOCH) // _MICROSECOND
+
+
+def from_micros(micros):
+    """Inverse of to_micros, giving back the stored ISO string"""
+    return (_EPOCH + micros * _MICROSECOND).isoformat()
+
+
+def _as_float(value):
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class DeviceWindow:
+    """Ring buffer of one device's most recent readings"""
+
+    def __init__(self, capacity, max_age_us, floor):
+        self.capacity = capacity
+        self.max_age_us = max_age_us
+        self.floor = floor
+        self.times = array('q', bytes(8 * capacity))
+        self.columns = [array('d', bytes(8 * capacity)) for _ in WINDOW_METRICS]
+        self.start = 0
+        self.size = 0
+        self.newest = None
+        self.ordered = True  # False once a late reading lands out of order
+        self.lock = threading.Lock()
+
+    def _evict_oldest(self):
+        self.floor = max(self.floor, self.times[self.start])
+        self.start = (self.start + 1) % self.capacity
+        self.size -= 1
+
+    def append(self, micros, values):
+        """Add a reading, returning False if it is older than the buffer's floor"""
+        with self.lock:
+            if micros <= self.floor:
+                return False
+            if self.size == self.capacity:
+                self._evict_oldest()
+
+            position = (self.start + self.size) % self.capacity
+            self.times[position] = micros
+            for column, value in zip(self.columns, values):
+                column[position] = value
+            self.size += 1
+
+            if self.newest is None or micros >= self.newest:
+                self.newest = micros
+            else:
+                self.ordered = False
+
+            # Keep only the last max_age_us of readings
+            while self.size and self.times[self.start] < self.newest - self.max_age_us:
+                self._evict_oldest()
+            return True
+
+    def _logical(self, column):
+        """Column contents from oldest to newest insertion"""
+        end = self.start + self.size
+        if end <= self.capacity:
+            return column[self.start:end]
+        return column[self.start:] + column[:end - self.capacity]
+
+    def snapshot(self, lo, hi, metric_indexes):
+        """Copy readings with lo <= time < hi, sorted by time, or None if the range is incomplete"""
+        with self.lock:
+            if lo <= self.floor:
+                return None
+            times = self._logical(self.times)
+            columns = [self._logical(self.columns[i]) for i in metric_indexes]
+            ordered = self.ordered
+
+        if not ordered:
+            order = sorted(range(len(times)), key=times.__getitem__)
+            times = array('q', (times[i] for i in order))
+            columns = [array('d', (column[i] for i in order)) for column in columns]
+
+        first = bisect.bisect_left(times, lo)
+        last = bisect.bisect_left(times, hi) if hi is not None else len(times)
+        return times[first:last], [column[first:last] for column in columns]
+
+
+class RecentWindow:
+    """Per-device DeviceWindow buffers with a shared size limit"""
+
+    def __init__(self, hours, capacity):
+        self.hours = hours
+        self.capacity = capacity
+        self.max_age_us = int(hours * 3600 * 1_000_000)
+        self._floor = _NOT_WARMED
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self):
+        return self.hours > 0 and self.capacity > 0
+
+    def _device(self, device_id):
+        window = self._devices.get(device_id)
+        if window is None:
+            with self._lock:
+                window = self._devices.get(device_id)
+                if window is None:
+                    window = self._devices[device_id] = DeviceWindow(self.capacity, self.max_age_us, self._floor)
+        return window
+
+    def append_rows(self, rows):
+        """Add greenhouse_data insert tuples to their devices' buffers"""
+        if not self.enabled:
+            return
+        for row in rows:
+            try:
+                micros = to_micros(row[_TIMESTAMP_INDEX])
+            except (TypeError, ValueError):
+                continue
+            self._device(row[0]).append(micros, [_as_float(row[i]) for i in _METRIC_INDEXES])
+
+    def warm(self, db, now):
+        """Load the last `hours` of readings for every recently active device"""
+        if not self.enabled:
+            return 0
+        cutoff = (now - datetime.timedelta(hours=self.hours)).isoformat()
+        cutoff_micros = to_micros(cutoff)
+        devices = [row[0] for row in db.query(f'''
+            SELECT DISTINCT device_id FROM {rollup_table('1h')}
+            WHERE bucket >= CAST(strftime('%s', ?) AS INTEGER) / 3600
+        ''', (cutoff,))]
+
+        loaded = 0
+        with self._lock:
+            self._floor = cutoff_micros
+        for device_id in devices:
+            rows = db.query(f'''
+                SELECT timestamp, {', '.join(WINDOW_METRICS)}
+                FROM greenhouse_data
+                WHERE device_id = ? AND timestamp > ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (device_id, cutoff, self.capacity))
+            floor = cutoff_micros
+            if len(rows) == self.capacity:
+                # Older readings in the window did not fit
+                floor = max(floor, to_micros(rows[-1][0]))
+            window = DeviceWindow(self.capacity, self.max_age_us, floor)
+            for row in reversed(rows):
+                try:
+                    window.append(to_micros(row[0]), [_as_float(v) for v in row[1:]])
+                except (TypeError, ValueError):
+                    continue
+            with self._lock:
+                self._devices[device_id] = window
+            loaded += window.size
+        return loaded
+
+    def series(self, device_id, lo, hi, metrics):
+        """(times, columns) for lo <= time < hi (epoch microseconds), or None on a miss"""
+        snapshot = None
+        if self.enabled:
+            window = self._devices.get(device_id)
+            if window is not None:
+                snapshot = window.snapshot(lo, hi, [WINDOW_METRICS.index(m) for m in metrics])
+            elif lo > self._floor:
+                # No buffer means no readings since the warm-up cutoff
+                snapshot = array('q'), [array('d') for _ in metrics]
+        with self._lock:
+            if snapshot is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+        return snapshot
+
+    def stats(self):
+        with self._lock:
+            devices = list(self._devices.values())
+            hits, misses = self._hits, self._misses
+        return {
+            'enabled': self.enabled,
+            'window_hours': self.hours,
+            'capacity_per_device': self.capacity,
+            'devices': len(devices),
+            'readings': sum(w.size for w in devices),
+            'bytes_per_device': self.capacity * 8 * (1 + len(WINDOW_METRICS)),
+            'hits': hits,
+            'misses': misses
+        }
+
+
+def aggregate_window(times, columns, width, metrics):
+    """Bucket rows in the greenhouse_aggregate.format_bucket_rows layout from window columns"""
+    rows = []
+    bucket = None
+    for position, micros in enumerate(times):
+        current = (micros // 1_000_000) // width
+        if current != bucket:
+            bucket = current
+            row = [bucket, 0]
+            for _ in metrics:
+                row += [None, None, 0.0, 0, None]
+            rows.append(row)
+        row[1] += 1
+        for i, column in enumerate(columns):
+            value = column[position]
+            offset = 2 + i * 5
+            # Rows are time-ordered, so the latest reading's value wins "last"
+            row[offset + 4] = None if math.isnan(value) else value
+            if math.isnan(value):
+                continue
+            row[offset] = value if row[offset] is None else min(row[offset], value)
+            row[offset + 1] = value if row[offset + 1] is None else max(row[offset + 1], value)
+            row[offset + 2] += value
+            row[offset + 3] += 1
+
+    for row in rows:
+        for i in range(len(metrics)):
+            offset = 2 + i * 5
+            count = row[offset + 3]
+            row[offset + 2] = row[offset + 2] / count if count else None
+    return rows
+
+
+__all__ = [
+    'WINDOW_METRICS', 'to_micros', 'from_micros', 'DeviceWindow', 'RecentWindow', 'aggregate_window'
+]
@@ -2,30 +2,38 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 import json
 import datetime
-import sqlite3
 import threading
 import time
 
+from backend.sqlite_pool import SQLitePool
+from backend.json_stream import STREAM_FORMATS, streaming_response
+from backend.pagination import SEEK_BEFORE_SQL, decode_cursor, split_page
+
 app = Flask(__name__)
 CORS(app)  # Mengizinkan cross-origin requests
 
+# Pool koneksi SQLite bersama (satu koneksi per thread)
+db = SQLitePool('sensor_data.db')
+
 # Database untuk menyimpan data sensor
 def init_db():
-    conn = sqlite3.connect('sensor_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_readings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            sensor_id TEXT NOT NULL,
-            sensor_type TEXT NOT NULL,
-            value REAL NOT NULL,
-            unit TEXT,
-            timestamp TEXT NOT NULL,
-            status TEXT DEFAULT 'active'
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with db.transaction():
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS sensor_readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sensor_id TEXT NOT NULL,
+                sensor_type TEXT NOT NULL,
+                value REAL NOT NULL,
+                unit TEXT,
+                timestamp TEXT NOT NULL,
+                status TEXT DEFAULT 'active'
+            )
+        ''')
+        # Index untuk riwayat per sensor (dan pagination dengan cursor)
+        db.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sensor_readings_sensor_time
+            ON sensor_readings (sensor_id, timestamp)
+        ''')
 
 # Inisialisasi database saat startup
 init_db()
@@ -113,14 +121,11 @@ def receive_sensor_data():
             connected_sensors[sensor_id]['status'] = 'active'
         
         # Simpan ke database
-        conn = sqlite3.connect('sensor_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO sensor_readings (sensor_id, sensor_type, value, unit, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (sensor_id, sensor_type, value, unit, timestamp))
-        conn.commit()
-        conn.close()
+        with db.transaction():
+            db.execute('''
+                INSERT INTO sensor_readings (sensor_id, sensor_type, value, unit, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (sensor_id, sensor_type, value, unit, timestamp))
         
         return jsonify({
             'status': 'success',
@@ -172,40 +177,67 @@ def get_all_sensors():
             'message': str(e)
         }), 500
 
+def reading_row_to_dict(row):
+    """Ubah baris sensor_readings menjadi dictionary untuk API"""
+    return {
+        'id': row[0],
+        'sensor_id': row[1],
+        'sensor_type': row[2],
+        'value': row[3],
+        'unit': row[4],
+        'timestamp': row[5],
+        'status': row[6]
+    }
+
 @app.route('/api/sensor/history/<sensor_id>', methods=['GET'])
 def get_sensor_history(sensor_id):
     """Endpoint untuk mendapatkan riwayat data sensor"""
     try:
         limit = request.args.get('limit', 100, type=int)
         
-        conn = sqlite3.connect('sensor_data.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        # Pagination keyset: ?cursor= melanjutkan setelah baris terakhir halaman sebelumnya
+        seek_sql, seek_params = '', ()
+        if request.args.get('cursor'):
+            try:
+                seek_params = decode_cursor(request.args['cursor'])
+            except ValueError as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': str(e)
+                }), 400
+            seek_sql = f'AND {SEEK_BEFORE_SQL}'
+        
+        history_sql = f'''
             SELECT * FROM sensor_readings 
-            WHERE sensor_id = ? 
-            ORDER BY timestamp DESC 
+            WHERE sensor_id = ? {seek_sql}
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
-        ''', (sensor_id, limit))
+        '''
+        params = (sensor_id, *seek_params)
         
-        rows = cursor.fetchall()
-        conn.close()
+        # Mode streaming: baris dikirim sambil dibaca, untuk limit yang besar
+        stream_format = request.args.get('stream')
+        if stream_format is not None:
+            if stream_format not in STREAM_FORMATS:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'stream harus salah satu dari: {", ".join(STREAM_FORMATS)}'
+                }), 400
+            return streaming_response(
+                db.iter_query(history_sql, params + (limit,)), reading_row_to_dict, stream_format,
+                {'status': 'success'}, 'data'
+            )
         
-        history = []
-        for row in rows:
-            history.append({
-                'id': row[0],
-                'sensor_id': row[1],
-                'sensor_type': row[2],
-                'value': row[3],
-                'unit': row[4],
-                'timestamp': row[5],
-                'status': row[6]
-            })
+        # Satu baris tambahan untuk mengetahui apakah masih ada halaman berikutnya
+        rows = db.query(history_sql, params + (limit + 1 if limit >= 0 else limit,))
+        rows, next_cursor = split_page(rows, limit, timestamp_index=5)
+        history = [reading_row_to_dict(row) for row in rows]
         
         return jsonify({
             'status': 'success',
             'data': history,
-            'total_records': len(history)
+            'total_records': len(history),
+            'next_cursor': next_cursor
         })
         
     except Exception as e:
@@ -245,6 +277,15 @@ def get_api_status():
             'message': str(e)
         }), 500
 
+@app.route('/api/db/stats', methods=['GET'])
+def get_db_stats():
+    """Endpoint untuk statistik pool koneksi dan cache statement SQLite"""
+    return jsonify({
+        'status': 'success',
+        'timestamp': datetime.datetime.now().isoformat(),
+        'database': db.stats()
+    })
+
 if __name__ == '__main__':
     print("🚀 Starting Sensor API Server...")
     print("📡 API akan berjalan di: http://0.0.0.0:5000")
@@ -257,5 +298,7 @@ if __name__ == '__main__':
     print("   - GET  /api/sensors/all      : Ambil semua data sensor")
     print("   - GET  /api/sensor/history/<id> : Riwayat data sensor")
     print("   - GET  /api/sensor/status    : Status konektivitas")
+    print("   - GET  /api/db/stats         : Statistik pool database")
+    print("💡 Produksi: python backend/run_server.py --app sensor")
     
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file